@@ -0,0 +1,168 @@
+import re
+import threading
+
+# Обозначения адресных элементов: полные и сокращенные формы -> каноническая
+DESIGNATORS = {
+    'улица': 'ул', 'ул': 'ул',
+    'проспект': 'пр', 'просп': 'пр', 'пр-т': 'пр', 'пр-кт': 'пр', 'пр': 'пр',
+    'переулок': 'пер', 'пер': 'пер',
+    'шоссе': 'ш', 'ш': 'ш',
+    'бульвар': 'б-р', 'бульв': 'б-р', 'б-р': 'б-р',
+    'площадь': 'пл', 'пл': 'пл',
+    'набережная': 'наб', 'наб': 'наб',
+    'проезд': 'пр-д', 'пр-д': 'пр-д',
+    'микрорайон': 'мкр', 'мкр': 'мкр',
+    'город': 'г', 'г': 'г',
+    'дом': 'д', 'д': 'д',
+    'корпус': 'к', 'корп': 'к', 'к': 'к',
+    'строение': 'стр', 'стр': 'стр',
+    'квартира': 'кв', 'кв': 'кв',
+    'подъезд': 'под', 'парадная': 'под', 'под': 'под',
+}
+
+_TOKEN = re.compile(r'[а-яa-z]+(?:-[а-яa-z]+)*|\d+')
+
+# Минимальная похожесть (коэффициент Дайса по триграммам) для нечеткого совпадения
+FUZZY_THRESHOLD = 0.5
+
+
+def _words(address):
+    text = (address or '').lower().replace('ё', 'е')
+    return _TOKEN.findall(text)
+
+
+def address_tokens(address):
+    """Значимые слова адреса для поиска: без обозначений (ул., д., корп., ...).
+
+    «ул. Ленина, д. 5к2», «Ленина улица дом 5 корп 2» -> ['ленина', '5', '2']
+    """
+    return [word for word in _words(address) if word not in DESIGNATORS]
+
+
+def normalize_address(address):
+    """Нормализованный адрес: нижний регистр, ё -> е, обозначения в краткой форме.
+
+    «Улица Лёнина, дом 5, корпус 2» и «ул. Ленина д.5 к.2» -> «ул ленина д 5 к 2»
+    """
+    return ' '.join(DESIGNATORS.get(word, word) for word in _words(address))
+
+
+def address_matches(address, query):
+    """Каждое слово запроса — начало какого-либо слова адреса"""
+    tokens = address_tokens(address)
+    return all(any(token.startswith(word) for token in tokens) for word in address_tokens(query))
+
+
+def is_duplicate(first, second, threshold=0.7):
+    """Похоже на один и тот же дом: номера совпадают, названия похожи (допускаются опечатки)"""
+    first, second = address_tokens(first), address_tokens(second)
+    if [word for word in first if word.isdigit()] != [word for word in second if word.isdigit()]:
+        return False
+    names = _trigrams([word for word in first if not word.isdigit()]), \
+        _trigrams([word for word in second if not word.isdigit()])
+    if not names[0] or not names[1]:
+        return names[0] == names[1]
+    return 2 * len(names[0] & names[1]) / (len(names[0]) + len(names[1])) >= threshold
+
+
+def _trigrams(tokens):
+    grams = set()
+    for token in tokens:
+        padded = f' {token} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def similarity(first, second):
+    """Похожесть двух адресов по триграммам от 0 до 1"""
+    first, second = _trigrams(address_tokens(first)), _trigrams(address_tokens(second))
+    if not first or not second:
+        return 0.0
+    return 2 * len(first & second) / (len(first) + len(second))
+
+
+class AddressIndex:
+    """Поисковый индекс адресов задач: префиксы слов и триграммы.
+
+    Префиксный индекс находит адреса, в которых каждое слово запроса является
+    началом слова адреса («лен 5» -> «ул. Ленина, д. 5»); триграммный — похожие
+    адреса с опечатками («ленена 5»). Обновляется по одной задаче.
+    """
+
+    def __init__(self, records=()):
+        self.tokens = {}
+        self.trigrams = {}
+        self.by_prefix = {}
+        self.by_trigram = {}
+        self._lock = threading.Lock()
+        for record in records:
+            self.add(record['id'], record.get('address'))
+
+    def add(self, record_id, address):
+        tokens = address_tokens(address)
+        grams = _trigrams(tokens)
+        with self._lock:
+            self._remove(record_id)
+            self.tokens[record_id] = tokens
+            self.trigrams[record_id] = grams
+            for token in tokens:
+                for length in range(1, len(token) + 1):
+                    self.by_prefix.setdefault(token[:length], set()).add(record_id)
+            for gram in grams:
+                self.by_trigram.setdefault(gram, set()).add(record_id)
+
+    def remove(self, record_id):
+        with self._lock:
+            self._remove(record_id)
+
+    def _remove(self, record_id):
+        tokens = self.tokens.pop(record_id, None)
+        if tokens is None:
+            return
+        for token in tokens:
+            for length in range(1, len(token) + 1):
+                self._discard(self.by_prefix, token[:length], record_id)
+        for gram in self.trigrams.pop(record_id):
+            self._discard(self.by_trigram, gram, record_id)
+
+    @staticmethod
+    def _discard(index, key, record_id):
+        ids = index.get(key)
+        if ids is not None:
+            ids.discard(record_id)
+            if not ids:
+                del index[key]
+
+    def prefix_ids(self, query):
+        """id задач, в адресе которых есть начало каждого слова запроса"""
+        words = address_tokens(query)
+        if not words:
+            return set()
+        with self._lock:
+            sets = sorted((self.by_prefix.get(word, set()) for word in words), key=len)
+            return set(sets[0]).intersection(*sets[1:])
+
+    def search(self, query, limit=20, threshold=FUZZY_THRESHOLD):
+        """Лучшие совпадения: [(id, оценка)], по убыванию оценки (limit=None — все).
+
+        Совпадения по префиксам всех слов идут первыми (оценка 1 + похожесть),
+        затем нечеткие совпадения по триграммам с похожестью не ниже threshold.
+        """
+        grams = _trigrams(address_tokens(query))
+        if not grams:
+            return []
+        exact = self.prefix_ids(query)
+        with self._lock:
+            common = {}
+            for gram in grams:
+                for record_id in self.by_trigram.get(gram, ()):
+                    common[record_id] = common.get(record_id, 0) + 1
+            scores = {}
+            for record_id in exact.union(common):
+                score = 2 * common.get(record_id, 0) / (len(grams) + len(self.trigrams[record_id]))
+                if record_id in exact:
+                    scores[record_id] = 1 + score
+                elif score >= threshold:
+                    scores[record_id] = score
+        results = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return results if limit is None else results[:limit]
@@ -1,21 +1,53 @@
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify, flash
-from werkzeug.utils import secure_filename
-from werkzeug.security import check_password_hash
+from flask import (Blueprint, Flask, current_app, render_template, request, redirect, url_for, session, jsonify,
+                   flash, make_response, Response, abort, send_file, g, stream_with_context)
+from flask.wrappers import Request
+from werkzeug.local import LocalProxy
+from werkzeug.middleware.proxy_fix import ProxyFix
 import os
 import json
-from datetime import datetime
-import pandas as pd
+import base64
+import math
+import mimetypes
+import hashlib
+import uuid
+from datetime import datetime, timezone
 import logging
-from data_manager import DataManager
-from config import USERS, SECRET_KEY, UPLOADS_DIR, WORK_TYPES, TASK_STATUSES, BRIGADE_STATUSES
+from credentials import CredentialStore
+from data_manager import DataManager, ANY, task_matches
+from events import ChangeBroadcaster, format_event
+from json_stream import negotiate_encoding, stream_json
+from jobs import JobQueue, JobWorkers
+from photos import HASHED_NAME, PhotoError, check_photo, ensure_thumbnail, photo_exists, photo_name, photo_path, receive_photo
+from report_jobs import make_handlers
+from uploads import IncompleteUploads, UploadError, UploadSessions
+from rate_limit import create_login_throttle
+from config import (USERS, SECRET_KEY, UPLOADS_DIR, WORK_TYPES, TASK_STATUSES, BRIGADE_STATUSES,
+                    CREDENTIALS_PATH, LOGIN_USER_BURST, LOGIN_USER_REFILL, LOGIN_IP_BURST, LOGIN_IP_REFILL,
+                    LOGIN_MAX_BACKOFF, LOGIN_TRUSTED_FOR, LOGIN_THROTTLE_STORE, LOGIN_THROTTLE_PATH,
+                    TRUSTED_PROXIES, PHOTOS_DIR, PHOTO_THUMBNAILS, JOBS_DB_PATH, JOB_WORKERS,
+                    WEB_GRACEFUL_TIMEOUT, MEDIA_MAX_AGE, MEDIA_SENDFILE, MEDIA_ACCEL_PREFIX,
+                    PHOTO_MAX_FILE_SIZE, REPORT_MAX_PHOTOS, REPORT_MAX_UPLOAD_SIZE, SSE_MAX_CONNECTIONS,
+                    BOT_TOKEN, STORAGE_BACKEND, UPLOAD_SESSIONS_DIR)
+
+class AppRequest(Request):
+    """Запрос, предел тела которого вью может поднять: request.max_content_length = ...
+
+    Во Flask 3.0 это свойство только читает MAX_CONTENT_LENGTH из конфигурации.
+    Новый предел действует, если задан до чтения request.form/files/stream.
+    """
+
+    _max_content_length = None
+
+    @property
+    def max_content_length(self):
+        if self._max_content_length is not None:
+            return self._max_content_length
+        return super().max_content_length
+
+    @max_content_length.setter
+    def max_content_length(self, value):
+        self._max_content_length = value
 
-app = Flask(__name__)
-app.secret_key = SECRET_KEY
-app.config['UPLOAD_FOLDER'] = UPLOADS_DIR
-app.config['MAX_CONTENT_LENGTH'] = 4 * 1024 * 1024  # 4MB max file size (уменьшено для стабильности)
-app.config['SESSION_COOKIE_SECURE'] = False  # Установите True при использовании HTTPS
-app.config['SESSION_COOKIE_HTTPONLY'] = True
-app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
 
 # Настройка логирования
 logging.basicConfig(
@@ -27,9 +59,52 @@ logging.basicConfig(
     ]
 )
 
-dm = DataManager()
 
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+class AppServices:
+    """Объекты одного приложения: данные, учетные данные, очередь заданий и ее
+    исполнители, сессии загрузки, ограничитель входа и рассылка событий"""
+
+    def __init__(self, config):
+        self.dm = DataManager(config['STORAGE_BACKEND'])
+        self.credentials = CredentialStore(config['CREDENTIALS_PATH'])
+        self.jobs = JobQueue(config['JOBS_DB_PATH'])
+        self.job_workers = JobWorkers(self.jobs, make_handlers(self.dm, self.jobs), config['JOB_WORKERS'])
+        self.uploads = UploadSessions(config['UPLOAD_SESSIONS_DIR'])
+        self.login_throttle = create_login_throttle(config['LOGIN_THROTTLE_STORE'], config['LOGIN_THROTTLE_PATH'],
+                                                    user_limit=(LOGIN_USER_BURST, LOGIN_USER_REFILL),
+                                                    ip_limit=(LOGIN_IP_BURST, LOGIN_IP_REFILL),
+                                                    max_backoff=LOGIN_MAX_BACKOFF,
+                                                    trusted_for=LOGIN_TRUSTED_FOR)
+        self.broadcaster = ChangeBroadcaster(self.dm, max_subscribers=config['SSE_MAX_CONNECTIONS'],
+                                             heartbeat=SSE_HEARTBEAT)
+
+
+def services(app=None):
+    """Объекты приложения app (по умолчанию — текущего)"""
+    return (app or current_app).extensions['awr']
+
+
+# Объекты текущего приложения для обработчиков запросов
+dm = LocalProxy(lambda: services().dm)
+credentials = LocalProxy(lambda: services().credentials)
+jobs = LocalProxy(lambda: services().jobs)
+uploads = LocalProxy(lambda: services().uploads)
+login_throttle = LocalProxy(lambda: services().login_throttle)
+broadcaster = LocalProxy(lambda: services().broadcaster)
+
+web = Blueprint('web', __name__)
+
+ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
+
+# Размер страницы /api/tasks по умолчанию и максимальный
+API_TASKS_LIMIT = 50
+API_TASKS_MAX_LIMIT = 500
+# Интервал комментариев-пингов в потоке событий (сек) и пауза переподключения клиента (мс)
+SSE_HEARTBEAT = 15
+SSE_RETRY_MS = 5000
+# Начало ответа потока событий, который пишет цикл рассылки (соединение закрывается вместе с потоком)
+SSE_RESPONSE_HEAD = ('HTTP/1.1 200 OK\r\nContent-Type: text/event-stream; charset=utf-8\r\n'
+                     'Cache-Control: no-cache\r\nX-Accel-Buffering: no\r\nConnection: close\r\n\r\n')
 
 def allowed_file(filename):
     """Проверка разрешенных форматов файлов"""
@@ -43,12 +118,12 @@ def validate_file_size(file):
     file.seek(0, 2)  # Перейти к концу файла
     size = file.tell()
     file.seek(0)  # Вернуться к началу
-    return size <= 2 * 1024 * 1024  # 2MB максимум
+    return size <= PHOTO_MAX_FILE_SIZE
 
 def login_required(f):
     def wrapper(*args, **kwargs):
         if 'user' not in session:
-            return redirect(url_for('login'))
+            return redirect(url_for('web.login'))
         return f(*args, **kwargs)
     wrapper.__name__ = f.__name__
     return wrapper
@@ -58,51 +133,101 @@ def role_required(roles):
         def wrapper(*args, **kwargs):
             if 'user' not in session or session['user']['role'] not in roles:
                 flash('Недостаточно прав доступа')
-                return redirect(url_for('dashboard'))
+                return redirect(url_for('web.dashboard'))
             return f(*args, **kwargs)
         wrapper.__name__ = f.__name__
         return wrapper
     return decorator
 
-@app.route('/')
+def conditional(*data_types):
+    """Условный GET для JSON ответов, построенных из коллекций data_types.
+
+    ETag — хеш версий коллекций, роли и имени пользователя и строки запроса,
+    поэтому разные роли никогда не получают чужой закэшированный ответ.
+    Если клиент прислал совпадающий If-None-Match, сразу отвечаем 304 — данные
+    не читаются и не сериализуются. If-Modified-Since не учитывается: точность
+    Last-Modified — секунда, и запись в ту же секунду дала бы устаревший 304.
+    """
+    def decorator(f):
+        def wrapper(*args, **kwargs):
+            versions = [dm.collection_version(data_type) for data_type in data_types]
+            user = session['user']
+            # Сжатые и несжатые ответы — разные представления с разными ETag
+            validator = repr(([stamp for stamp, _ in versions], user['role'], user['name'], request.full_path,
+                              request.headers.get('Accept-Encoding')))
+            etag = hashlib.sha1(validator.encode('utf-8')).hexdigest()
+            times = [modified for _, modified in versions]
+            last_modified = None
+            if times and None not in times:
+                last_modified = datetime.fromtimestamp(int(max(times)), timezone.utc)
+
+            if request.if_none_match.contains(etag):
+                response = make_response('', 304)
+            else:
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            if last_modified is not None:
+                response.last_modified = last_modified
+            # Ответ зависит от пользователя: кэшировать только в браузере и всегда перепроверять
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            return response
+        wrapper.__name__ = f.__name__
+        return wrapper
+    return decorator
+
+@web.route('/')
 def index():
     if 'user' in session:
-        return redirect(url_for('dashboard'))
+        return redirect(url_for('web.dashboard'))
     return render_template('login.html')
 
-@app.route('/login', methods=['GET', 'POST'])
+@web.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
         
-        if username in USERS and check_password_hash(USERS[username]['password'], password):
+        # Проверка пароля дорогая (хеширование), поэтому перебор отсекается до нее
+        allowed, retry_after = login_throttle.check(username, request.remote_addr)
+        if not allowed:
+            logging.warning(f'Вход ограничен: {username} с {request.remote_addr}')
+            flash(f'Слишком много попыток входа. Повторите через {math.ceil(retry_after)} с')
+            response = make_response(render_template('login.html'), 429)
+            response.headers['Retry-After'] = str(math.ceil(retry_after))
+            return response
+        
+        if username in USERS and credentials.verify(username, password):
+            login_throttle.success(username, request.remote_addr)
             session['user'] = {
                 'username': username,
                 'role': USERS[username]['role'],
                 'name': USERS[username]['name']
             }
             logging.info(f'Успешный вход пользователя: {username}')
-            return redirect(url_for('dashboard'))
+            return redirect(url_for('web.dashboard'))
         else:
+            login_throttle.failure()
             logging.warning(f'Неудачная попытка входа: {username}')
             flash('Неверный логин или пароль')
     
     return render_template('login.html')
 
-@app.route('/logout')
+@web.route('/logout')
 def logout():
     session.clear()
-    return redirect(url_for('index'))
+    return redirect(url_for('web.index'))
 
-@app.route('/dashboard')
+@web.route('/dashboard')
 @login_required
 def dashboard():
     user_role = session['user']['role']
     return render_template(f'dashboard_{user_role}.html', user=session['user'])
 
 # Маршруты для Супер-админа и Админов
-@app.route('/new_task', methods=['GET', 'POST'])
+@web.route('/new_task', methods=['GET', 'POST'])
 @login_required
 @role_required(['super_admin', 'admin'])
 def new_task():
@@ -126,9 +251,21 @@ def new_task():
             task_data['assigned_admin'] = request.form['assigned_admin']
             task_data['status'] = 'В работе'
         
+        # Возможный дубликат: по этому адресу уже есть невыполненная задача
+        if 'confirm_duplicate' not in request.form:
+            duplicates = dm.find_duplicate_tasks(task_data['address'])
+            if duplicates:
+                return render_template('new_task.html',
+                                     work_types=WORK_TYPES,
+                                     brigades=dm.load_data('brigades'),
+                                     access_info=dm.load_data('access_info'),
+                                     duplicates=duplicates,
+                                     form_data=request.form.to_dict(),
+                                     user=session['user'])
+        
         task_id = dm.add_task(task_data)
         flash(f'Задача #{task_id} успешно создана')
-        return redirect(url_for('task_list'))
+        return redirect(url_for('web.task_list'))
     
     brigades = dm.load_data('brigades')
     access_info = dm.load_data('access_info')
@@ -138,23 +275,24 @@ def new_task():
                          access_info=access_info,
                          user=session['user'])
 
-@app.route('/task_list')
+@web.route('/task_list')
 @login_required
 def task_list():
-    tasks = dm.load_data('tasks')
     user_role = session['user']['role']
     user_name = session['user']['name']
     
     # Фильтрация задач в зависимости от роли
     if user_role == 'brigade':
-        tasks = [task for task in tasks if task.get('assigned_brigade') == user_name]
+        tasks = dm.get_brigade_tasks(user_name)
     elif user_role == 'admin':
         # Админы видят все задачи кроме личных заданий от супер-админа
-        tasks = [task for task in tasks if not task.get('assigned_admin')]
+        tasks = dm.get_tasks_without_admin()
+    else:
+        tasks = dm.load_data('tasks')
     
     return render_template('task_list.html', tasks=tasks, user=session['user'])
 
-@app.route('/my_tasks')
+@web.route('/my_tasks')
 @login_required
 def my_tasks():
     user_role = session['user']['role']
@@ -163,11 +301,10 @@ def my_tasks():
     if user_role == 'admin':
         tasks = dm.get_admin_tasks(user_name)
     elif user_role == 'brigade':
-        tasks = dm.get_brigade_tasks(user_name)
         # Разделяем на активные, выполненные и отложенные
-        active_tasks = [t for t in tasks if t['status'] == 'В работе']
-        completed_tasks = [t for t in tasks if t['status'] == 'Выполнено']
-        postponed_tasks = [t for t in tasks if t['status'] == 'Отложено']
+        active_tasks = dm.get_brigade_tasks(user_name, 'В работе')
+        completed_tasks = dm.get_brigade_tasks(user_name, 'Выполнено')
+        postponed_tasks = dm.get_brigade_tasks(user_name, 'Отложено')
         
         return render_template('brigade_tasks.html', 
                              active_tasks=active_tasks,
@@ -179,32 +316,45 @@ def my_tasks():
     
     return render_template('my_tasks.html', tasks=tasks, user=session['user'])
 
-@app.route('/task/<int:task_id>')
+@web.route('/task/<int:task_id>')
 @login_required
 def task_detail(task_id):
-    tasks = dm.load_data('tasks')
-    task = next((t for t in tasks if t['id'] == task_id), None)
+    task = dm.get_task(task_id)
+    if task:
+        task_reports = dm.get_reports_for_task(task_id)
+    else:
+        # Давно выполненные задачи лежат в архиве
+        task, task_reports = dm.get_archived_task(task_id)
     if not task:
         flash('Задача не найдена')
-        return redirect(url_for('task_list'))
-    
-    reports = dm.load_data('reports')
-    task_reports = [r for r in reports if r.get('task_id') == task_id]
+        return redirect(url_for('web.task_list'))
     
     return render_template('task_detail.html', task=task, reports=task_reports, user=session['user'])
 
-@app.route('/task/<int:task_id>/report', methods=['GET', 'POST'])
+@web.route('/task/<int:task_id>/report', methods=['GET', 'POST'])
 @login_required
 @role_required(['brigade'])
 def task_report(task_id):
-    tasks = dm.load_data('tasks')
-    task = next((t for t in tasks if t['id'] == task_id), None)
+    task = dm.get_task(task_id)
     
     if not task or task.get('assigned_brigade') != session['user']['name']:
         flash('Нет прав на эту задачу')
-        return redirect(url_for('my_tasks'))
+        return redirect(url_for('web.my_tasks'))
     
     if request.method == 'POST':
+        # Форма может нести все фото сразу (без загрузки частями, см. uploads.py); запас — на поля формы
+        request.max_content_length = REPORT_MAX_UPLOAD_SIZE + 1024 * 1024
+        # Повторная отправка той же формы (двойное нажатие, обновление страницы) не создает второй отчет
+        # Ключ занимается в очереди атомарно (UNIQUE), поэтому из одновременных отправок сохранится одна
+        submit_key = request.form.get('submit_key')
+        job_id = None
+        if submit_key:
+            job_id = jobs.reserve('process_report', f'process_report:{submit_key}')
+            if job_id is None:
+                flash('Отчет уже сохранен')
+                return redirect(url_for('web.my_tasks'))
+            g.reserved_job = job_id
+        
         report_data = {
             'task_id': task_id,
             'brigade': session['user']['name'],
@@ -217,6 +367,36 @@ def task_report(task_id):
         # Обработка фотографий
         uploaded_files = request.files.getlist('photos')
         failed_uploads = []
+        incoming_photos = []
+        
+        def attach_photo(incoming_path, filename, original):
+            # Имя снимка — хеш содержимого: повторно отправленное фото не хранится дважды
+            if filename not in report_data['photos']:
+                report_data['photos'].append(filename)
+            if photo_exists(filename):
+                os.remove(incoming_path)
+                logging.info(f'Файл {original} уже загружен ранее: {filename}')
+            elif [incoming_path, filename] not in incoming_photos:
+                incoming_photos.append([incoming_path, filename])
+                logging.info(f'Файл успешно загружен: {original} → {filename}')
+        
+        # Фото, загруженные частями до отправки формы (uploads.py)
+        try:
+            for incoming_path, filename in uploads.take(submit_key, session['user']['name'], task_id):
+                attach_photo(incoming_path, filename, filename)
+        except IncompleteUploads as e:
+            # Отчет без части фото не сохраняется: форма возвращается с тем же ключом,
+            # и страница продолжает незавершенные загрузки (резерв ключа снимет teardown)
+            flash(f'{e}. Выберите эти файлы снова — загрузка продолжится с места остановки')
+            pending = [dict(upload, url=url_for('web.api_upload', key=submit_key, upload_id=upload['id']))
+                       for upload in e.sessions]
+            form_data = {'comment': report_data['comment'], 'access': report_data['access'],
+                         'materials': list(zip(request.form.getlist('material_name'),
+                                               request.form.getlist('material_quantity')))}
+            return report_form(task, submit_key, form_data, pending), 409
+        except UploadError as e:
+            flash(str(e))
+            return redirect(url_for('web.my_tasks'))
         
         for file in uploaded_files:
             if file and file.filename:
@@ -225,22 +405,23 @@ def task_report(task_id):
                     continue
                     
                 if not validate_file_size(file):
-                    failed_uploads.append(f'"{file.filename}" - слишком большой файл (>макс 2MB)')
+                    failed_uploads.append(f'"{file.filename}" - слишком большой файл '
+                                          f'(макс {PHOTO_MAX_FILE_SIZE // (1024 * 1024)}MB)')
+                    continue
+                
+                if len(report_data['photos']) >= REPORT_MAX_PHOTOS:
+                    failed_uploads.append(f'"{file.filename}" - больше {REPORT_MAX_PHOTOS} фото в отчете')
                     continue
                     
                 try:
-                    filename = secure_filename(file.filename)
-                    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_')
-                    filename = timestamp + filename
-                    
-                    # Создать папку, если её нет
-                    photos_dir = os.path.join(app.config['UPLOAD_FOLDER'], 'photos')
-                    os.makedirs(photos_dir, exist_ok=True)
-                    
-                    file_path = os.path.join(photos_dir, filename)
-                    file.save(file_path)
-                    report_data['photos'].append(filename)
-                    logging.info(f'Файл успешно загружен: {filename}')
+                    # Здесь проверяется только заголовок; уменьшение, пересжатие и превью
+                    # (photos.py) выполняет фоновое задание process_report
+                    check_photo(file.stream)
+                    digest, incoming_path = receive_photo(file.stream)
+                    attach_photo(incoming_path, photo_name(digest), file.filename)
+                except PhotoError as e:
+                    failed_uploads.append(f'"{file.filename}" - не удалось прочитать изображение')
+                    logging.warning(f'Файл {file.filename} не является изображением: {e}')
                 except Exception as e:
                     failed_uploads.append(f'"{file.filename}" - ошибка загрузки')
                     logging.error(f'Ошибка загрузки файла {file.filename}: {e}')
@@ -259,7 +440,10 @@ def task_report(task_id):
                     'quantity': float(quantity)
                 })
         
-        dm.add_report(report_data)
+        report_id = dm.add_report(report_data)
+        payload = {'report_id': report_id, 'photos': incoming_photos}
+        if job_id is None or not jobs.submit(job_id, payload):
+            jobs.enqueue('process_report', payload, key=f'process_report:report-{report_id}')
         
         # Проверяем полноту отчета
         report_complete = all([
@@ -276,26 +460,94 @@ def task_report(task_id):
         else:
             flash('Отчет сохранен, но не все поля заполнены')
         
-        return redirect(url_for('my_tasks'))
+        return redirect(url_for('web.my_tasks'))
     
+    return report_form(task, uuid.uuid4().hex)
+
+def report_form(task, submit_key, form_data=None, pending_uploads=()):
+    """Страница отчета; form_data и pending_uploads — введенное ранее и незавершенные загрузки"""
     materials = dm.load_data('materials')
     brigade_materials = dm.load_data('brigade_materials')
     user_materials = brigade_materials.get(session['user']['name'], {})
     
     return render_template('task_report.html', 
                          task=task, 
+                         submit_key=submit_key,
+                         reports=dm.get_reports_for_task(task['id']),
+                         max_photos=REPORT_MAX_PHOTOS,
+                         max_file_size=PHOTO_MAX_FILE_SIZE,
                          materials=materials,
                          user_materials=user_materials,
+                         form_data=form_data or {},
+                         pending_uploads=list(pending_uploads),
                          user=session['user'])
 
+@web.teardown_request
+def release_report_reservation(exc):
+    """Резерв ключа отчета, который не дошел до очереди (отказ или ошибка), освобождается"""
+    job_id = g.pop('reserved_job', None)
+    if job_id is not None:
+        jobs.cancel(job_id)
+
+def photo_visible(name, user):
+    """Фото доступно, если оно есть в отчете по задаче, которую пользователь видит в списке задач"""
+    conditions = task_scope(user)
+    return any(task_matches(task, conditions) for task in dm.get_photo_tasks(name))
+
+@web.route('/media/<name>')
+@login_required
+def media(name):
+    """Фото отчета; ?size=small|medium — превью (создается при первом запросе).
+
+    Фото с именем по хешу не меняется, поэтому браузер хранит его без повторных
+    запросов (immutable) и сверяет по ETag из хеша. Поддерживаются запросы
+    диапазонов (Range); при MEDIA_SENDFILE файл отдает прокси-сервер.
+    """
+    size = request.args.get('size')
+    if size is not None and size not in PHOTO_THUMBNAILS:
+        abort(404)
+    # 404, а не 403: по ответу нельзя узнать, есть ли чужое фото
+    if not photo_visible(name, session['user']):
+        abort(404)
+    try:
+        path = ensure_thumbnail(name, size) if size else photo_path(name)
+    except (OSError, PhotoError):
+        abort(404)
+    full_path = os.path.join(os.path.abspath(PHOTOS_DIR), path)
+    if not os.path.isfile(full_path):
+        abort(404)
+
+    hashed = HASHED_NAME.fullmatch(name) is not None
+    etag = f'{os.path.splitext(name)[0]}-{size or "full"}' if hashed else None
+    max_age = MEDIA_MAX_AGE if hashed else 86400
+    if MEDIA_SENDFILE:
+        response = make_response('')
+        if MEDIA_SENDFILE == 'x-accel':
+            response.headers['X-Accel-Redirect'] = MEDIA_ACCEL_PREFIX + path
+        else:
+            response.headers['X-Sendfile'] = full_path
+        response.mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        if etag:
+            response.set_etag(etag)
+            response = response.make_conditional(request)
+    else:
+        response = send_file(full_path, conditional=True, etag=etag or True, max_age=max_age)
+    # Фото доступны только после входа: общие кэши хранить их не должны
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.max_age = max_age
+    if hashed:
+        response.cache_control.immutable = True
+    return response
+
 # Маршруты для кладовщика
-@app.route('/warehouse')
+@web.route('/warehouse')
 @login_required
 @role_required(['warehouse'])
 def warehouse():
     return render_template('warehouse.html', user=session['user'])
 
-@app.route('/materials')
+@web.route('/materials')
 @login_required
 def materials():
     materials = dm.load_data('materials')
@@ -305,50 +557,448 @@ def materials():
                          brigade_materials=brigade_materials,
                          user=session['user'])
 
-@app.route('/reports')
+@web.route('/reports')
 @login_required
 def reports():
     reports = dm.load_data('reports')
     return render_template('reports.html', reports=reports, user=session['user'])
 
-@app.route('/map')
+@web.route('/map')
 @login_required
 def map_view():
-    tasks = dm.load_data('tasks')
-    user_role = session['user']['role']
-    user_name = session['user']['name']
-    
-    if user_role == 'brigade':
-        # Бригады видят только свои задачи в работе
-        tasks = [t for t in tasks if t.get('assigned_brigade') == user_name and t['status'] == 'В работе']
-    
-    return render_template('map.html', tasks=tasks, user=session['user'])
+    # Задачи страница загружает сама по видимой области (/api/tasks?bbox=..., /api/tasks/clusters)
+    return render_template('map.html', user=session['user'])
 
-@app.route('/brigades')
+@web.route('/brigades')
 @login_required
 @role_required(['super_admin', 'admin'])
 def brigades_list():
-    brigades = dm.load_data('brigades')
+    # Список уходит в браузер целиком (tojson), поэтому хеш пароля из старых записей убирается
+    brigades = [{key: value for key, value in brigade.items() if key != 'password'}
+                for brigade in dm.load_data('brigades')]
     return render_template('brigades.html', brigades=brigades, statuses=BRIGADE_STATUSES, user=session['user'])
 
 # API маршруты
-@app.route('/api/tasks')
+def task_scope(user):
+    """Условия выборки задач, видимых пользователю (как на странице списка задач)"""
+    if user['role'] == 'brigade':
+        return [('assigned_brigade', [user['name']])]
+    if user['role'] == 'admin':
+        # Админы не видят личные задания других администраторов
+        return [('assigned_admin', [None, '', user['name']])]
+    return []
+
+def filter_values(value):
+    """Значение фильтра из запроса: none — поле не заполнено, any — заполнено"""
+    if value == 'none':
+        return [None, '']
+    if value == 'any':
+        return ANY
+    return [value]
+
+def task_conditions(args, user):
+    """Условия выборки задач из параметров запроса с учетом роли пользователя"""
+    conditions = task_scope(user)
+    for param, field in (('status', 'status'), ('brigade', 'assigned_brigade'),
+                         ('admin', 'assigned_admin'), ('work_type', 'work_type')):
+        if args.get(param) is not None:
+            conditions.append((field, filter_values(args[param])))
+    if args.get('urgent') in ('1', 'true'):
+        conditions.append(('urgent', [True]))
+    return conditions
+
+def parse_bbox(value):
+    """Область карты из параметра bbox=юг,запад,север,восток"""
+    if not value:
+        return None
+    bbox = [float(part) for part in value.split(',')]
+    if len(bbox) != 4 or bbox[0] > bbox[2] or bbox[1] > bbox[3]:
+        raise ValueError('Некорректная область')
+    return bbox
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key, ensure_ascii=False).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+    key = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    if not isinstance(key, list):
+        raise ValueError('Некорректный курсор')
+    return key
+
+@web.route('/api/tasks')
 @login_required
+@conditional('tasks')
 def api_tasks():
-    tasks = dm.load_data('tasks')
-    return jsonify(tasks)
+    """Задачи с фильтрацией, сортировкой и постраничной выдачей на сервере.
+
+    Параметры: status, brigade, admin, work_type (none/any — поле пустое/заполнено),
+    urgent=1, q (начала слов адреса: «лен 5»), bbox (юг,запад,север,восток — область
+    карты), sort (поле, «-поле» — по убыванию),
+    page или cursor, limit, fields (список полей через запятую).
+    version — номер последнего изменения для /api/tasks/changes.
+    """
+    args = request.args
+    conditions = task_conditions(args, session['user'])
+    # Версия читается до выборки: изменения, сделанные во время нее, придут в следующей дельте
+    version = dm.change_version()
+
+    try:
+        limit = min(int(args.get('limit', API_TASKS_LIMIT)), API_TASKS_MAX_LIMIT)
+        page = int(args.get('page', 1))
+        cursor = decode_cursor(args['cursor']) if args.get('cursor') else None
+        bbox = parse_bbox(args.get('bbox'))
+        if limit < 0 or page < 1:
+            raise ValueError
+        fields = [field for field in args.get('fields', '').split(',') if field]
+        tasks, total, next_cursor = dm.query_tasks(conditions, q=args.get('q'), sort=args.get('sort', 'id'),
+                                                   offset=(page - 1) * limit, cursor=cursor,
+                                                   limit=limit, fields=fields, bbox=bbox)
+    except ValueError:
+        return jsonify({'error': 'Некорректные параметры запроса'}), 400
+
+    return stream_json(tasks, {
+        'total': total,
+        'page': None if cursor is not None else page,
+        'limit': limit,
+        'next_cursor': encode_cursor(next_cursor) if next_cursor is not None else None,
+        'version': version
+    }, 'tasks', negotiate_encoding(request.accept_encodings))
+
+@web.route('/api/tasks/search')
+@login_required
+def api_task_search():
+    """Поиск задач по адресу с учетом сокращений (ул., пр., д.) и опечаток.
+
+    Параметры: q, limit, duplicates=1 — только возможные дубликаты адреса q
+    (невыполненные задачи по тому же дому).
+    """
+    query = request.args.get('q', '')
+    conditions = task_scope(session['user'])
+    if request.args.get('duplicates') == '1':
+        tasks = [task for task in dm.find_duplicate_tasks(query) if task_matches(task, conditions)]
+        return jsonify({'tasks': tasks})
+    try:
+        limit = min(int(request.args.get('limit', 20)), API_TASKS_MAX_LIMIT)
+    except ValueError:
+        return jsonify({'error': 'Некорректные параметры запроса'}), 400
+    results = dm.search_tasks(query, conditions, limit)
+    return jsonify({'tasks': [dict(task, score=round(score, 3)) for task, score in results]})
+
+@web.route('/api/tasks/changes')
+@login_required
+@conditional('tasks', 'sequences')
+def api_task_changes():
+    """Задачи, созданные, измененные или удаленные после версии since.
+
+    Фильтры и fields — как у /api/tasks. Ответ: {version, tasks, removed, reset};
+    reset=true — версия клиента устарела, список нужно загрузить заново.
+    """
+    args = request.args
+    try:
+        since = int(args.get('since', 0))
+        bbox = parse_bbox(args.get('bbox'))
+    except ValueError:
+        return jsonify({'error': 'Некорректные параметры запроса'}), 400
+    fields = [field for field in args.get('fields', '').split(',') if field]
+    changes = dm.get_task_changes(since, task_conditions(args, session['user']), q=args.get('q'),
+                                  fields=fields, bbox=bbox)
+    if changes is None:
+        return jsonify({'version': dm.change_version(), 'tasks': [], 'removed': [], 'reset': True})
+    version, tasks, removed = changes
+    return stream_json(tasks, {'version': version, 'removed': removed, 'reset': False}, 'tasks',
+                       negotiate_encoding(request.accept_encodings))
+
+@web.route('/api/tasks/clusters')
+@login_required
+@conditional('tasks')
+def api_task_clusters():
+    """Кластеры задач видимой области карты: bbox, zoom (масштаб Leaflet) и фильтры
+    status, brigade, admin, work_type, urgent — как у /api/tasks.
+
+    Ответ: {zoom, total, clusters: [{lat, lon, count, urgent, statuses}]}, где zoom —
+    уровень, по которому посчитаны кластеры, total — число задач в них.
+    """
+    args = request.args
+    try:
+        zoom = int(args['zoom'])
+        bbox = parse_bbox(args.get('bbox')) or [-90, -180, 90, 180]
+        level, clusters = dm.task_clusters(zoom, bbox, task_conditions(args, session['user']))
+    except (KeyError, ValueError):
+        return jsonify({'error': 'Некорректные параметры запроса'}), 400
+    return stream_json(clusters, {'zoom': level, 'total': sum(cluster['count'] for cluster in clusters)},
+                       'clusters', negotiate_encoding(request.accept_encodings))
+
+def change_events(data, changes, conditions):
+    """События SSE для изменений, видимых пользователю с условиями conditions (data — DataManager)"""
+    for data_type, record, before in changes:
+        if data_type == 'tasks':
+            if task_matches(record, conditions):
+                yield format_event('task', record, record['rev'])
+            elif before is not None and task_matches(before, conditions):
+                # Только задачи, которые пользователь видел: id чужих задач не раскрываются
+                yield format_event('task_removed', {'id': record['id']}, record['rev'])
+        else:
+            task = data.get_task(record.get('task_id'))
+            if task is not None and task_matches(task, conditions):
+                yield format_event('report', record, record['rev'])
+
+def event_prelude(data, last_event_id, conditions):
+    """Начало потока событий: (номер изменения, пауза переподключения и пропущенные события)"""
+    version = data.change_version()
+    text = f'retry: {SSE_RETRY_MS}\n\n'
+    if last_event_id is not None and last_event_id.isdigit():
+        changes = data.get_changes(int(last_event_id))
+        if changes is None:
+            text += format_event('reset', {'version': version})
+        else:
+            version = changes[0]
+            text += ''.join(change_events(data, changes[1], conditions))
+    return version, text
+
+@web.route('/api/events')
+@login_required
+def api_events():
+    """Поток изменений задач и отчетов (Server-Sent Events).
+
+    События: task, task_removed (задача больше не видна пользователю), report и
+    reset (пропущенные изменения недоступны — данные нужно загрузить заново).
+    id события — номер изменения; при переподключении браузер присылает его в
+    Last-Event-ID, и пропущенные события досылаются.
+
+    serve.py отдает соединение циклу рассылки (environ['awr.detach']), и поток
+    веб-сервера сразу освобождается. Другие серверы держат поток на каждое
+    соединение; когда такие места заняты — 503, и страница опрашивает /api/tasks/changes.
+    """
+    conditions = task_scope(session['user'])
+    last_event_id = request.headers.get('Last-Event-ID', request.args.get('last_event_id'))
+    detach = request.environ.get('awr.detach')
+    if detach is not None:
+        data, hub = services().dm, services().broadcaster
+        version, text = event_prelude(data, last_event_id, conditions)
+        head = SSE_RESPONSE_HEAD + text
+
+        def render(changes):
+            return ''.join(change_events(data, changes, conditions))
+
+        detach(lambda sock: hub.attach(sock, head.encode('utf-8'), render, version))
+        return Response(status=200)  # не отправляется: ответ пишет цикл рассылки
+
+    subscriber = broadcaster.subscribe()
+    if subscriber is None:
+        response = jsonify({'error': 'Поток событий недоступен, используйте /api/tasks/changes'})
+        response.status_code = 503
+        response.headers['Retry-After'] = '60'
+        return response
+
+    def stream():
+        try:
+            version, text = event_prelude(dm, last_event_id, conditions)
+            yield text
+            while not subscriber.closed:
+                if subscriber.overflow:
+                    subscriber.overflow = False
+                    version = dm.change_version()
+                    yield format_event('reset', {'version': version})
+                batch = subscriber.get(SSE_HEARTBEAT)
+                if subscriber.closed:
+                    break
+                if batch is None:
+                    yield ': ping\n\n'
+                    continue
+                batch_version, changes = batch
+                if changes is None:
+                    version = batch_version
+                    yield format_event('reset', {'version': version})
+                    continue
+                yield from change_events(dm, [change for change in changes if change[1]['rev'] > version],
+                                         conditions)
+                version = max(version, batch_version)
+        finally:
+            broadcaster.unsubscribe(subscriber)
+
+    # Контекст запроса нужен потоку до конца: dm и broadcaster — объекты текущего приложения
+    response = Response(stream_with_context(stream()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Место освобождается, даже если поток так и не начали читать
+    response.call_on_close(lambda unsubscribe=broadcaster.unsubscribe: unsubscribe(subscriber))
+    return response
+
+@web.route('/api/archive/tasks')
+@login_required
+def api_archive_tasks():
+    month = request.args.get('month')
+    brigade = request.args.get('brigade')
+    if session['user']['role'] == 'brigade':
+        brigade = session['user']['name']
+    return stream_json(dm.archive.query_tasks(month=month, brigade=brigade),
+                       encoding=negotiate_encoding(request.accept_encodings))
+
+@web.route('/api/stats/cache')
+@login_required
+@role_required(['super_admin'])
+def api_cache_stats():
+    return jsonify(dm.get_cache_stats())
+
+@web.errorhandler(UploadError)
+def upload_error(e):
+    return jsonify({'error': str(e)}), e.status
+
+def upload_session(key, upload_id):
+    """Сессия загрузки текущего пользователя или ошибка 404"""
+    upload = uploads.get(key, upload_id)
+    if upload is None or upload['user'] != session['user']['name']:
+        raise UploadError('Сессия загрузки не найдена', 404)
+    return upload
+
+@web.route('/api/uploads', methods=['POST'])
+@login_required
+@role_required(['brigade'])
+def api_upload_create():
+    """Сессия загрузки фото отчета частями: {task_id, submit_key, filename, size} (см. uploads.py)"""
+    data = request.get_json(silent=True) or {}
+    task_id, filename, size = data.get('task_id'), data.get('filename'), data.get('size')
+    if not isinstance(task_id, int) or not isinstance(size, int) or not isinstance(filename, str):
+        return jsonify({'error': 'Некорректные параметры запроса'}), 400
+    task = dm.get_task(task_id)
+    if not task or task.get('assigned_brigade') != session['user']['name']:
+        return jsonify({'error': 'Нет прав на эту задачу'}), 403
+    if not allowed_file(filename):
+        return jsonify({'error': 'Неподдерживаемый формат'}), 400
+    status = uploads.create(session['user']['name'], task_id, data.get('submit_key'), filename, size)
+    status['url'] = url_for('web.api_upload', key=data['submit_key'], upload_id=status['id'])
+    return jsonify(status), 201
+
+@web.route('/api/uploads/<key>/<upload_id>', methods=['GET', 'DELETE'])
+@login_required
+def api_upload(key, upload_id):
+    """Сколько байт уже принято (клиент продолжает с части next_chunk); DELETE — отмена загрузки"""
+    upload = upload_session(key, upload_id)
+    if request.method == 'DELETE':
+        uploads.delete(upload)
+        return '', 204
+    return jsonify(uploads.status(upload))
+
+@web.route('/api/uploads/<key>/<upload_id>/<int:index>', methods=['PUT'])
+@login_required
+def api_upload_chunk(key, upload_id, index):
+    """Часть файла index (тело запроса пишется на диск по мере получения)"""
+    upload = upload_session(key, upload_id)
+    request.max_content_length = upload['chunk_size']
+    if request.content_length is None:
+        return jsonify({'error': 'Нужен заголовок Content-Length'}), 411
+    try:
+        uploads.write_chunk(upload, index, request.stream, request.content_length)
+    except UploadError as e:
+        if e.status != 409:
+            raise
+        return jsonify({'error': str(e), **uploads.status(upload)}), 409
+    return jsonify(uploads.status(upload))
+
+@web.route('/api/uploads/<key>/<upload_id>/complete', methods=['POST'])
+@login_required
+def api_upload_complete(key, upload_id):
+    """Завершение загрузки: файл проверяется и прикладывается к отчету при отправке формы"""
+    upload = upload_session(key, upload_id)
+    try:
+        return jsonify(uploads.complete(upload))
+    except PhotoError as e:
+        logging.warning(f"Файл {upload['filename']} не является изображением: {e}")
+        return jsonify({'error': 'Не удалось прочитать изображение'}), 422
+
+@web.route('/api/stats/jobs')
+@login_required
+@role_required(['super_admin'])
+def api_job_stats():
+    """Число фоновых заданий по статусам"""
+    return jsonify(jobs.stats())
+
+@web.route('/api/jobs/<int:job_id>')
+@login_required
+def api_job(job_id):
+    """Статус фонового задания по отчету, задачу которого пользователь видит"""
+    job = jobs.get(job_id)
+    report = dm.get_report(job['payload'].get('report_id')) if job and job['payload'] else None
+    task = dm.get_task(report['task_id']) if report else None
+    if task is None or not task_matches(task, task_scope(session['user'])):
+        return jsonify({'error': 'Задание не найдено'}), 404
+    return jsonify({field: job[field] for field in ('id', 'kind', 'status', 'attempts', 'max_attempts',
+                                                     'error', 'result', 'created', 'updated')})
+
+@web.route('/api/stats/login')
+@login_required
+@role_required(['super_admin'])
+def api_login_stats():
+    """Счетчики ограничителя входа: allowed, rejected, succeeded, failed и keys"""
+    return jsonify(login_throttle.stats())
+
+def create_app(config=None):
+    """Приложение AWR (для serve.py или другого WSGI-сервера, например gunicorn "app:create_app()").
+
+    Каждый вызов создает свое приложение со своими данными, очередью заданий,
+    сессиями загрузки, ограничителем входа и рассылкой событий. config —
+    значения, заменяющие настройки из config.py (пути, число исполнителей и т.п.).
+    """
+    app = Flask(__name__)
+    app.request_class = AppRequest
+    app.config.update(
+        SECRET_KEY=SECRET_KEY,
+        UPLOAD_FOLDER=UPLOADS_DIR,
+        # Предел для всех запросов; отчет с фото и части загрузки поднимают его у себя
+        MAX_CONTENT_LENGTH=4 * 1024 * 1024,
+        SESSION_COOKIE_SECURE=False,  # Установите True при использовании HTTPS
+        SESSION_COOKIE_HTTPONLY=True,
+        SESSION_COOKIE_SAMESITE='Lax',
+        STORAGE_BACKEND=STORAGE_BACKEND,
+        CREDENTIALS_PATH=CREDENTIALS_PATH,
+        JOBS_DB_PATH=JOBS_DB_PATH,
+        JOB_WORKERS=JOB_WORKERS,
+        UPLOAD_SESSIONS_DIR=UPLOAD_SESSIONS_DIR,
+        LOGIN_THROTTLE_STORE=LOGIN_THROTTLE_STORE,
+        LOGIN_THROTTLE_PATH=LOGIN_THROTTLE_PATH,
+        SSE_MAX_CONNECTIONS=SSE_MAX_CONNECTIONS,
+        TRUSTED_PROXIES=TRUSTED_PROXIES
+    )
+    app.config.update(config or {})
+    if app.config['TRUSTED_PROXIES']:
+        # IP клиента (request.remote_addr) берется из X-Forwarded-For, а не адреса прокси
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXIES'],
+                                x_proto=app.config['TRUSTED_PROXIES'])
 
-if __name__ == '__main__':
-    # Создание необходимых директорий
     os.makedirs('data', exist_ok=True)
-    os.makedirs('uploads/photos', exist_ok=True)
+    os.makedirs(PHOTOS_DIR, exist_ok=True)
     os.makedirs('backups', exist_ok=True)
-    
-    # Проверка конфигурации
-    from config import BOT_TOKEN
+
     if BOT_TOKEN == "YOUR_BOT_TOKEN_HERE":
         logging.warning("ВНИМАНИЕ: Не настроен токен бота. Обновите config.py")
-    
+
+    app.extensions['awr'] = AppServices(app.config)
+    app.register_blueprint(web)
+    return app
+
+def preload(app):
+    """Предварительная загрузка данных с индексами и компиляция шаблонов.
+
+    serve.py вызывает ее до fork, поэтому воркеры начинают работу с готовым
+    кэшем; без нее данные и шаблоны загружаются при первых запросах.
+    """
+    services(app).dm.warm_up()
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+
+def start_job_workers(app):
+    """Запуск исполнителей фоновых заданий приложения в этом процессе (после fork)"""
+    services(app).job_workers.start()
+
+def shutdown(app, timeout=WEB_GRACEFUL_TIMEOUT):
+    """Подготовка воркера к остановке: открытые потоки событий завершаются,
+    исполнители заданий доделывают текущие задания не дольше timeout секунд"""
+    services(app).broadcaster.close()
+    if not services(app).job_workers.stop(timeout):
+        logging.warning(f'Фоновые задания не завершились за {timeout} с и будут повторены')
+
+if __name__ == '__main__':
+    # Сервер разработки; в продакшене приложение запускается через serve.py
+    app = create_app()
     logging.info("🚀 Запуск AWR Web Application")
     logging.info(f"🌐 Приложение доступно по адресу: http://0.0.0.0:5000")
     
@@ -356,4 +1006,7 @@ if __name__ == '__main__':
     debug_mode = os.getenv('FLASK_DEBUG', '0') == '1'
     port = int(os.getenv('PORT', 5000))
     
+    # С перезагрузчиком (FLASK_DEBUG=1) приложение работает в дочернем процессе
+    if not debug_mode or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_job_workers(app)
     app.run(debug=debug_mode, host='0.0.0.0', port=port)
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Архив выполненных задач AWR
+Выполненные задачи старше заданного срока вместе с отчетами и старые записи
+лога склада переносятся из рабочих файлов в помесячные разделы data/archive/ГГГГ-ММ
+"""
+
+import json
+import os
+import sys
+
+from storage import JsonStorage
+
+ARCHIVE_COLLECTIONS = ('tasks', 'reports', 'warehouse_log')
+
+
+def _month(iso_date):
+    return iso_date[:7] if iso_date else 'unknown'
+
+
+def _index_photos(photos, report):
+    """Добавление фото отчета в индекс {имя фото: [id задач]}"""
+    if report.get('task_id') is None:
+        return
+    for name in report.get('photos') or ():
+        task_ids = photos.setdefault(name, [])
+        if report['task_id'] not in task_ids:
+            task_ids.append(report['task_id'])
+
+
+class Archive:
+    """Холодное хранилище: помесячные разделы и индекс задач по разделам.
+
+    Индекс (index.json) хранит для каждой архивной задачи месяц раздела,
+    бригаду и адрес, а для каждого фото архивных отчетов — id задач, поэтому
+    поиск по истории открывает только нужные разделы. Прочитанный индекс
+    кэшируется, пока файл не изменится.
+    """
+
+    def __init__(self, archive_dir, locks=None):
+        self.archive_dir = archive_dir
+        self.locks = locks
+        self.index_path = os.path.join(archive_dir, 'index.json')
+        self._index_cache = (None, None)
+        os.makedirs(archive_dir, exist_ok=True)
+
+    def _locked(self, func, *args):
+        """Вызов func под эксклюзивной блокировкой архива"""
+        if self.locks is None:
+            return func(*args)
+        with self.locks.exclusive('archive'):
+            return func(*args)
+
+    def _partition(self, month):
+        partition_dir = os.path.join(self.archive_dir, month)
+        return JsonStorage({name: os.path.join(partition_dir, f'{name}.json') for name in ARCHIVE_COLLECTIONS})
+
+    def _read_index(self):
+        """Индекс с диска (для изменения)"""
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {'tasks': {}, 'photos': {}}
+
+    def load_index(self):
+        """Индекс для чтения (общий объект, не изменять)"""
+        try:
+            stat = os.stat(self.index_path)
+            stamp = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        except FileNotFoundError:
+            stamp = None
+        cached_stamp, index = self._index_cache
+        if index is None or stamp != cached_stamp:
+            index = self._read_index()
+            self._index_cache = (stamp, index)
+        return index
+
+    def _save_index(self, index):
+        tmp_path = f'{self.index_path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.index_path)
+
+    def months(self):
+        """Список разделов архива"""
+        return sorted(name for name in os.listdir(self.archive_dir)
+                      if os.path.isdir(os.path.join(self.archive_dir, name)))
+
+    def add(self, tasks, reports, warehouse_log):
+        """Запись в архив (повторная запись тех же id ничего не дублирует)"""
+        self._locked(self._add, tasks, reports, warehouse_log)
+
+    def _add(self, tasks, reports, warehouse_log):
+        task_months = {task['id']: _month(task.get('completed_date')) for task in tasks}
+        batches = {}
+        for task in tasks:
+            batches.setdefault(task_months[task['id']], {}).setdefault('tasks', []).append(task)
+        for report in reports:
+            month = task_months.get(report.get('task_id'), _month(report.get('created_date')))
+            batches.setdefault(month, {}).setdefault('reports', []).append(report)
+        for entry in warehouse_log:
+            batches.setdefault(_month(entry.get('date')), {}).setdefault('warehouse_log', []).append(entry)
+
+        for month, collections in batches.items():
+            os.makedirs(os.path.join(self.archive_dir, month), exist_ok=True)
+            partition = self._partition(month)
+            for name, records in collections.items():
+                merged = {record['id']: record for record in partition.load(name)}
+                merged.update((record['id'], record) for record in records)
+                partition.save(name, sorted(merged.values(), key=lambda record: record['id']))
+
+        index = self._read_index()
+        for task in tasks:
+            index['tasks'][str(task['id'])] = {
+                'month': task_months[task['id']],
+                'brigade': task.get('assigned_brigade'),
+                'address': task.get('address'),
+                'completed_date': task.get('completed_date')
+            }
+        if 'photos' in index:
+            for report in reports:
+                _index_photos(index['photos'], report)
+        else:
+            index['photos'] = self._scan_photos()
+        self._save_index(index)
+
+    def _scan_photos(self):
+        """Фото архивных отчетов по всем разделам: {имя: [id задач]}"""
+        photos = {}
+        for month in self.months():
+            for report in self._partition(month).load('reports'):
+                _index_photos(photos, report)
+        return photos
+
+    def _reindex_photos(self):
+        index = self._read_index()
+        index['photos'] = self._scan_photos()
+        self._save_index(index)
+        return index
+
+    def get_task(self, task_id):
+        """Архивная задача по id (None, если ее нет в архиве)"""
+        meta = self.load_index()['tasks'].get(str(task_id))
+        if meta is None:
+            return None
+        tasks = self._partition(meta['month']).load('tasks')
+        return next((task for task in tasks if task['id'] == task_id), None)
+
+    def get_reports_for_task(self, task_id):
+        meta = self.load_index()['tasks'].get(str(task_id))
+        if meta is None:
+            return []
+        return [report for report in self._partition(meta['month']).load('reports')
+                if report.get('task_id') == task_id]
+
+    def query_tasks(self, month=None, brigade=None):
+        """Архивные задачи за месяц и/или бригады (по индексу, читаются только нужные разделы)"""
+        wanted = {}
+        for task_id, meta in self.load_index()['tasks'].items():
+            if month and meta['month'] != month:
+                continue
+            if brigade and meta['brigade'] != brigade:
+                continue
+            wanted.setdefault(meta['month'], set()).add(int(task_id))
+        result = []
+        for partition_month in sorted(wanted):
+            result.extend(task for task in self._partition(partition_month).load('tasks')
+                          if task['id'] in wanted[partition_month])
+        return result
+
+    def get_photo_tasks(self, name):
+        """Архивные задачи, в отчетах по которым есть фото name (по индексу фото)"""
+        index = self.load_index()
+        if 'photos' not in index:  # индекс, записанный до появления фото в нем
+            index = self._locked(self._reindex_photos)
+        tasks = (self.get_task(task_id) for task_id in index['photos'].get(name, ()))
+        return [task for task in tasks if task is not None]
+
+    def update_reports(self, update):
+        """Изменение архивных отчетов на месте: update(отчет) возвращает True, если
+        изменил отчет; возвращает число измененных отчетов"""
+        return self._locked(self._update_reports, update)
+
+    def _update_reports(self, update):
+        changed = 0
+        for month in self.months():
+            partition = self._partition(month)
+            reports = partition.load('reports')
+            updated = sum(1 for report in reports if update(report))
+            if updated:
+                partition.save('reports', reports)
+                changed += updated
+        if changed:
+            self._reindex_photos()  # имена фото могли измениться
+        return changed
+
+    def get_warehouse_log(self, month):
+        return self._partition(month).load('warehouse_log')
+
+
+if __name__ == '__main__':
+    from data_manager import DataManager
+
+    days = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    moved = DataManager().archive_completed_tasks(days)
+    print(f"В архив перенесено: задач {moved['tasks']}, отчетов {moved['reports']}, "
+          f"записей лога склада {moved['warehouse_log']}")
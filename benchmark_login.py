@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Задержка входа легитимного пользователя во время перебора паролей
+Приложение запускается на копии данных; несколько потоков-атакующих
+отправляют неверные пароли администратора с нескольких IP, а в это время
+бригада и сам атакуемый администратор входят со своих адресов (администратор
+уже входил со своего адреса до атаки). Замер выполняется без атаки, при атаке
+без ограничения попыток и при атаке с ограничителем из config.py. Если
+администратор не может войти или с ограничителем p95 входа кого-то из них
+превышает базовый больше чем в --max-ratio раз, скрипт завершается с кодом 1
+"""
+
+import argparse
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BASE_DIR)
+
+USER = ('brigade1', 'brig1pass', '10.0.0.2')
+# Атакуемый логин; пароль задается в копии данных
+VICTIM = ('admin1', 'admin1-benchmark', '10.0.0.3')
+
+
+def attack(app, stop, ip, counts):
+    client = app.test_client()
+    attempt = 0
+    while not stop.is_set():
+        response = client.post('/login', data={'username': VICTIM[0], 'password': f'guess{attempt}'},
+                               environ_base={'REMOTE_ADDR': ip})
+        counts[response.status_code] = counts.get(response.status_code, 0) + 1
+        attempt += 1
+
+
+def login(app, user):
+    """Время входа пользователя user = (логин, пароль, IP), сек"""
+    username, password, ip = user
+    client = app.test_client()
+    started = time.perf_counter()
+    response = client.post('/login', data={'username': username, 'password': password},
+                           environ_base={'REMOTE_ADDR': ip})
+    elapsed = time.perf_counter() - started
+    if response.status_code != 302:
+        raise RuntimeError(f'Вход {username} не удался: {response.status_code}')
+    return elapsed
+
+
+def measure(app, attackers, logins):
+    """Задержки входа {логин: [сек]} бригады и атакуемого пользователя и ответы атакующим {код: число}"""
+    stop = threading.Event()
+    counts = {}
+    threads = [threading.Thread(target=attack, args=(app, stop, f'203.0.113.{i % 4 + 1}', counts))
+               for i in range(attackers)]
+    for thread in threads:
+        thread.start()
+    try:
+        time.sleep(0.5 if attackers else 0)
+        latencies = {USER[0]: [], VICTIM[0]: []}
+        for _ in range(logins):
+            for user in (USER, VICTIM):
+                latencies[user[0]].append(login(app, user))
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+    for values in latencies.values():
+        values.sort()
+    return latencies, counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Задержка входа при переборе паролей')
+    parser.add_argument('--attackers', type=int, default=8, help='Число потоков-атакующих')
+    parser.add_argument('--logins', type=int, default=30, help='Число входов пользователя в замере')
+    parser.add_argument('--max-ratio', type=float, default=3, help='Допустимый рост p95 под атакой')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='awr_login_')
+    try:
+        shutil.copytree(os.path.join(BASE_DIR, 'data'), os.path.join(work_dir, 'data'),
+                        ignore=shutil.ignore_patterns('locks', 'archive', '*.db*'))
+        os.chdir(work_dir)
+        from app import create_app, services
+        from rate_limit import LoginThrottle, MemoryStore
+
+        logging.disable(logging.WARNING)
+        app = create_app()
+        services(app).credentials.set_password(VICTIM[0], VICTIM[1])
+        throttle = services(app).login_throttle
+        login(app, VICTIM)  # администратор уже входил со своего адреса
+        unlimited = LoginThrottle(MemoryStore(), user_limit=(10 ** 9, 1), ip_limit=(10 ** 9, 1))
+        phases = (('без атаки', throttle, 0),
+                  ('атака без ограничения', unlimited, args.attackers),
+                  ('атака с ограничением', throttle, args.attackers))
+        print(f'{args.attackers} атакующих, по {args.logins} входов {USER[0]} и {VICTIM[0]}')
+        print(f"{'замер':>24} {'логин':>9} {'p50, мс':>8} {'p95, мс':>8}  ответы атакующим")
+        p95 = {}
+        ok = True
+        for name, login_throttle, attackers in phases:
+            services(app).login_throttle = login_throttle
+            try:
+                latencies, counts = measure(app, attackers, args.logins)
+            except RuntimeError as e:
+                print(f'{name:>24} ❌ {e}')
+                ok = False
+                continue
+            answers = ', '.join(f'{code}: {count}' for code, count in sorted(counts.items()))
+            for username, values in latencies.items():
+                p95[name, username] = values[int(len(values) * 0.95)] * 1000
+                print(f'{name:>24} {username:>9} {values[len(values) // 2] * 1000:>8.1f} '
+                      f'{p95[name, username]:>8.1f}  {answers}')
+                answers = ''
+        stats = throttle.stats()
+        print(f"Ограничитель: пропущено {stats['allowed']}, отклонено {stats['rejected']}")
+        for username in (USER[0], VICTIM[0]):
+            if ('атака с ограничением', username) not in p95:
+                continue
+            ratio = p95['атака с ограничением', username] / p95['без атаки', username]
+            ok = ok and ratio <= args.max_ratio
+            print(f"{'✅' if ratio <= args.max_ratio else '❌'} p95 {username} под атакой: x{ratio:.1f} "
+                  f"от базового (допустимо x{args.max_ratio:g})")
+    finally:
+        os.chdir(BASE_DIR)
+        shutil.rmtree(work_dir)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Сравнение пропускной способности сервера разработки (python app.py) и
+продакшен-запуска (python serve.py)
+Оба сервера по очереди запускаются на копии данных с заданным числом задач,
+после чего несколько процессов-клиентов в течение заданного времени запрашивают
+список задач через API и страницу списка задач
+"""
+
+import argparse
+import http.cookiejar
+import multiprocessing
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.parse
+import urllib.request
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BASE_DIR)
+
+# Запросы клиента по кругу
+PATHS = ['/api/tasks?limit=200', '/task_list', '/api/tasks?status=В работе&limit=50']
+
+STATUSES = ['Новая задача', 'В работе', 'Выполнено']
+
+
+def prepare_data(work_dir, count):
+    """Копия данных с count задачами в work_dir (она же становится текущей директорией)"""
+    shutil.copytree(os.path.join(BASE_DIR, 'data'), os.path.join(work_dir, 'data'),
+                    ignore=shutil.ignore_patterns('locks', 'archive', '*.db*'))
+    os.chdir(work_dir)
+    from data_manager import DataManager
+
+    dm = DataManager()
+    with dm.transaction('tasks', 'sequences') as tx:
+        for i in range(count):
+            tx.insert('tasks', {
+                'address': f'ул. Тестовая, д. {i % 500}',
+                'work_type': 'Подключение',
+                'status': STATUSES[i % len(STATUSES)],
+                'assigned_brigade': f'Бригада {i % 10 + 1}',
+                'created_date': '2024-01-15T10:30:00',
+                'urgent': i % 7 == 0
+            })
+
+
+def wait_port(port, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'Сервер не открыл порт {port}')
+
+
+def client(args):
+    port, duration, seed = args
+    base = f'http://127.0.0.1:{port}'
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+    opener.open(f'{base}/login', urllib.parse.urlencode(
+        {'username': 'superadmin', 'password': 'admin123'}).encode()).read()
+    paths = PATHS[:]
+    random.Random(seed).shuffle(paths)
+    latencies = []
+    errors = 0
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        path = paths[len(latencies) % len(paths)]
+        started = time.monotonic()
+        try:
+            opener.open(base + urllib.parse.quote(path, safe='/?=&')).read()
+        except OSError:
+            errors += 1
+            continue
+        latencies.append(time.monotonic() - started)
+    return latencies, errors
+
+
+def measure(command, work_dir, env, port, clients, duration):
+    server = subprocess.Popen(command, cwd=work_dir, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_port(port)
+        with multiprocessing.Pool(clients) as pool:
+            results = pool.map(client, [(port, duration, seed) for seed in range(clients)])
+    finally:
+        server.terminate()
+        server.wait()
+    latencies = sorted(latency for result in results for latency in result[0])
+    errors = sum(result[1] for result in results)
+    if not latencies:
+        return 0, 0, 0, errors
+    return (len(latencies) / duration, latencies[len(latencies) // 2] * 1000,
+            latencies[int(len(latencies) * 0.95)] * 1000, errors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Сравнение app.py и serve.py под нагрузкой')
+    parser.add_argument('--tasks', type=int, default=2000, help='Число задач в данных')
+    parser.add_argument('--clients', type=int, default=16, help='Число одновременных клиентов')
+    parser.add_argument('--duration', type=float, default=10, help='Длительность замера (сек)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2, help='WEB_WORKERS для serve.py')
+    parser.add_argument('--threads', type=int, default=8, help='WEB_THREADS для serve.py')
+    parser.add_argument('--port', type=int, default=5090)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='awr_serve_')
+    try:
+        prepare_data(work_dir, args.tasks)
+        env = dict(os.environ, PORT=str(args.port), WEB_WORKERS=str(args.workers),
+                   WEB_THREADS=str(args.threads), FLASK_DEBUG='0')
+        print(f'{args.tasks} задач, {args.clients} клиентов, {args.duration:g} с')
+        print(f"{'сервер':>28} {'запр/с':>8} {'p50, мс':>8} {'p95, мс':>8} {'ошибок':>7}")
+        for name, script in (('python app.py', 'app.py'),
+                             (f'serve.py {args.workers}x{args.threads}', 'serve.py')):
+            rate, p50, p95, errors = measure([sys.executable, os.path.join(BASE_DIR, script)], work_dir, env,
+                                             args.port, args.clients, args.duration)
+            print(f'{name:>28} {rate:>8.0f} {p50:>8.1f} {p95:>8.1f} {errors:>7}')
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Сравнение форматов снапшотов коллекций: JSON и двоичный (marshal)
+Для каждого размера генерируются задачи, после чего замеряются размер файла,
+время записи и время загрузки через JsonStorage
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from storage import JsonStorage
+
+STATUSES = ['Новая', 'В работе', 'Выполнена']
+
+
+def make_tasks(count):
+    return [{
+        'id': i,
+        'address': f'ул. Тестовая, д. {i % 500}, кв. {i % 97}',
+        'work_type': 'Подключение',
+        'status': STATUSES[i % len(STATUSES)],
+        'assigned_brigade': f'Бригада {i % 10 + 1}',
+        'assigned_admin': f'admin{i % 5 + 1}',
+        'created_date': '2024-01-15T10:30:00',
+        'description': 'Подключение абонента, проверка линии',
+        'urgent': i % 7 == 0,
+        'materials': {'БО/16 100': i % 3, 'Коннектор': 2}
+    } for i in range(1, count + 1)]
+
+
+def measure(storage, tasks):
+    started = time.perf_counter()
+    storage.save('tasks', tasks)
+    write_time = time.perf_counter() - started
+    size = os.path.getsize(storage._readable_path('tasks'))
+    started = time.perf_counter()
+    loaded = storage.load('tasks')
+    read_time = time.perf_counter() - started
+    assert loaded == tasks
+    return size, write_time, read_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Сравнение форматов снапшотов')
+    parser.add_argument('--sizes', default='10000,100000,1000000',
+                        help='Размеры коллекции через запятую')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='awr_snapshot_')
+    try:
+        data_files = {'tasks': os.path.join(work_dir, 'tasks.json')}
+        print(f"{'записей':>10} {'формат':>8} {'размер, МБ':>11} {'запись, с':>10} {'загрузка, с':>12}")
+        for count in (int(size) for size in args.sizes.split(',')):
+            tasks = make_tasks(count)
+            for fmt in ('json', 'binary'):
+                storage = JsonStorage(data_files, formats={'tasks': fmt})
+                size, write_time, read_time = measure(storage, tasks)
+                print(f'{count:>10} {fmt:>8} {size / 1024 / 1024:>11.1f} {write_time:>10.2f} {read_time:>12.2f}')
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main()
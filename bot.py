@@ -4,7 +4,8 @@ import os
 from aiogram import Bot, Dispatcher, types
 from aiogram.filters import Command
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, WebAppInfo
-from config import BOT_TOKEN, AUTHORIZED_PHONES, SUPER_GROUP_ID
+from config import BOT_TOKEN, AUTHORIZED_PHONES, SUPER_GROUP_ID, PHOTOS_DIR
+from photos import photo_path
 
 # Настройка логгинга
 logging.basicConfig(
@@ -102,8 +103,7 @@ async def send_report_to_group(report_data, task_data):
         
         # Отправляем фотографии
         for photo in report_data['photos']:
-            photo_path = f"uploads/photos/{photo}"
-            with open(photo_path, 'rb') as photo_file:
+            with open(os.path.join(PHOTOS_DIR, photo_path(photo)), 'rb') as photo_file:
                 await bot.send_photo(SUPER_GROUP_ID, photo_file)
                 
     except Exception as e:
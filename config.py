@@ -1,6 +1,5 @@
 import os
 from datetime import datetime
-from werkzeug.security import generate_password_hash, check_password_hash
 
 # Telegram Bot Configuration
 BOT_TOKEN = os.getenv('BOT_TOKEN', "YOUR_BOT_TOKEN_HERE")  # Замените на ваш токен бота
@@ -24,89 +23,75 @@ AUTHORIZED_PHONES = [
     "79161234580",  # Кладовщик
 ]
 
-# Пользователи системы (логин: {пароль, роль, имя})
-# ВАЖНО: Пароли хешированы для безопасности
+# Пользователи системы (логин: {роль, имя, телефон})
+# Хеши паролей хранятся отдельно в CREDENTIALS_PATH: python credentials.py set логин
 USERS = {
     "superadmin": {
-        "password": generate_password_hash("admin123"),
         "role": "super_admin",
         "name": "Супер Администратор",
         "phone": "79161234567"
     },
     "admin1": {
-        "password": generate_password_hash("admin1pass"),
         "role": "admin",
         "name": "Администратор 1",
         "phone": "79161234568"
     },
     "admin2": {
-        "password": generate_password_hash("admin2pass"),
         "role": "admin",
         "name": "Администратор 2",
         "phone": "79161234569"
     },
     "brigade1": {
-        "password": generate_password_hash("brig1pass"),
         "role": "brigade",
         "name": "Бригада 1",
         "phone": "79161234570"
     },
     "brigade2": {
-        "password": generate_password_hash("brig2pass"),
         "role": "brigade",
         "name": "Бригада 2",
         "phone": "79161234571"
     },
     "brigade3": {
-        "password": generate_password_hash("brig3pass"),
         "role": "brigade",
         "name": "Бригада 3",
         "phone": "79161234572"
     },
     "brigade4": {
-        "password": generate_password_hash("brig4pass"),
         "role": "brigade",
         "name": "Бригада 4",
         "phone": "79161234573"
     },
     "brigade5": {
-        "password": generate_password_hash("brig5pass"),
         "role": "brigade",
         "name": "Бригада 5",
         "phone": "79161234574"
     },
     "brigade6": {
-        "password": generate_password_hash("brig6pass"),
         "role": "brigade",
         "name": "Бригада 6",
         "phone": "79161234575"
     },
     "brigade7": {
-        "password": generate_password_hash("brig7pass"),
         "role": "brigade",
         "name": "Бригада 7",
         "phone": "79161234576"
     },
     "brigade8": {
-        "password": generate_password_hash("brig8pass"),
         "role": "brigade",
         "name": "Бригада 8",
         "phone": "79161234577"
     },
     "brigade9": {
-        "password": generate_password_hash("brig9pass"),
         "role": "brigade",
         "name": "Бригада 9",
         "phone": "79161234578"
     },
     "brigade10": {
-        "password": generate_password_hash("brig10pass"),
         "role": "brigade",
         "name": "Бригада 10",
         "phone": "79161234579"
     },
     "warehouse": {
-        "password": generate_password_hash("warehouse123"),
         "role": "warehouse",
         "name": "Кладовщик",
         "phone": "79161234580"
@@ -157,10 +142,111 @@ UPLOADS_DIR = "uploads"
 STATIC_DIR = "static"
 TEMPLATES_DIR = "templates"
 
+# Хеши паролей пользователей (см. credentials.py)
+CREDENTIALS_PATH = os.getenv('CREDENTIALS_PATH', f"{DATA_DIR}/credentials.json")
+
+# Фото отчетов (photos.py): каталог, длинная сторона после уменьшения (px), качество
+# сжатия и формат ("JPEG" или "WEBP"); превью (длинная сторона, px) — в PHOTOS_DIR/thumbs
+PHOTOS_DIR = f"{UPLOADS_DIR}/photos"
+# Загруженные фото, которые еще ждут обработки фоновым заданием
+PHOTOS_INCOMING_DIR = f"{UPLOADS_DIR}/incoming"
+PHOTO_MAX_EDGE = int(os.getenv('PHOTO_MAX_EDGE', 2048))
+PHOTO_QUALITY = int(os.getenv('PHOTO_QUALITY', 82))
+PHOTO_FORMAT = os.getenv('PHOTO_FORMAT', 'JPEG').upper()
+PHOTO_THUMBNAILS = {'small': 320, 'medium': 1024}
+# Снимки с большим числом пикселей не открываются (защита от "бомб" распаковки)
+PHOTO_MAX_PIXELS = int(os.getenv('PHOTO_MAX_PIXELS', 50_000_000))
+# Отдача фото (/media): сколько браузер хранит фото с именем по хешу (сек) и передача
+# файла прокси-серверу: "" — отдает приложение, "x-sendfile" (Apache, lighttpd) или
+# "x-accel" (nginx: internal location MEDIA_ACCEL_PREFIX с alias на PHOTOS_DIR)
+MEDIA_MAX_AGE = int(os.getenv('MEDIA_MAX_AGE', 365 * 24 * 3600))
+MEDIA_SENDFILE = os.getenv('MEDIA_SENDFILE', '')
+MEDIA_ACCEL_PREFIX = os.getenv('MEDIA_ACCEL_PREFIX', '/protected-media/')
+# Ограничения загрузки фото в отчет: размер одного фото, число фото и их общий объем (байт)
+PHOTO_MAX_FILE_SIZE = int(os.getenv('PHOTO_MAX_FILE_SIZE', 20 * 1024 * 1024))
+REPORT_MAX_PHOTOS = int(os.getenv('REPORT_MAX_PHOTOS', 20))
+REPORT_MAX_UPLOAD_SIZE = int(os.getenv('REPORT_MAX_UPLOAD_SIZE', 200 * 1024 * 1024))
+# Загрузка фото частями (uploads.py): каталог сессий, размер части (байт) и сколько
+# хранится сессия, по которой отчет так и не отправили (сек)
+UPLOAD_SESSIONS_DIR = f"{UPLOADS_DIR}/sessions"
+UPLOAD_CHUNK_SIZE = int(os.getenv('UPLOAD_CHUNK_SIZE', 512 * 1024))
+UPLOAD_SESSION_TTL = int(os.getenv('UPLOAD_SESSION_TTL', 24 * 3600))
+
+# Фоновые задания (jobs.py): база очереди, потоков-исполнителей в каждом процессе
+# приложения (0 — исполнители запускаются отдельно: python jobs.py run), число попыток,
+# пауза перед первым повтором (удваивается с каждой попыткой, сек), аренда задания
+# исполнителем (сек; задание упавшего процесса возвращается в очередь) и опрос очереди (сек)
+JOBS_DB_PATH = os.getenv('JOBS_DB_PATH', f"{DATA_DIR}/jobs.db")
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', 2))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', 5))
+JOB_RETRY_DELAY = float(os.getenv('JOB_RETRY_DELAY', 10))
+JOB_LEASE = float(os.getenv('JOB_LEASE', 300))
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', 1))
+
+# Ограничение попыток входа (rate_limit.py): запас попыток и секунды на восстановление
+# одной попытки — для логина и для IP клиента; наибольшая блокировка при переборе (сек).
+# Хранилище "memory" — свое в каждом процессе, "file" — общее для воркеров serve.py
+LOGIN_USER_BURST = int(os.getenv('LOGIN_USER_BURST', 5))
+LOGIN_USER_REFILL = float(os.getenv('LOGIN_USER_REFILL', 60))
+LOGIN_IP_BURST = int(os.getenv('LOGIN_IP_BURST', 20))
+LOGIN_IP_REFILL = float(os.getenv('LOGIN_IP_REFILL', 6))
+LOGIN_MAX_BACKOFF = float(os.getenv('LOGIN_MAX_BACKOFF', 300))
+# Сколько секунд после успешного входа IP пользователя считается своим: попытки с него
+# не расходуют общее ведро логина, поэтому перебор с других адресов владельца не блокирует
+LOGIN_TRUSTED_FOR = float(os.getenv('LOGIN_TRUSTED_FOR', 30 * 24 * 3600))
+LOGIN_THROTTLE_STORE = os.getenv('LOGIN_THROTTLE_STORE', 'file')
+LOGIN_THROTTLE_PATH = f"{DATA_DIR}/locks/login_throttle"
+# Сколько прокси перед приложением добавляют X-Forwarded-For (Render, nginx — 1)
+TRUSTED_PROXIES = int(os.getenv('TRUSTED_PROXIES', 0))
+
+# Хранилище данных: "json" (файлы в DATA_DIR), "journal" (JSON + журнал JSONL)
+# или "sqlite" (встроенная база)
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'json')
+SQLITE_PATH = os.getenv('SQLITE_PATH', f"{DATA_DIR}/awr.db")
+# Журнал сворачивается в снапшот, когда превышает этот размер (байт)
+JOURNAL_COMPACT_BYTES = int(os.getenv('JOURNAL_COMPACT_BYTES', 1024 * 1024))
+# fsync после каждой записи в журнал (медленнее, но переживает отключение питания)
+JOURNAL_FSYNC = os.getenv('JOURNAL_FSYNC', '0') == '1'
+# Формат снапшотов коллекций json/journal: "json" (по умолчанию) или "binary"
+# (marshal, быстрее для больших коллекций), например "tasks=binary,reports=binary"
+SNAPSHOT_FORMATS = dict(item.strip().split('=', 1)
+                        for item in os.getenv('SNAPSHOT_FORMATS', '').split(',') if '=' in item)
+
+# Архив: выполненные задачи старше этого срока (дней) переносятся в data/archive
+ARCHIVE_DIR = f"{DATA_DIR}/archive"
+ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', 90))
+
+# Геокодирование адресов задач: "gazetteer" (офлайн справочник GAZETTEER_PATH,
+# пополняется командой python geocoder.py import адреса.csv) или "nominatim" (OpenStreetMap)
+GEOCODER = os.getenv('GEOCODER', 'gazetteer')
+GAZETTEER_PATH = os.getenv('GAZETTEER_PATH', f"{DATA_DIR}/gazetteer.json")
+# Регион, добавляемый к адресу при запросе к nominatim
+GEOCODER_REGION = os.getenv('GEOCODER_REGION', 'Москва')
+# Размер ячейки пространственного индекса задач (градусы, ~1 км)
+GRID_CELL_DEGREES = float(os.getenv('GRID_CELL_DEGREES', 0.01))
+# Кластеры задач на карте: уровни масштаба Leaflet, для которых они считаются заранее,
+# и размер кластера на экране (пиксели). Ближе CLUSTER_MAX_ZOOM карта показывает задачи
+CLUSTER_MIN_ZOOM = int(os.getenv('CLUSTER_MIN_ZOOM', 8))
+CLUSTER_MAX_ZOOM = int(os.getenv('CLUSTER_MAX_ZOOM', 16))
+CLUSTER_CELL_PIXELS = int(os.getenv('CLUSTER_CELL_PIXELS', 64))
+
+# Продакшен-сервер serve.py: число процессов-воркеров, потоков в каждом и время на
+# завершение начатых запросов при остановке (сек)
+WEB_WORKERS = int(os.getenv('WEB_WORKERS', 2))
+WEB_THREADS = int(os.getenv('WEB_THREADS', 32))
+WEB_GRACEFUL_TIMEOUT = int(os.getenv('WEB_GRACEFUL_TIMEOUT', 30))
+# Под serve.py SSE-соединения /api/events обслуживает поток рассылки событий и их
+# число не ограничено. Другие серверы (python app.py, gunicorn) держат поток на
+# каждое соединение: там их не больше SSE_MAX_CONNECTIONS на процесс, остальные
+# страницы опрашивают /api/tasks/changes раз в 30 секунд
+SSE_MAX_CONNECTIONS = int(os.getenv('SSE_MAX_CONNECTIONS', max(WEB_THREADS * 3 // 4, 1)))
+
 # Создание директорий если их нет
 os.makedirs(DATA_DIR, exist_ok=True)
 os.makedirs(UPLOADS_DIR, exist_ok=True)
-os.makedirs(f"{UPLOADS_DIR}/photos", exist_ok=True)
+os.makedirs(PHOTOS_DIR, exist_ok=True)
+os.makedirs(PHOTOS_INCOMING_DIR, exist_ok=True)
+os.makedirs(UPLOAD_SESSIONS_DIR, exist_ok=True)
 os.makedirs(STATIC_DIR, exist_ok=True)
 os.makedirs(f"{STATIC_DIR}/css", exist_ok=True)
 os.makedirs(f"{STATIC_DIR}/js", exist_ok=True)
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Пароли пользователей веб-приложения
+Хеши паролей считаются один раз (командой ниже) и хранятся в CREDENTIALS_PATH,
+поэтому импорт config.py не тратит время на хеширование
+"""
+
+import getpass
+import json
+import os
+import sys
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class CredentialStore:
+    """Хеши паролей из JSON файла {логин: хеш}; файл перечитывается при изменении"""
+
+    def __init__(self, path):
+        self.path = path
+        self._hashes = {}
+        self._mtime = None
+
+    def _load(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return {}
+        if mtime != self._mtime:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self._hashes = json.load(f)
+            self._mtime = mtime
+        return self._hashes
+
+    def verify(self, login, password):
+        password_hash = self._load().get(login)
+        return password_hash is not None and check_password_hash(password_hash, password)
+
+    def set_password(self, login, password):
+        hashes = dict(self._load())
+        hashes[login] = generate_password_hash(password)
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(hashes, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def missing(self, logins):
+        """Логины, для которых пароль не задан"""
+        hashes = self._load()
+        return [login for login in logins if login not in hashes]
+
+
+if __name__ == '__main__':
+    from config import CREDENTIALS_PATH, USERS
+
+    store = CredentialStore(CREDENTIALS_PATH)
+    if len(sys.argv) == 3 and sys.argv[1] == 'set':
+        login = sys.argv[2]
+        if login not in USERS:
+            print(f'Пользователь {login} не найден в config.USERS')
+            sys.exit(1)
+        password = getpass.getpass(f'Новый пароль для {login}: ')
+        if not password or password != getpass.getpass('Повторите пароль: '):
+            print('Пароли не совпадают')
+            sys.exit(1)
+        store.set_password(login, password)
+        print(f'Пароль пользователя {login} сохранен в {CREDENTIALS_PATH}')
+    elif len(sys.argv) == 2 and sys.argv[1] == 'check':
+        missing = store.missing(USERS)
+        for login in missing:
+            print(f'Не задан пароль: {login}')
+        sys.exit(1 if missing else 0)
+    else:
+        print('Использование:\n'
+              '  python credentials.py set логин   # задать пароль пользователя\n'
+              '  python credentials.py check       # пользователи без пароля')
+        sys.exit(1)
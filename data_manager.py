@@ -1,10 +1,80 @@
-import json
-import os
-from datetime import datetime
-from config import DATA_DIR, USERS
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from address_index import AddressIndex, address_matches, address_tokens, is_duplicate, normalize_address
+from archive import Archive
+from config import (DATA_DIR, USERS, STORAGE_BACKEND, SQLITE_PATH,
+                    JOURNAL_COMPACT_BYTES, JOURNAL_FSYNC, SNAPSHOT_FORMATS, ARCHIVE_DIR,
+                    ARCHIVE_AFTER_DAYS, GEOCODER, GAZETTEER_PATH, GEOCODER_REGION, GRID_CELL_DEGREES,
+                    CLUSTER_MIN_ZOOM, CLUSTER_MAX_ZOOM, CLUSTER_CELL_PIXELS)
+from geocoder import GeocodeError, create_geocoder
+from indexes import ChangeLog, ClusterIndex, GridCell, RecordIndex, in_bbox
+from locks import CollectionLocks
+from storage import create_storage
+
+# Сеточный индекс задач по координатам
+TASK_GRID = GridCell(GRID_CELL_DEGREES)
+
+# Уровни масштаба карты с кластерами задач: {уровень: размер ячейки в градусах}
+# (на уровне z окружность по долготе занимает 256 * 2**z пикселей)
+CLUSTER_LEVELS = {zoom: 360 / 2 ** zoom * CLUSTER_CELL_PIXELS / 256
+                  for zoom in range(CLUSTER_MIN_ZOOM, CLUSTER_MAX_ZOOM + 1)}
+# Поля задач, по которым разбиты кластеры: по ним можно фильтровать карту
+CLUSTER_GROUP_FIELDS = ('status', 'urgent', 'assigned_brigade', 'assigned_admin', 'work_type')
+
+# Коллекции-списки с индексом по id и поля для дополнительных индексов
+INDEXED_FIELDS = {
+    'tasks': ('assigned_brigade', 'assigned_admin', 'status', 'work_type', 'urgent',
+              ('assigned_brigade', 'status'), TASK_GRID),
+    'reports': ('task_id',),
+    'warehouse_log': ()
+}
+
+# Коллекции, изменения которых нумеруются глобальной последовательностью (поле rev)
+CHANGE_TRACKED = ('tasks', 'reports')
+# Сколько последних изменений помнит журнал изменений в памяти (для дельт и потока событий)
+CHANGE_LOG_LIMIT = 10000
+
+# Поля, по которым можно сортировать выборку задач
+TASK_SORT_FIELDS = ('id', 'created_date', 'assigned_date', 'completed_date', 'address',
+                    'status', 'work_type', 'assigned_brigade')
+# Значение фильтра «поле заполнено» (любое непустое значение)
+ANY = object()
+
+
+def task_matches(task, conditions, q=None, bbox=None):
+    """Проверка задачи на условия выборки (см. DataManager.query_tasks)"""
+    for field, values in conditions:
+        value = task.get(field)
+        if values is ANY:
+            if not value:
+                return False
+        elif value not in values:
+            return False
+    if bbox is not None and not in_bbox(task, bbox):
+        return False
+    return not q or address_matches(task.get('address'), q)
+
+
+def _project(task, fields=None):
+    """Копия задачи; при заданном fields — только эти поля и id"""
+    if fields:
+        return {field: _copy(task[field]) for field in ('id', *fields) if field in task}
+    return _copy(task)
+
+
+def _copy(value):
+    """Быстрая глубокая копия JSON-структуры (словари, списки, скаляры)"""
+    if isinstance(value, dict):
+        return {key: _copy(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_copy(item) for item in value]
+    return value
+
 
 class DataManager:
-    def __init__(self):
+    def __init__(self, backend=None):
         self.data_files = {
             'tasks': f'{DATA_DIR}/tasks.json',
             'reports': f'{DATA_DIR}/reports.json',
@@ -15,8 +85,45 @@ class DataManager:
             'warehouse_log': f'{DATA_DIR}/warehouse_log.json',
             'access_info': f'{DATA_DIR}/access_info.json',
             'acceptance': f'{DATA_DIR}/acceptance.json',
-            'brigades': f'{DATA_DIR}/brigades.json'
+            'brigades': f'{DATA_DIR}/brigades.json',
+            'sequences': f'{DATA_DIR}/sequences.json',
+            'geocode': f'{DATA_DIR}/geocode.json'
         }
+        # Блокировки и версии коллекций, общие для всех процессов-воркеров
+        self.locks = CollectionLocks(f'{DATA_DIR}/locks', self.data_files)
+        self.storage = create_storage(backend or STORAGE_BACKEND, self.data_files,
+                                      sqlite_path=SQLITE_PATH,
+                                      journal_compact_bytes=JOURNAL_COMPACT_BYTES,
+                                      journal_fsync=JOURNAL_FSYNC,
+                                      locks=self.locks,
+                                      snapshot_formats=SNAPSHOT_FORMATS)
+        self.archive = Archive(ARCHIVE_DIR, self.locks)
+        self.geocoder = create_geocoder(GEOCODER, GAZETTEER_PATH, GEOCODER_REGION)
+        # Кэш чтения: коллекция -> (отметка хранилища, данные, индекс)
+        self._cache = {}
+        self._cache_lock = threading.Lock()
+        self._write_lock = threading.RLock()
+        self._cache_stats = {key: {'hits': 0, 'misses': 0} for key in self.data_files}
+        # Вызываются после каждого изменения задач и отчетов в этом процессе
+        self._listeners = []
+        # Поисковый индекс адресов и индекс задач, по которому он построен
+        self._address_lock = threading.Lock()
+        self._address_index = None
+        self._address_source = None
+        # Кластеры задач для карты, так же привязанные к индексу задач
+        self._cluster_lock = threading.Lock()
+        self._cluster_index = None
+        self._cluster_source = None
+        # Отчеты по именам фото (для проверки доступа к фото), привязанные к индексу отчетов
+        self._photo_lock = threading.Lock()
+        self._photo_reports = None
+        self._photo_source = None
+        # Журнал изменений задач и отчетов, индексы, по которым он ведется, и последний
+        # учтенный в нем rev каждой коллекции
+        self._change_lock = threading.Lock()
+        self._change_log = None
+        self._change_sources = {}
+        self._change_seen = {}
         self._init_data_files()
     
     def _init_data_files(self):
@@ -39,12 +146,23 @@ class DataManager:
             'warehouse_log': [],
             'access_info': [],
             'acceptance': [],
-            'brigades': self._get_initial_brigades()
+            'brigades': self._get_initial_brigades(),
+            'sequences': {},
+            'geocode': {}
         }
         
-        for key, file_path in self.data_files.items():
-            if not os.path.exists(file_path):
+        for key in self.data_files:
+            if not self.storage.exists(key):
                 self.save_data(key, default_data[key])
+        self._strip_brigade_passwords()
+    
+    def _strip_brigade_passwords(self):
+        """Удаление хешей паролей из старых записей бригад: пароли хранятся в credentials.json"""
+        with self._write_lock, self.locks.exclusive('brigades'):
+            brigades = self._cached('brigades')
+            if any('password' in brigade for brigade in brigades):
+                self.save_data('brigades', [{key: value for key, value in brigade.items() if key != 'password'}
+                                            for brigade in brigades])
     
     def _get_initial_brigades(self):
         """Получить начальный список бригад из конфигурации"""
@@ -56,106 +174,728 @@ class DataManager:
                     'name': user_data['name'],
                     'phone': user_data['phone'],
                     'status': 'в работе',
-                    'login': username,
-                    'password': user_data['password']
+                    'login': username
                 })
         return brigades
     
+    def _entry(self, data_type):
+        """Актуальная запись кэша: (отметка хранилища, данные, индекс).
+
+        Кэш проверяется по версии коллекции (общей для всех процессов) и отметке
+        хранилища (inode/размер/mtime файла или версия в SQLite), поэтому
+        неизмененные данные повторно не разбираются, а запись другим воркером
+        сразу делает кэш недействительным. Для коллекций-списков вместе с
+        данными строится индекс по id и полям.
+        """
+        stamp = self._stamp(data_type)
+        entry = self._cache.get(data_type)
+        stats = self._cache_stats[data_type]
+        if entry is not None and stamp is not None and entry[0] == stamp:
+            stats['hits'] += 1
+            return entry
+        stats['misses'] += 1
+        with self.locks.shared(data_type):
+            stamp = self._stamp(data_type)
+            data = self.storage.load(data_type)
+        index = None
+        if data_type in INDEXED_FIELDS:
+            index = RecordIndex(data, INDEXED_FIELDS[data_type])
+            data = index.records
+        entry = (stamp, data, index)
+        if stamp is not None:
+            with self._cache_lock:
+                self._cache[data_type] = entry
+        return entry
+    
+    def _stamp(self, data_type):
+        storage_stamp = self.storage.stamp(data_type)
+        if storage_stamp is None:
+            return None
+        return (self.locks.version(data_type), storage_stamp)
+    
+    def _cached(self, data_type):
+        """Общий (не копируемый) экземпляр данных коллекции — изменять нельзя"""
+        return self._entry(data_type)[1]
+    
+    def _index(self, data_type):
+        return self._entry(data_type)[2]
+    
+    def _refresh_cache(self, data_type, data, index=None):
+        """Запись в кэш данных, только что сохраненных этим процессом"""
+        self.locks.bump(data_type)
+        stamp = self._stamp(data_type)
+        with self._cache_lock:
+            if stamp is None:
+                self._cache.pop(data_type, None)
+            else:
+                self._cache[data_type] = (stamp, data, index)
+    
+    def collection_version(self, data_type):
+        """Версия коллекции для HTTP-валидаторов: (отметка, время изменения или None).
+
+        Отметка меняется при любой записи любым процессом, поэтому по ней можно
+        ответить 304 Not Modified, не загружая и не сериализуя данные.
+        """
+        return self._stamp(data_type), self.locks.modified(data_type)
+    
+    def add_listener(self, callback):
+        """Подписка на изменения задач и отчетов (callback без аргументов)"""
+        self._listeners.append(callback)
+    
+    def _notify(self):
+        for callback in self._listeners:
+            callback()
+    
+    def warm_up(self):
+        """Загрузка всех коллекций в кэш и построение индексов задач.
+
+        Вызывается в главном процессе serve.py до fork: воркеры получают готовый
+        кэш. Соединение с хранилищем закрывается — каждый процесс откроет свое.
+        """
+        for data_type in self.data_files:
+            self._entry(data_type)
+        self._addresses()
+        self._changes()
+        self.task_clusters(CLUSTER_MIN_ZOOM, (-90, -180, 90, 180))  # строит индекс кластеров
+        self.storage.close()
+    
+    def get_cache_stats(self):
+        """Счетчики попаданий и промахов кэша по коллекциям"""
+        return {key: dict(stats) for key, stats in self._cache_stats.items()}
+    
     def load_data(self, data_type):
-        """Загрузка данных из JSON файла"""
-        try:
-            with open(self.data_files[data_type], 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            return []
+        """Загрузка данных (копия из кэша чтения)"""
+        return _copy(self._cached(data_type))
     
     def save_data(self, data_type, data):
-        """Сохранение данных в JSON файл"""
-        with open(self.data_files[data_type], 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        """Сохранение данных в хранилище"""
+        with self._write_lock, self.locks.exclusive(data_type):
+            self.storage.save(data_type, data)
+            self._refresh_saved(data_type, data)
+    
+    def _refresh_saved(self, data_type, data):
+        """Запись в кэш коллекции, сохраненной целиком"""
+        data = _copy(data)
+        index = None
+        if data_type in INDEXED_FIELDS:
+            index = RecordIndex(data, INDEXED_FIELDS[data_type])
+        self._refresh_cache(data_type, data, index)
+    
+    def _next_id(self, data_type, index):
+        """Следующий id из постоянной монотонной последовательности коллекции"""
+        sequences = self._cached('sequences')
+        new_id = max(sequences.get(data_type, 0), index.max_id) + 1
+        sequences = dict(sequences)
+        sequences[data_type] = new_id
+        if data_type in CHANGE_TRACKED:
+            sequences['changes'] = sequences.get('changes', 0) + 1
+        self.save_data('sequences', sequences)
+        return new_id
+    
+    def _next_revision(self):
+        """Следующий номер глобальной последовательности изменений (под блокировкой sequences)"""
+        sequences = dict(self._cached('sequences'))
+        sequences['changes'] = sequences.get('changes', 0) + 1
+        self.save_data('sequences', sequences)
+        return sequences['changes']
+    
+    def change_version(self):
+        """Номер последнего изменения задач и отчетов.
+
+        Клиенты получают версии только отсюда, поэтому журнал изменений (_changes)
+        заводится не позже первой выданной версии и дельта от нее всегда доступна.
+        """
+        self._changes()
+        return self._cached('sequences').get('changes', 0)
+    
+    def _insert_record(self, data_type, record):
+        """Добавление записи с новым id в хранилище, кэш и индексы"""
+        with self._write_lock, self.locks.exclusive(data_type, 'sequences'):
+            index = self._index(data_type)
+            record['id'] = self._next_id(data_type, index)
+            if data_type in CHANGE_TRACKED:
+                record['rev'] = self._cached('sequences')['changes']
+            self.storage.insert(data_type, record)
+            index.add(_copy(record))
+            self._refresh_cache(data_type, index.records, index)
+            if data_type == 'tasks':
+                self._index_task(index, None, record)
+            elif data_type == 'reports':
+                self._index_report(index, record)
+            if data_type in CHANGE_TRACKED:
+                self._log_change(data_type, index, None, record)
+        if data_type in CHANGE_TRACKED:
+            self._notify()
+        return record['id']
+    
+    def geocode(self, address):
+        """Координаты адреса (широта, долгота) или None.
+
+        Результат геокодера запоминается в коллекции geocode по нормализованному
+        адресу (в том числе «не найдено»), поэтому каждый адрес геокодируется один раз.
+        Сбой геокодера не запоминается: адрес будет геокодирован при следующем обращении.
+        """
+        key = normalize_address(address)
+        if not key:
+            return None
+        cache = self._cached('geocode')
+        if key not in cache:
+            try:
+                point = self.geocoder.geocode(address)
+            except GeocodeError as e:
+                logging.warning(f'Адрес "{address}" не геокодирован: {e}')
+                return None
+            with self._write_lock, self.locks.exclusive('geocode'):
+                cache = dict(self._cached('geocode'))
+                cache[key] = list(point) if point else None
+                self.save_data('geocode', cache)
+        point = cache[key]
+        return tuple(point) if point else None
+    
+    def clear_geocode_misses(self):
+        """Удаление из кэша ненайденных адресов (после пополнения справочника)"""
+        with self._write_lock, self.locks.exclusive('geocode'):
+            cache = {key: point for key, point in self._cached('geocode').items() if point}
+            self.save_data('geocode', cache)
+    
+    def geocode_tasks(self):
+        """Заполнение координат задач, у которых их нет; возвращает число найденных"""
+        found = 0
+        for task in list(self._index('tasks').records):
+            if task.get('lat') is None:
+                point = self.geocode(task.get('address'))
+                if point:
+                    self.update_task(task['id'], {'lat': point[0], 'lon': point[1]})
+                    found += 1
+        return found
     
     def add_task(self, task_data):
         """Добавление новой задачи"""
-        tasks = self.load_data('tasks')
-        task_data['id'] = len(tasks) + 1
+        # Геокодирование до взятия блокировок: внешний геокодер может отвечать долго
+        point = self.geocode(task_data.get('address'))
+        if point:
+            task_data['lat'], task_data['lon'] = point
         task_data['created_date'] = datetime.now().isoformat()
         task_data['status'] = 'Новая задача'
-        tasks.append(task_data)
-        self.save_data('tasks', tasks)
-        return task_data['id']
+        return self._insert_record('tasks', task_data)
     
     def update_task(self, task_id, update_data):
         """Обновление задачи"""
-        tasks = self.load_data('tasks')
-        for task in tasks:
-            if task['id'] == task_id:
-                task.update(update_data)
-                if 'status' in update_data:
-                    if update_data['status'] == 'В работе' and 'assigned_date' not in task:
-                        task['assigned_date'] = datetime.now().isoformat()
-                    elif update_data['status'] == 'Выполнено' and 'completed_date' not in task:
-                        task['completed_date'] = datetime.now().isoformat()
-                break
-        self.save_data('tasks', tasks)
+        if 'address' in update_data and 'lat' not in update_data:
+            point = self.geocode(update_data['address'])
+            update_data = dict(update_data, lat=point[0] if point else None, lon=point[1] if point else None)
+        with self._write_lock, self.locks.exclusive('tasks', 'sequences'):
+            index = self._index('tasks')
+            task = index.get(task_id)
+            if task is None:
+                return
+            changes = dict(update_data)
+            changes['rev'] = self._next_revision()
+            merged = dict(task, **changes)
+            if 'status' in update_data:
+                if update_data['status'] == 'В работе' and 'assigned_date' not in merged:
+                    changes['assigned_date'] = datetime.now().isoformat()
+                elif update_data['status'] == 'Выполнено' and 'completed_date' not in merged:
+                    changes['completed_date'] = datetime.now().isoformat()
+            self.storage.patch('tasks', task_id, changes)
+            old = task
+            task = _copy(task)
+            task.update(_copy(changes))
+            index.replace(task)
+            self._refresh_cache('tasks', index.records, index)
+            self._index_task(index, old, task)
+            self._log_change('tasks', index, old, task)
+        self._notify()
     
     def add_report(self, report_data):
         """Добавление отчета"""
-        reports = self.load_data('reports')
-        report_data['id'] = len(reports) + 1
         report_data['created_date'] = datetime.now().isoformat()
-        reports.append(report_data)
-        self.save_data('reports', reports)
-        return report_data['id']
+        return self._insert_record('reports', report_data)
+    
+    def _addresses(self):
+        """Поисковый индекс адресов задач.
+
+        Строится при первом поиске и дальше обновляется по одной задаче в
+        add_task/update_task; если задачи перезагружены (их изменил другой
+        процесс), индекс строится заново.
+        """
+        index = self._index('tasks')
+        with self._address_lock:
+            if self._address_source is not index:
+                self._address_index = AddressIndex(index.records)
+                self._address_source = index
+            return self._address_index
+    
+    def _index_task(self, index, old, task):
+        """Обновление поиска по адресам и кластеров после добавления (old=None) или изменения задачи"""
+        with self._address_lock:
+            if self._address_source is index and (old is None or old.get('address') != task.get('address')):
+                self._address_index.add(task['id'], task.get('address'))
+        with self._cluster_lock:
+            if self._cluster_source is index:
+                if old is not None:
+                    self._cluster_index.remove(old)
+                self._cluster_index.add(task)
+    
+    def _photos(self):
+        """id отчетов по имени фото: {имя: [id]}; строится при первом запросе и
+        пополняется в add_report, как поиск по адресам"""
+        index = self._index('reports')
+        with self._photo_lock:
+            if self._photo_source is not index:
+                photos = {}
+                for report in index.records:
+                    for name in report.get('photos') or ():
+                        photos.setdefault(name, []).append(report['id'])
+                self._photo_reports = photos
+                self._photo_source = index
+            return self._photo_reports
+    
+    def _index_report(self, index, report):
+        with self._photo_lock:
+            if self._photo_source is index:
+                for name in report.get('photos') or ():
+                    self._photo_reports.setdefault(name, []).append(report['id'])
+    
+    def _changes(self):
+        """Журнал изменений задач и отчетов (ChangeLog).
+
+        Строится при первом запросе и дальше пополняется при каждой записи в этом
+        процессе; если коллекцию перезагрузили (ее изменил другой процесс),
+        изменения находятся сравнением нового индекса с прежним. Так дельта
+        стоит пропорционально числу изменений, а не размеру коллекций.
+        """
+        indexes = {data_type: self._index(data_type) for data_type in CHANGE_TRACKED}
+        with self._change_lock:
+            if self._change_log is None:
+                self._change_seen = {data_type: max((record.get('rev', 0) for record in index.records), default=0)
+                                     for data_type, index in indexes.items()}
+                self._change_log = ChangeLog(max(self._change_seen.values()), CHANGE_LOG_LIMIT)
+                self._change_sources = indexes
+                return self._change_log
+            for data_type, index in indexes.items():
+                old = self._change_sources[data_type]
+                if old is index:
+                    continue
+                seen = self._change_seen[data_type]
+                for record in index.records:
+                    rev = record.get('rev', 0)
+                    if rev > seen:
+                        self._change_log.add(rev, data_type, record['id'], old.get(record['id']))
+                        self._change_seen[data_type] = max(self._change_seen[data_type], rev)
+                self._change_sources[data_type] = index
+            return self._change_log
+    
+    def _log_change(self, data_type, index, old, record):
+        """Запись изменения в журнал (old — прежняя версия или None для новой записи)"""
+        with self._change_lock:
+            if self._change_log is not None and self._change_sources.get(data_type) is index:
+                self._change_log.add(record['rev'], data_type, record['id'], old)
+                self._change_seen[data_type] = max(self._change_seen[data_type], record['rev'])
     
-    def get_brigade_tasks(self, brigade_name):
-        """Получение задач конкретной бригады"""
-        tasks = self.load_data('tasks')
-        return [task for task in tasks if task.get('assigned_brigade') == brigade_name]
+    def get_photo_tasks(self, name):
+        """Задачи, в отчетах по которым есть фото name (рабочие, а если таких нет — архивные)"""
+        reports = self._index('reports')
+        tasks = []
+        for report_id in self._photos().get(name, ()):
+            task = self.get_task(reports.get(report_id)['task_id'])
+            if task is not None:
+                tasks.append(task)
+        if tasks:
+            return tasks
+        return self.archive.get_photo_tasks(name)
+    
+    def search_tasks(self, query, conditions=(), limit=20):
+        """Поиск задач по адресу с учетом сокращений и опечаток: [(задача, оценка)]"""
+        index = self._index('tasks')
+        results = []
+        for task_id, score in self._addresses().search(query, limit=None):
+            task = index.get(task_id)
+            if task is not None and task_matches(task, conditions):
+                results.append((_copy(task), score))
+                if len(results) == limit:
+                    break
+        return results
+    
+    def find_duplicate_tasks(self, address):
+        """Невыполненные задачи, похожие на задачу по тому же адресу"""
+        index = self._index('tasks')
+        duplicates = []
+        for task_id, _ in self._addresses().search(address, limit=None):
+            task = index.get(task_id)
+            if task is not None and task.get('status') != 'Выполнено' and is_duplicate(address, task.get('address')):
+                duplicates.append(_copy(task))
+        return duplicates
+    
+    def task_clusters(self, zoom, bbox, conditions=()):
+        """Кластеры задач области bbox для масштаба карты zoom: (уровень, кластеры).
+
+        Кластер — {'lat', 'lon', 'count', 'urgent', 'statuses'}: центр масс, число
+        задач, из них срочных и число задач по статусам. conditions — как у
+        query_tasks, но только по полям CLUSTER_GROUP_FIELDS. Индекс кластеров
+        строится при первом запросе и дальше обновляется по одной задаче, как
+        поиск по адресам.
+        """
+        for field, _ in conditions:
+            if field not in CLUSTER_GROUP_FIELDS:
+                raise ValueError(f'Фильтр кластеров по полю {field} не поддерживается')
+        accepted = {}
+
+        def accept(group):
+            if group not in accepted:
+                accepted[group] = task_matches(dict(zip(CLUSTER_GROUP_FIELDS, group)), conditions)
+            return accepted[group]
+
+        index = self._index('tasks')
+        with self._cluster_lock:
+            if self._cluster_source is not index:
+                self._cluster_index = ClusterIndex(CLUSTER_LEVELS, CLUSTER_GROUP_FIELDS, index.records)
+                self._cluster_source = index
+            level = self._cluster_index.level(zoom)
+            cells = self._cluster_index.clusters(level, bbox, accept)
+        clusters = []
+        for count, lat, lon, groups in cells:
+            statuses = {}
+            urgent = 0
+            for (status, is_urgent, *_), number in groups.items():
+                statuses[status] = statuses.get(status, 0) + number
+                if is_urgent:
+                    urgent += number
+            clusters.append({'lat': round(lat, 6), 'lon': round(lon, 6), 'count': count,
+                             'urgent': urgent, 'statuses': statuses})
+        return level, clusters
+    
+    def get_task(self, task_id):
+        """Задача по id (None, если не найдена)"""
+        task = self._index('tasks').get(task_id)
+        return _copy(task) if task is not None else None
+    
+    def get_report(self, report_id):
+        """Отчет по id (None, если не найден)"""
+        report = self._index('reports').get(report_id)
+        return _copy(report) if report is not None else None
+    
+    def get_reports_for_task(self, task_id):
+        """Отчеты по задаче"""
+        return [_copy(report) for report in self._index('reports').lookup('task_id', task_id)]
+    
+    def get_brigade_tasks(self, brigade_name, status=None):
+        """Получение задач конкретной бригады (при необходимости — только в заданном статусе)"""
+        index = self._index('tasks')
+        if status is None:
+            tasks = index.lookup('assigned_brigade', brigade_name)
+        else:
+            tasks = index.lookup(('assigned_brigade', 'status'), (brigade_name, status))
+        return [_copy(task) for task in tasks]
     
     def get_admin_tasks(self, admin_name):
         """Получение задач конкретного админа"""
-        tasks = self.load_data('tasks')
-        return [task for task in tasks if task.get('assigned_admin') == admin_name]
+        return [_copy(task) for task in self._index('tasks').lookup('assigned_admin', admin_name)]
     
-    def update_materials(self, material_name, quantity, operation='add'):
-        """Обновление количества материалов на складе"""
-        materials = self.load_data('materials')
-        if material_name in materials:
+    def get_tasks_by_status(self, status):
+        """Получение задач в заданном статусе"""
+        return [_copy(task) for task in self._index('tasks').lookup('status', status)]
+    
+    def get_tasks_without_admin(self):
+        """Задачи, не назначенные лично администратору"""
+        index = self._index('tasks')
+        tasks = index.lookup('assigned_admin', None) + index.lookup('assigned_admin', '')
+        return [_copy(task) for task in sorted(tasks, key=lambda task: task['id'])]
+    
+    def query_tasks(self, conditions=(), q=None, sort='id', offset=0, cursor=None, limit=50, fields=None,
+                    bbox=None):
+        """Выборка задач по индексам: (страница, всего найдено, ключ следующей страницы).
+
+        Страница — генератор копий задач, чтобы ответ можно было отдавать потоком.
+
+        conditions — пары (поле, допустимые значения) из индексируемых полей задач;
+        вместо списка значений можно передать ANY (поле заполнено). Одно поле может
+        встречаться несколько раз — условия объединяются через И. Кандидаты берутся
+        из самого узкого индекса, остальные условия проверяются по ним.
+        q — начала слов адреса (см. address_index), bbox — (юг, запад, север, восток):
+        только задачи с координатами в этой области (по сеточному индексу), sort — поле из TASK_SORT_FIELDS («-поле» — по убыванию).
+        Страница задается смещением offset или курсором cursor — ключом сортировки
+        последней задачи предыдущей страницы. fields — список возвращаемых полей.
+        """
+        descending = sort.startswith('-')
+        sort_field = sort.lstrip('-')
+        if sort_field not in TASK_SORT_FIELDS:
+            raise ValueError(f'Недопустимое поле сортировки: {sort_field}')
+        index = self._index('tasks')
+
+        matches = []
+        filled = []
+        for field, values in conditions:
+            if values is ANY:
+                filled.append(field)
+                continue
+            matched = {}
+            for value in values:
+                matched.update(index.by_field[field].get(value, {}))
+            matches.append(matched)
+        if bbox is not None:
+            matches.append(index.within(TASK_GRID, bbox))
+        if address_tokens(q):
+            matches.append({task_id: index.get(task_id) for task_id in self._addresses().prefix_ids(q)
+                            if index.get(task_id) is not None})
+        matches.sort(key=len)
+        tasks = matches[0].values() if matches else index.records
+        tasks = [task for task in tasks
+                 if all(task['id'] in matched for matched in matches[1:])
+                 and all(task.get(field) for field in filled)]
+
+        if sort_field == 'id':
+            def key(task):
+                return [task['id']]
+        else:
+            def key(task):
+                return [str(task.get(sort_field) or ''), task['id']]
+        # Курсор приходит от клиента: он должен иметь вид ключа сортировки, иначе сравнение упадет
+        if cursor is not None and not (
+                len(cursor) == (1 if sort_field == 'id' else 2)
+                and type(cursor[-1]) is int
+                and (sort_field == 'id' or isinstance(cursor[0], str))):
+            raise ValueError('Курсор не соответствует сортировке')
+        tasks.sort(key=key, reverse=descending)
+        total = len(tasks)
+        if cursor is not None:
+            offset = next((position for position, task in enumerate(tasks)
+                           if (key(task) < cursor if descending else key(task) > cursor)), total)
+        page = tasks[offset:offset + limit]
+        next_cursor = key(page[-1]) if page and offset + limit < total else None
+        return (_project(task, fields) for task in page), total, next_cursor
+    
+    def get_changes(self, since):
+        """Все изменения задач и отчетов после версии since:
+        (версия, [(коллекция, запись, версия записи на момент since или None)]) или None.
+
+        Записи упорядочены по номеру изменения rev; прежние версии общие с журналом
+        и изменять их нельзя. None — как в get_task_changes.
+        """
+        with self.locks.shared('reports', 'sequences', 'tasks'):
+            sequences = self._cached('sequences')
+            version = sequences.get('changes', 0)
+            if since < sequences.get('changes_reset', 0) or since > version:
+                return None
+            changed = self._changes().since(since)
+            if changed is None:
+                return None
+            changes = []
+            for (data_type, record_id), before in changed.items():
+                record = self._index(data_type).get(record_id)
+                if record is not None:
+                    changes.append((data_type, _copy(record), before))
+        changes.sort(key=lambda change: change[1]['rev'])
+        return version, changes
+    
+    def get_task_changes(self, since, conditions=(), q=None, fields=None, bbox=None):
+        """Изменения задач после версии since: (версия, задачи, id удаленных) или None.
+
+        Задачи, созданные или измененные после since и подходящие под условия
+        выборки, возвращаются целиком (или полями fields); подходившие на момент
+        since, но больше не подходящие (например, переназначенные другой
+        бригаде), — в списке удаленных. None означает, что версия клиента устарела
+        (задачи уходили в архив или журнал изменений ее уже не помнит) или
+        неизвестна и список нужно загрузить заново.
+        """
+        with self.locks.shared('reports', 'sequences', 'tasks'):
+            sequences = self._cached('sequences')
+            version = sequences.get('changes', 0)
+            if since < sequences.get('changes_reset', 0) or since > version:
+                return None
+            changed = self._changes().since(since)
+            if changed is None:
+                return None
+            index = self._index('tasks')
+            tasks, removed = [], []
+            for (data_type, task_id), before in changed.items():
+                task = index.get(task_id) if data_type == 'tasks' else None
+                if task is None:
+                    continue
+                if task_matches(task, conditions, q, bbox):
+                    tasks.append(_project(task, fields))
+                elif before is not None and task_matches(before, conditions, q, bbox):
+                    removed.append(task_id)
+        return version, tasks, removed
+    
+    @contextmanager
+    def transaction(self, *data_types):
+        """Единица работы над несколькими коллекциями.
+
+        with dm.transaction('materials', 'warehouse_log') as tx:
+            materials = tx.load('materials')
+            ...
+            tx.insert('warehouse_log', entry)
+
+        На перечисленные коллекции (без списка — на все) сразу берутся
+        эксклюзивные блокировки. Каждая коллекция загружается один раз,
+        изменения применяются в памяти и фиксируются в хранилище атомарно
+        при выходе из блока. При исключении ничего не записывается.
+        """
+        data_types = set(data_types or self.data_files)
+        if data_types & set(INDEXED_FIELDS):
+            data_types.add('sequences')
+        with self._write_lock, self.locks.exclusive(*data_types):
+            tx = Transaction(self, data_types)
+            yield tx
+            tx.commit()
+    
+    def _change_stock(self, stock, item_name, quantity, operation):
+        if item_name in stock:
             if operation == 'add':
-                materials[material_name] += quantity
+                stock[item_name] += quantity
             else:
-                materials[material_name] = max(0, materials[material_name] - quantity)
+                stock[item_name] = max(0, stock[item_name] - quantity)
         else:
-            materials[material_name] = quantity if operation == 'add' else 0
-        self.save_data('materials', materials)
+            stock[item_name] = quantity if operation == 'add' else 0
+    
+    def update_materials(self, material_name, quantity, operation='add'):
+        """Обновление количества материалов на складе"""
+        with self.transaction('materials') as tx:
+            self._change_stock(tx.load('materials'), material_name, quantity, operation)
     
     def transfer_material_to_brigade(self, material_name, quantity, brigade_name):
         """Передача материала бригаде"""
-        # Списать со склада
-        self.update_materials(material_name, quantity, 'subtract')
-        
-        # Добавить бригаде
-        brigade_materials = self.load_data('brigade_materials')
-        if brigade_name not in brigade_materials:
-            brigade_materials[brigade_name] = {}
-        if material_name not in brigade_materials[brigade_name]:
-            brigade_materials[brigade_name][material_name] = 0
-        brigade_materials[brigade_name][material_name] += quantity
-        self.save_data('brigade_materials', brigade_materials)
-        
-        # Записать в лог
-        self.add_warehouse_log({
-            'type': 'ТМЦ',
-            'operation': 'Выдача бригаде',
-            'item': material_name,
-            'quantity': quantity,
-            'brigade': brigade_name,
-            'date': datetime.now().isoformat()
-        })
+        with self.transaction('materials', 'brigade_materials', 'warehouse_log') as tx:
+            # Списать со склада
+            self._change_stock(tx.load('materials'), material_name, quantity, 'subtract')
+            
+            # Добавить бригаде
+            brigade_materials = tx.load('brigade_materials')
+            self._change_stock(brigade_materials.setdefault(brigade_name, {}), material_name, quantity, 'add')
+            
+            # Записать в лог
+            tx.insert('warehouse_log', {
+                'type': 'ТМЦ',
+                'operation': 'Выдача бригаде',
+                'item': material_name,
+                'quantity': quantity,
+                'brigade': brigade_name,
+                'date': datetime.now().isoformat()
+            })
+    
+    def return_material_from_brigade(self, material_name, quantity, brigade_name):
+        """Возврат материала от бригады на склад"""
+        with self.transaction('materials', 'brigade_materials', 'warehouse_log') as tx:
+            brigade_materials = tx.load('brigade_materials').setdefault(brigade_name, {})
+            quantity = min(quantity, brigade_materials.get(material_name, 0))
+            self._change_stock(brigade_materials, material_name, quantity, 'subtract')
+            self._change_stock(tx.load('materials'), material_name, quantity, 'add')
+            tx.insert('warehouse_log', {
+                'type': 'ТМЦ',
+                'operation': 'Возврат на склад',
+                'item': material_name,
+                'quantity': quantity,
+                'brigade': brigade_name,
+                'date': datetime.now().isoformat()
+            })
     
     def add_warehouse_log(self, log_entry):
         """Добавление записи в лог склада"""
-        logs = self.load_data('warehouse_log')
-        log_entry['id'] = len(logs) + 1
-        logs.append(log_entry)
-        self.save_data('warehouse_log', logs)
+        self._insert_record('warehouse_log', log_entry)
+    
+    def archive_completed_tasks(self, older_than_days=None):
+        """Перенос в архив выполненных задач старше срока, их отчетов и старого лога склада.
+
+        Сначала записи пишутся в архив (повторная запись идемпотентна), затем
+        одной транзакцией удаляются из рабочих коллекций.
+        """
+        days = ARCHIVE_AFTER_DAYS if older_than_days is None else older_than_days
+        cutoff = (datetime.now() - timedelta(days=days)).isoformat()
+        with self.transaction('tasks', 'reports', 'warehouse_log') as tx:
+            cold_tasks = [task for task in self._index('tasks').lookup('status', 'Выполнено')
+                          if task.get('completed_date', cutoff) < cutoff]
+            cold_ids = {task['id'] for task in cold_tasks}
+            cold_reports = [report for task_id in cold_ids
+                            for report in self._index('reports').lookup('task_id', task_id)]
+            cold_logs = [entry for entry in self._cached('warehouse_log') if entry.get('date', cutoff) < cutoff]
+            moved = {'tasks': len(cold_tasks), 'reports': len(cold_reports), 'warehouse_log': len(cold_logs)}
+            if not any(moved.values()):
+                return moved
+            self.archive.add(cold_tasks, cold_reports, cold_logs)
+            
+            # Удаление из рабочих коллекций не попадает в ленту изменений:
+            # клиенты с более ранней версией должны загрузить задачи заново
+            sequences = tx.load('sequences')
+            sequences['changes'] = sequences.get('changes', 0) + 1
+            sequences['changes_reset'] = sequences['changes']
+            
+            cold_report_ids = {report['id'] for report in cold_reports}
+            cold_log_ids = {entry['id'] for entry in cold_logs}
+            tasks = tx.load('tasks')
+            tasks[:] = [task for task in tasks if task['id'] not in cold_ids]
+            reports = tx.load('reports')
+            reports[:] = [report for report in reports if report['id'] not in cold_report_ids]
+            logs = tx.load('warehouse_log')
+            logs[:] = [entry for entry in logs if entry['id'] not in cold_log_ids]
+        return moved
+    
+    def get_archived_task(self, task_id):
+        """Задача из архива с ее отчетами: (задача, отчеты) или (None, [])"""
+        task = self.archive.get_task(task_id)
+        if task is None:
+            return None, []
+        return task, self.archive.get_reports_for_task(task_id)
+
+
+class Transaction:
+    """Изменения нескольких коллекций, фиксируемые вместе (см. DataManager.transaction)"""
+
+    def __init__(self, dm, data_types):
+        self.dm = dm
+        self.data_types = data_types
+        self._original = {}
+        self._working = {}
+        self._inserts = {}
+
+    def load(self, data_type):
+        """Рабочая копия коллекции (загружается один раз за транзакцию)"""
+        if data_type not in self.data_types:
+            raise ValueError(f'Коллекция {data_type} не объявлена в транзакции')
+        if data_type not in self._working:
+            self._original[data_type] = self.dm._cached(data_type)
+            self._working[data_type] = _copy(self._original[data_type])
+        return self._working[data_type]
+
+    def insert(self, data_type, record):
+        """Добавление записи в коллекцию-список с выдачей нового id"""
+        if data_type not in self.data_types:
+            raise ValueError(f'Коллекция {data_type} не объявлена в транзакции')
+        sequences = self.load('sequences')
+        last_id = max(sequences.get(data_type, 0), self.dm._index(data_type).max_id)
+        record['id'] = last_id + 1
+        sequences[data_type] = record['id']
+        if data_type in CHANGE_TRACKED:
+            sequences['changes'] = sequences.get('changes', 0) + 1
+            record['rev'] = sequences['changes']
+        self._inserts.setdefault(data_type, []).append(record)
+        return record['id']
+
+    def commit(self):
+        changes = {}
+        for data_type, data in self._working.items():
+            if data != self._original[data_type]:
+                changes[data_type] = ('save', data)
+        for data_type, records in self._inserts.items():
+            changes[data_type] = ('insert', records)
+        if not changes:
+            return
+        # Индексы берутся до записи: после нее кэш устарел бы и перечитал уже добавленные записи
+        indexes = {data_type: self.dm._index(data_type) for data_type in self._inserts}
+        self.dm.storage.commit(changes)
+        for data_type, (operation, data) in changes.items():
+            if operation == 'save':
+                self.dm._refresh_saved(data_type, data)
+            else:
+                index = indexes[data_type]
+                for record in data:
+                    index.add(_copy(record))
+                    if data_type == 'tasks':
+                        self.dm._index_task(index, None, record)
+                    elif data_type == 'reports':
+                        self.dm._index_report(index, record)
+                    if data_type in CHANGE_TRACKED:
+                        self.dm._log_change(data_type, index, None, record)
+                self.dm._refresh_cache(data_type, index.records, index)
+        if any(data_type in changes for data_type in CHANGE_TRACKED):
+            self.dm._notify()
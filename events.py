@@ -0,0 +1,279 @@
+import json
+import logging
+import queue
+import selectors
+import socket
+import threading
+import time
+
+# Сколько пакетов изменений может ждать медленный подписчик, прежде чем получит reset
+SUBSCRIBER_QUEUE_SIZE = 100
+# Сколько байт может ждать отправки медленное соединение, прежде чем будет закрыто
+# (браузер переподключится с Last-Event-ID и получит пропущенное)
+STREAM_BUFFER_LIMIT = 1024 * 1024
+
+
+class Subscriber:
+    """Очередь пакетов изменений одного SSE-соединения"""
+
+    def __init__(self):
+        self.queue = queue.Queue(SUBSCRIBER_QUEUE_SIZE)
+        self.overflow = False
+        self.closed = False
+
+    def get(self, timeout):
+        """Следующий пакет (version, changes) или None, если за timeout ничего не пришло"""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class EventStream:
+    """SSE-соединение, переданное циклу рассылки: сокет, буфер отправки и
+    render(changes) — текст событий для пользователя этого соединения"""
+
+    def __init__(self, sock, data, render, version):
+        self.sock = sock
+        self.buffer = bytearray(data)
+        self.render = render
+        self.version = version
+        self.sent = time.monotonic()
+
+
+class ChangeBroadcaster:
+    """Рассылка изменений задач и отчетов подписчикам Server-Sent Events.
+
+    Один фоновый поток на процесс следит за номером последнего изменения
+    (DataManager.change_version): записи этого процесса будят его сразу через
+    слушатель DataManager, записи других воркеров замечаются при опросе раз в
+    poll_interval секунд. Изменения читаются один раз и раздаются всем.
+
+    Соединения, переданные через attach (serve.py), обслуживает сам этот поток:
+    он пишет события в неблокирующие сокеты через selectors и шлет пинги раз в
+    heartbeat секунд, поэтому потоки веб-сервера соединениями не заняты.
+    Если сервер не умеет отдавать соединение, поток ответа ждет свою очередь
+    (subscribe); таких подписчиков не больше max_subscribers.
+    """
+
+    def __init__(self, dm, poll_interval=1.0, max_subscribers=None, heartbeat=15):
+        self.dm = dm
+        self.poll_interval = poll_interval
+        self.max_subscribers = max_subscribers
+        self.heartbeat = heartbeat
+        self._subscribers = set()
+        self._streams = set()
+        self._pending = []
+        self._lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+        # Сокеты пробуждения и selector создаются при запуске потока (уже после fork)
+        self._wakeup = None
+        self._selector = None
+        self._changed = threading.Event()
+        dm.add_listener(self._notify)
+
+    def _start(self):
+        """Запуск потока рассылки (вызывать под self._lock)"""
+        if self._thread is None:
+            self._selector = selectors.DefaultSelector()
+            reader, self._wakeup = socket.socketpair()
+            reader.setblocking(False)
+            self._wakeup.setblocking(False)
+            self._selector.register(reader, selectors.EVENT_READ)
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _wake(self):
+        if self._wakeup is not None:
+            try:
+                self._wakeup.send(b'\0')
+            except (BlockingIOError, OSError):
+                pass  # цикл и так проснется: в сокете уже есть байт
+
+    def _notify(self):
+        self._changed.set()
+        self._wake()
+
+    def subscribe(self):
+        """Новый подписчик или None, если все max_subscribers мест заняты"""
+        subscriber = Subscriber()
+        with self._lock:
+            if self._closed:
+                subscriber.closed = True
+                return subscriber
+            if self.max_subscribers is not None and len(self._subscribers) >= self.max_subscribers:
+                return None
+            self._subscribers.add(subscriber)
+            self._start()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def attach(self, sock, data, render, version):
+        """Передача SSE-соединения циклу рассылки.
+
+        data — начало ответа (заголовки HTTP и пропущенные события), version — номер
+        изменения, по который они отправлены; render(changes) — текст событий.
+        """
+        with self._lock:
+            if self._closed:
+                sock.close()
+                return
+            self._pending.append(EventStream(sock, data, render, version))
+            self._start()
+        self._wake()
+
+    def close(self):
+        """Завершение всех подписок (при остановке процесса): соединения цикла
+        закрываются, подписчики получают closed, новые подписки сразу закрыты"""
+        with self._lock:
+            self._closed = True
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            subscriber.closed = True
+            try:
+                subscriber.queue.put_nowait(None)  # разбудить ожидающее соединение
+            except queue.Full:
+                pass
+        self._wake()
+        if self._thread is not None:
+            self._thread.join(5)
+
+    def _run(self):
+        version = self.dm.change_version()
+        polled = time.monotonic()
+        while not self._closed:
+            timeout = max(polled + self.poll_interval - time.monotonic(), 0)
+            for key, mask in self._selector.select(timeout):
+                if key.data is None:
+                    try:
+                        while key.fileobj.recv(4096):
+                            pass
+                    except (BlockingIOError, OSError):
+                        pass
+                    continue
+                stream = key.data
+                if mask & selectors.EVENT_READ and not self._receive(stream):
+                    self._drop(stream)
+                elif mask & selectors.EVENT_WRITE:
+                    self._flush(stream)
+            with self._lock:
+                pending, self._pending = self._pending, []
+            for stream in pending:
+                self._add(stream, version)
+
+            if self._changed.is_set() or time.monotonic() - polled >= self.poll_interval:
+                self._changed.clear()
+                polled = time.monotonic()
+                with self._lock:
+                    idle = not self._subscribers and not self._streams
+                if not idle and self.dm.change_version() != version:
+                    changes = self.dm.get_changes(version)
+                    if changes is None:
+                        version = self.dm.change_version()
+                    else:
+                        version = changes[0]
+                    self._publish((version, changes[1] if changes else None))
+
+            now = time.monotonic()
+            for stream in list(self._streams):
+                if now - stream.sent >= self.heartbeat:
+                    self._send(stream, ': ping\n\n')
+        for stream in list(self._streams):
+            self._drop(stream)
+
+    def _add(self, stream, version):
+        """Регистрация соединения; изменения между его началом и version досылаются"""
+        stream.sock.setblocking(False)
+        self._streams.add(stream)
+        self._selector.register(stream.sock, selectors.EVENT_READ, stream)
+        self._flush(stream)
+        if stream in self._streams and stream.version != version:
+            changes = self.dm.get_changes(stream.version)
+            self._deliver(stream, changes or (self.dm.change_version(), None))
+
+    def _receive(self, stream):
+        """Чтение из соединения клиента: False — клиент отключился"""
+        try:
+            return bool(stream.sock.recv(4096))
+        except BlockingIOError:
+            return True
+        except OSError:
+            return False
+
+    def _publish(self, batch):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.queue.put_nowait(batch)
+            except queue.Full:
+                subscriber.overflow = True
+        for stream in list(self._streams):
+            self._deliver(stream, batch)
+
+    def _deliver(self, stream, batch):
+        version, changes = batch
+        try:
+            if changes is None:
+                text = format_event('reset', {'version': version})
+            else:
+                text = stream.render([change for change in changes if change[1]['rev'] > stream.version])
+        except Exception:
+            logging.exception('Ошибка подготовки событий')
+            self._drop(stream)
+            return
+        stream.version = max(stream.version, version)
+        if text:
+            self._send(stream, text)
+
+    def _send(self, stream, text):
+        stream.buffer += text.encode('utf-8')
+        stream.sent = time.monotonic()
+        if len(stream.buffer) > STREAM_BUFFER_LIMIT:
+            self._drop(stream)
+        else:
+            self._flush(stream)
+
+    def _flush(self, stream):
+        if stream not in self._streams:
+            return
+        try:
+            while stream.buffer:
+                sent = stream.sock.send(stream.buffer)
+                del stream.buffer[:sent]
+        except BlockingIOError:
+            pass
+        except OSError:
+            self._drop(stream)
+            return
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if stream.buffer else 0)
+        self._selector.modify(stream.sock, events, stream)
+
+    def _drop(self, stream):
+        if stream not in self._streams:
+            return
+        self._streams.discard(stream)
+        self._selector.unregister(stream.sock)
+        try:
+            stream.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        stream.sock.close()
+
+    def stream_count(self):
+        """Число соединений в цикле рассылки"""
+        return len(self._streams)
+
+
+def format_event(event, data, event_id=None):
+    """Сообщение в формате text/event-stream"""
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'event: {event}')
+    lines.append(f'data: {json.dumps(data, ensure_ascii=False)}')
+    return '\n'.join(lines) + '\n\n'
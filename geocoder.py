@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Геокодирование адресов задач AWR
+Координаты ищутся в локальном справочнике адресов (gazetteer), найденные
+результаты сохраняются в постоянный кэш DataManager (коллекция geocode)
+"""
+
+import csv
+import json
+import os
+import sys
+
+from address_index import address_tokens, normalize_address
+
+
+class GeocodeError(Exception):
+    """Геокодер временно недоступен; такой ответ не кэшируется"""
+
+
+class GazetteerGeocoder:
+    """Офлайн геокодер по справочнику адресов: {нормализованный адрес: [широта, долгота]}.
+
+    Если дома нет в справочнике, но есть улица (адрес без номеров), возвращаются
+    координаты улицы — для карты этого достаточно.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._entries = None
+        self._mtime = None
+
+    def _load(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return {}
+        if mtime != self._mtime:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self._entries = json.load(f)
+            self._mtime = mtime
+        return self._entries
+
+    def geocode(self, address):
+        entries = self._load()
+        point = entries.get(normalize_address(address))
+        if point is None:
+            point = entries.get(street_key(address))
+        return tuple(point) if point else None
+
+
+class NominatimGeocoder:
+    """Геокодер OpenStreetMap Nominatim (нужен доступ в интернет)"""
+
+    URL = 'https://nominatim.openstreetmap.org/search'
+
+    def __init__(self, region=None, timeout=5):
+        self.region = region
+        self.timeout = timeout
+
+    def geocode(self, address):
+        """Координаты или None, если адрес не найден; при сбое сети — GeocodeError"""
+        import requests
+
+        query = f'{self.region}, {address}' if self.region else address
+        try:
+            response = requests.get(self.URL, params={'q': query, 'format': 'json', 'limit': 1},
+                                    headers={'User-Agent': 'awr-app'}, timeout=self.timeout)
+            response.raise_for_status()
+            results = response.json()
+        except (requests.RequestException, ValueError) as e:
+            raise GeocodeError(f'Nominatim недоступен: {e}') from e
+        if not results:
+            return None
+        return float(results[0]['lat']), float(results[0]['lon'])
+
+
+def street_key(address):
+    """Ключ улицы: нормализованный адрес без номеров домов и корпусов"""
+    return ' '.join(word for word in address_tokens(address) if not word.isdigit())
+
+
+def create_geocoder(name, gazetteer_path=None, region=None):
+    """Геокодер по имени из конфигурации"""
+    if name == 'gazetteer':
+        return GazetteerGeocoder(gazetteer_path)
+    if name == 'nominatim':
+        return NominatimGeocoder(region)
+    raise ValueError(f'Неизвестный геокодер: {name}')
+
+
+def import_gazetteer(csv_path, gazetteer_path):
+    """Пополнение справочника из CSV (адрес;широта;долгота); возвращает число адресов"""
+    try:
+        with open(gazetteer_path, 'r', encoding='utf-8') as f:
+            entries = json.load(f)
+    except FileNotFoundError:
+        entries = {}
+    count = 0
+    with open(csv_path, 'r', encoding='utf-8-sig', newline='') as f:
+        for row in csv.reader(f, delimiter=';'):
+            if len(row) < 3:
+                continue
+            try:
+                point = [float(row[1]), float(row[2])]
+            except ValueError:
+                continue  # строка заголовка
+            entries[normalize_address(row[0])] = point
+            entries.setdefault(street_key(row[0]), point)
+            count += 1
+    tmp_path = f'{gazetteer_path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(entries, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, gazetteer_path)
+    return count
+
+
+if __name__ == '__main__':
+    from config import GAZETTEER_PATH
+    from data_manager import DataManager
+
+    if len(sys.argv) == 3 and sys.argv[1] == 'import':
+        print(f'В справочник добавлено адресов: {import_gazetteer(sys.argv[2], GAZETTEER_PATH)}')
+        DataManager().clear_geocode_misses()
+    elif len(sys.argv) == 2 and sys.argv[1] == 'backfill':
+        print(f'Координаты найдены для задач: {DataManager().geocode_tasks()}')
+    else:
+        print('Использование:\n'
+              '  python geocoder.py import адреса.csv   # адрес;широта;долгота\n'
+              '  python geocoder.py backfill            # координаты для задач без них')
+        sys.exit(1)
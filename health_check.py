@@ -5,8 +5,8 @@
 """
 
 import os
+import importlib.util
 import json
-import requests
 import sys
 from datetime import datetime
 
@@ -60,7 +60,8 @@ def check_directories():
 def check_config():
     """Проверка конфигурации"""
     try:
-        from config import BOT_TOKEN, USERS, AUTHORIZED_PHONES
+        from config import BOT_TOKEN, USERS, AUTHORIZED_PHONES, CREDENTIALS_PATH
+        from credentials import CredentialStore
         
         issues = []
         
@@ -71,6 +72,9 @@ def check_config():
         # Проверка пользователей
         if not USERS:
             issues.append("Не настроены пользователи системы")
+        missing = CredentialStore(CREDENTIALS_PATH).missing(USERS)
+        if missing:
+            issues.append(f"Не заданы пароли: {', '.join(missing)} (python credentials.py set логин)")
         
         # Проверка авторизованных телефонов
         if not AUTHORIZED_PHONES:
@@ -109,8 +113,24 @@ def check_data_files():
         print(f"❌ Ошибка проверки файлов данных: {e}")
         return False
 
+def check_app():
+    """Проверка сборки приложения: create_app и ответ страницы входа без запуска сервера"""
+    try:
+        from app import create_app
+        response = create_app().test_client().get('/login')
+        if response.status_code != 200:
+            print(f"❌ Страница входа отвечает с кодом {response.status_code}")
+            return False
+        print("✅ Приложение создается и отвечает")
+        return True
+    except Exception as e:
+        print(f"❌ Ошибка создания приложения: {e}")
+        return False
+
 def check_web_app(port=5000):
     """Проверка доступности веб-приложения"""
+    import requests
+
     try:
         url = f"http://localhost:{port}"
         response = requests.get(url, timeout=5)
@@ -131,17 +151,20 @@ def check_web_app(port=5000):
 
 def check_dependencies():
     """Проверка зависимостей Python"""
-    try:
-        import flask
-        import aiogram
-        import pandas
-        import werkzeug
-        print("✅ Все Python зависимости установлены")
-        return True
-    except ImportError as e:
-        print(f"❌ Отсутствует зависимость: {e}")
+    # Модули только ищутся, а не импортируются: pandas и aiogram загружаются долго
+    missing = [name for name in ('flask', 'aiogram', 'pandas', 'werkzeug')
+               if importlib.util.find_spec(name) is None]
+    if missing:
+        print(f"❌ Отсутствует зависимость: {', '.join(missing)}")
         print("Выполните: pip install -r requirements.txt")
         return False
+    print("✅ Все Python зависимости установлены")
+    return True
+
+def check_startup_time():
+    """Проверка бюджета времени импорта модулей (см. startup_profile.py)"""
+    from startup_profile import check_startup
+    return check_startup(repeat=1, top=3)
 
 def run_full_check():
     """Полная проверка системы"""
@@ -155,6 +178,8 @@ def run_full_check():
         ("Python зависимости", check_dependencies),
         ("Конфигурация", check_config),
         ("Файлы данных", check_data_files),
+        ("Приложение", check_app),
+        ("Время запуска", check_startup_time),
     ]
     
     results = []
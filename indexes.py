@@ -0,0 +1,213 @@
+import bisect
+import math
+
+
+class GridCell:
+    """Поле пространственного индекса: ячейка сетки size x size градусов по lat/lon записи"""
+
+    def __init__(self, size):
+        self.size = size
+
+    def __call__(self, record):
+        lat, lon = record.get('lat'), record.get('lon')
+        if lat is None or lon is None:
+            return None
+        return math.floor(lat / self.size), math.floor(lon / self.size)
+
+    def cell_range(self, bbox):
+        """Диапазоны строк и столбцов ячеек, покрывающих bbox (юг, запад, север, восток)"""
+        south, west, north, east = bbox
+        return (range(math.floor(south / self.size), math.floor(north / self.size) + 1),
+                range(math.floor(west / self.size), math.floor(east / self.size) + 1))
+
+
+class ClusterIndex:
+    """Заранее посчитанные кластеры записей с координатами по уровням масштаба карты.
+
+    levels — {уровень: размер ячейки в градусах}. В каждой ячейке уровня записи
+    разбиты на группы по значениям полей group_fields; для группы хранятся число
+    записей и суммы координат. Кластеры области собираются из ячеек без перебора
+    записей, а сам индекс обновляется по одной записи.
+    """
+
+    def __init__(self, levels, group_fields, records=()):
+        self.grids = {level: GridCell(size) for level, size in levels.items()}
+        self.group_fields = group_fields
+        self.cells = {level: {} for level in levels}
+        for record in records:
+            self.add(record)
+
+    def add(self, record, sign=1):
+        lat, lon = record.get('lat'), record.get('lon')
+        if lat is None or lon is None:
+            return
+        group = tuple(record.get(field) for field in self.group_fields)
+        for level, grid in self.grids.items():
+            cells = self.cells[level]
+            cell = grid(record)
+            groups = cells.setdefault(cell, {})
+            stats = groups.setdefault(group, [0, 0.0, 0.0])
+            stats[0] += sign
+            stats[1] += sign * lat
+            stats[2] += sign * lon
+            if not stats[0]:
+                del groups[group]
+                if not groups:
+                    del cells[cell]
+
+    def remove(self, record):
+        self.add(record, -1)
+
+    def replace(self, old, record):
+        self.remove(old)
+        self.add(record)
+
+    def level(self, zoom):
+        """Ближайший посчитанный уровень"""
+        return min(max(zoom, min(self.grids)), max(self.grids))
+
+    def clusters(self, level, bbox, accept=None):
+        """Кластеры ячеек уровня, пересекающих bbox: [(число, широта, долгота, {группа: число})].
+
+        Координаты кластера — центр масс его записей. accept(группа) отбирает
+        группы (например, по фильтрам и правам пользователя); ячейки без
+        отобранных групп пропускаются.
+        """
+        grid, cells = self.grids[level], self.cells[level]
+        rows, cols = grid.cell_range(bbox)
+        if len(rows) * len(cols) <= len(cells):
+            candidates = (cells[(row, col)] for row in rows for col in cols if (row, col) in cells)
+        else:
+            candidates = (groups for cell, groups in cells.items() if cell[0] in rows and cell[1] in cols)
+        result = []
+        for groups in candidates:
+            count, lat_sum, lon_sum, counts = 0, 0.0, 0.0, {}
+            for group, stats in groups.items():
+                if accept is not None and not accept(group):
+                    continue
+                count += stats[0]
+                lat_sum += stats[1]
+                lon_sum += stats[2]
+                counts[group] = stats[0]
+            if count:
+                result.append((count, lat_sum / count, lon_sum / count, counts))
+        return result
+
+
+def in_bbox(record, bbox):
+    lat, lon = record.get('lat'), record.get('lon')
+    if lat is None or lon is None:
+        return False
+    south, west, north, east = bbox
+    return south <= lat <= north and west <= lon <= east
+
+
+def _key(record, field):
+    """Значение индексируемого поля; для составного индекса (кортеж полей) — кортеж значений"""
+    if callable(field):
+        return field(record)
+    if isinstance(field, tuple):
+        return tuple(record.get(name) for name in field)
+    return record.get(field)
+
+
+class RecordIndex:
+    """Индексы коллекции-списка в памяти: по id и по значениям выбранных полей.
+
+    Поле индекса — имя поля, кортеж имен для составного индекса или функция
+    от записи (например, GridCell для поиска по координатам).
+    Записи внутри индекса общие с кэшем DataManager и не должны изменяться
+    на месте — при обновлении запись заменяется новым объектом.
+    """
+
+    def __init__(self, records, fields=()):
+        self.records = []
+        self.by_id = {}
+        self.positions = {}
+        self.fields = fields
+        self.by_field = {field: {} for field in fields}
+        self.max_id = 0
+        for record in records:
+            self.add(record)
+
+    def add(self, record):
+        record_id = record['id']
+        self.positions[record_id] = len(self.records)
+        self.records.append(record)
+        self.by_id[record_id] = record
+        self.max_id = max(self.max_id, record_id)
+        for field in self.fields:
+            self.by_field[field].setdefault(_key(record, field), {})[record_id] = record
+
+    def replace(self, record):
+        """Замена записи с тем же id новой версией"""
+        record_id = record['id']
+        old = self.by_id[record_id]
+        for field in self.fields:
+            values = self.by_field[field]
+            old_value, new_value = _key(old, field), _key(record, field)
+            if old_value == new_value:
+                values[new_value][record_id] = record
+                continue
+            del values[old_value][record_id]
+            if not values[old_value]:
+                del values[old_value]
+            values.setdefault(new_value, {})[record_id] = record
+        self.records[self.positions[record_id]] = record
+        self.by_id[record_id] = record
+
+    def get(self, record_id):
+        return self.by_id.get(record_id)
+
+    def within(self, grid, bbox):
+        """Записи с координатами внутри bbox по сеточному индексу grid: {id: запись}"""
+        cells = self.by_field[grid]
+        rows, cols = grid.cell_range(bbox)
+        if len(rows) * len(cols) <= len(cells):
+            candidates = (cells.get((row, col), {}) for row in rows for col in cols)
+        else:
+            # Большая область: дешевле перебрать непустые ячейки
+            candidates = (records for cell, records in cells.items()
+                          if cell is not None and cell[0] in rows and cell[1] in cols)
+        return {record_id: record for records in candidates
+                for record_id, record in records.items() if in_bbox(record, bbox)}
+
+    def lookup(self, field, value):
+        """Записи с заданным значением поля в порядке id"""
+        return sorted(self.by_field[field].get(value, {}).values(), key=lambda record: record['id'])
+
+
+class ChangeLog:
+    """Журнал изменений записей в памяти, упорядоченный по номеру изменения rev.
+
+    Запись журнала — (коллекция, id, прежняя версия записи или None для новой).
+    Хранится не больше limit записей; изменения до floor недоступны.
+    """
+
+    def __init__(self, floor, limit):
+        self.floor = floor
+        self.limit = limit
+        self.revs = []
+        self.entries = []
+
+    def add(self, rev, data_type, record_id, before):
+        # Изменения, найденные при перезагрузке коллекции, могут прийти не по порядку
+        position = bisect.bisect_right(self.revs, rev)
+        self.revs.insert(position, rev)
+        self.entries.insert(position, (data_type, record_id, before))
+        if len(self.revs) > self.limit:
+            dropped = len(self.revs) - self.limit // 2
+            self.floor = self.revs[dropped - 1]
+            del self.revs[:dropped]
+            del self.entries[:dropped]
+
+    def since(self, rev):
+        """Записи, измененные после rev: {(коллекция, id): версия до первого такого изменения};
+        None — журнал начинается позже rev"""
+        if rev < self.floor:
+            return None
+        changed = {}
+        for position in range(bisect.bisect_right(self.revs, rev), len(self.revs)):
+            data_type, record_id, before = self.entries[position]
+            changed.setdefault((data_type, record_id), before)
+        return changed
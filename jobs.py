@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+"""
+Фоновые задания: очередь в SQLite и пул потоков-исполнителей
+Запрос ставит задание в очередь (enqueue) и сразу отвечает; исполнители
+берут задания по одному, при ошибке повторяют их с растущей паузой, а после
+JOB_MAX_ATTEMPTS попыток отмечают как failed. Задание, взятое упавшим
+процессом, возвращается в очередь по истечении аренды (JOB_LEASE); результат
+исполнителя, чья аренда истекла, не записывается.
+
+Исполнители работают внутри процессов приложения (JOB_WORKERS потоков) или
+отдельным процессом рядом с ним:
+    python jobs.py run         # исполнители без веб-сервера
+    python jobs.py stats       # число заданий по статусам
+    python jobs.py retry ID    # вернуть задание failed в очередь
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+from config import JOBS_DB_PATH, JOB_WORKERS, JOB_MAX_ATTEMPTS, JOB_RETRY_DELAY, JOB_LEASE, JOB_POLL_INTERVAL
+
+STATUSES = ('reserved', 'queued', 'running', 'done', 'failed')
+# Аренда задания не потеряна: оно в работе у той же попытки и срок аренды не истек
+LEASE_HELD = "id = ? AND status = 'running' AND attempts = ? AND locked_until >= ?"
+
+
+class PermanentError(Exception):
+    """Ошибка, которую повтор не исправит: задание сразу отмечается failed"""
+
+
+class JobQueue:
+    """Очередь заданий в таблице jobs базы SQLite.
+
+    Задание — вид (kind), JSON-параметры и необязательный ключ идемпотентности:
+    повторная постановка с тем же ключом возвращает уже существующее задание.
+    Ключ можно занять заранее (reserve), до того как известны параметры задания.
+    """
+
+    def __init__(self, db_path=JOBS_DB_PATH, max_attempts=JOB_MAX_ATTEMPTS, retry_delay=JOB_RETRY_DELAY,
+                 lease=JOB_LEASE):
+        self.db_path = db_path
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.lease = lease
+        self._local = threading.local()
+        self._added = threading.Condition()
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        with self.conn as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS jobs (id INTEGER PRIMARY KEY, kind TEXT NOT NULL, '
+                         'payload TEXT NOT NULL, key TEXT UNIQUE, status TEXT NOT NULL, '
+                         'attempts INTEGER NOT NULL DEFAULT 0, max_attempts INTEGER NOT NULL, '
+                         'run_at REAL NOT NULL, locked_until REAL, created REAL NOT NULL, '
+                         'updated REAL NOT NULL, error TEXT, result TEXT)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status_run_at ON jobs(status, run_at)')
+        # Соединение не должно перейти в воркеры serve.py через fork
+        self.close()
+
+    @property
+    def conn(self):
+        """Отдельное соединение на каждый поток (и процесс)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            conn.close()
+        self._local.conn = None
+
+    def _write(self):
+        """Транзакция записи: BEGIN IMMEDIATE сразу берет блокировку базы"""
+        conn = self.conn
+        conn.execute('BEGIN IMMEDIATE')
+        return conn
+
+    def enqueue(self, kind, payload, key=None, delay=0, max_attempts=None):
+        """Постановка задания в очередь; возвращает id (существующего задания, если key уже был)"""
+        now = time.time()
+        conn = self._write()
+        try:
+            if key is not None:
+                row = conn.execute('SELECT id FROM jobs WHERE key = ?', (key,)).fetchone()
+                if row:
+                    conn.execute('COMMIT')
+                    return row['id']
+            job_id = conn.execute(
+                'INSERT INTO jobs (kind, payload, key, status, max_attempts, run_at, created, updated) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (kind, json.dumps(payload, ensure_ascii=False), key, 'queued',
+                 max_attempts or self.max_attempts, now + delay, now, now)).lastrowid
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        with self._added:
+            self._added.notify()
+        return job_id
+
+    def reserve(self, kind, key):
+        """Резерв ключа до постановки задания: id резерва или None, если ключ уже занят.
+
+        Резерв не выполняется, пока его не поставят в очередь (submit), и удаляется
+        cancel; резерв упавшего процесса освобождается через lease.
+        """
+        now = time.time()
+        conn = self._write()
+        try:
+            row = conn.execute('SELECT id, status, locked_until FROM jobs WHERE key = ?', (key,)).fetchone()
+            if row and (row['status'] != 'reserved' or row['locked_until'] >= now):
+                conn.execute('COMMIT')
+                return None
+            if row:
+                conn.execute('DELETE FROM jobs WHERE id = ?', (row['id'],))
+            job_id = conn.execute(
+                'INSERT INTO jobs (kind, payload, key, status, max_attempts, run_at, locked_until, created, updated) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (kind, 'null', key, 'reserved', self.max_attempts, now, now + self.lease, now, now)).lastrowid
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return job_id
+
+    def submit(self, job_id, payload):
+        """Постановка зарезервированного задания в очередь; False — резерва уже нет"""
+        now = time.time()
+        cursor = self.conn.execute("UPDATE jobs SET status = 'queued', payload = ?, run_at = ?, locked_until = NULL, "
+                                   "updated = ? WHERE id = ? AND status = 'reserved'",
+                                   (json.dumps(payload, ensure_ascii=False), now, now, job_id))
+        if cursor.rowcount:
+            with self._added:
+                self._added.notify()
+        return cursor.rowcount > 0
+
+    def cancel(self, job_id):
+        """Освобождение резерва (задание, уже поставленное в очередь, не затрагивается)"""
+        self.conn.execute("DELETE FROM jobs WHERE id = ? AND status = 'reserved'", (job_id,))
+
+    def claim(self):
+        """Следующее готовое задание, взятое в работу, или None.
+
+        Задание с истекшей арендой берется повторно, если у него остались попытки,
+        иначе отмечается failed. Номер попытки attempts — токен аренды для complete и fail.
+        """
+        now = time.time()
+        conn = self._write()
+        try:
+            conn.execute("UPDATE jobs SET status = 'failed', locked_until = NULL, "
+                         "error = COALESCE(error || '; ', '') || 'Аренда истекла на последней попытке', "
+                         "updated = ? WHERE status = 'running' AND locked_until < ? AND attempts >= max_attempts",
+                         (now, now))
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE (status = 'queued' AND run_at <= ?) "
+                "OR (status = 'running' AND locked_until < ? AND attempts < max_attempts) "
+                "ORDER BY run_at, id LIMIT 1",
+                (now, now)).fetchone()
+            if row is not None:
+                conn.execute("UPDATE jobs SET status = 'running', attempts = attempts + 1, "
+                             "locked_until = ?, updated = ? WHERE id = ?", (now + self.lease, now, row['id']))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        if row is None:
+            return None
+        job = self._job(row)
+        job['attempts'] += 1
+        job['status'] = 'running'
+        return job
+
+    def complete(self, job, result=None):
+        """Задание job (из claim) выполнено; False — аренда потеряна и результат не записан"""
+        now = time.time()
+        conn = self._write()
+        try:
+            cursor = conn.execute("UPDATE jobs SET status = 'done', locked_until = NULL, error = NULL, result = ?, "
+                                  "updated = ? WHERE " + LEASE_HELD,
+                                  (json.dumps(result, ensure_ascii=False), now, job['id'], job['attempts'], now))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return cursor.rowcount > 0
+
+    def fail(self, job, error, permanent=False):
+        """Ошибка задания job (из claim): повтор через retry_delay * 2^(попытка-1) или статус failed.
+        False — аренда потеряна и ошибка не записана"""
+        now = time.time()
+        if permanent or job['attempts'] >= job['max_attempts']:
+            sql, params = "status = 'failed', locked_until = NULL, error = ?, updated = ?", (error, now)
+        else:
+            run_at = now + self.retry_delay * 2 ** (job['attempts'] - 1)
+            sql, params = ("status = 'queued', locked_until = NULL, error = ?, run_at = ?, updated = ?",
+                           (error, run_at, now))
+        conn = self._write()
+        try:
+            cursor = conn.execute('UPDATE jobs SET ' + sql + ' WHERE ' + LEASE_HELD,
+                                  params + (job['id'], job['attempts'], now))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return cursor.rowcount > 0
+
+    def retry(self, job_id):
+        """Возврат задания failed в очередь с новым запасом попыток; False — задание не failed"""
+        now = time.time()
+        cursor = self.conn.execute("UPDATE jobs SET status = 'queued', attempts = 0, run_at = ?, updated = ? "
+                                   "WHERE id = ? AND status = 'failed'", (now, now, job_id))
+        if cursor.rowcount:
+            with self._added:
+                self._added.notify()
+        return cursor.rowcount > 0
+
+    @staticmethod
+    def _job(row):
+        job = dict(row)
+        job['payload'] = json.loads(job['payload'])
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+    def get(self, job_id):
+        row = self.conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return self._job(row) if row else None
+
+    def find(self, key):
+        """Задание по ключу идемпотентности или None"""
+        row = self.conn.execute('SELECT * FROM jobs WHERE key = ?', (key,)).fetchone()
+        return self._job(row) if row else None
+
+    def stats(self):
+        """Число заданий по статусам и возраст самого старого готового к запуску (сек)"""
+        counts = dict.fromkeys(STATUSES, 0)
+        counts.update(self.conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+        oldest = self.conn.execute("SELECT MIN(run_at) FROM jobs WHERE status = 'queued' AND run_at <= ?",
+                                   (time.time(),)).fetchone()[0]
+        counts['oldest_queued_seconds'] = round(time.time() - oldest, 1) if oldest else 0
+        return counts
+
+    def wait(self, timeout):
+        """Ожидание постановки задания в этом процессе (из других — не дольше timeout)"""
+        with self._added:
+            self._added.wait(timeout)
+
+    def wake(self):
+        """Пробуждение всех ожидающих в wait"""
+        with self._added:
+            self._added.notify_all()
+
+
+class JobWorkers:
+    """Пул потоков, выполняющих задания очереди обработчиками handlers {вид: функция(payload)}"""
+
+    def __init__(self, queue, handlers, threads=JOB_WORKERS, poll_interval=JOB_POLL_INTERVAL):
+        self.queue = queue
+        self.handlers = handlers
+        self.threads = threads
+        self.poll_interval = poll_interval
+        self._stopping = False
+        self._threads = []
+
+    def start(self):
+        for index in range(self.threads):
+            thread = threading.Thread(target=self._work, name=f'job-worker-{index}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        """Остановка после текущих заданий; False — не все потоки завершились за timeout"""
+        self._stopping = True
+        self.queue.wake()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(None if deadline is None else max(deadline - time.monotonic(), 0))
+        return not any(thread.is_alive() for thread in self._threads)
+
+    def run_once(self):
+        """Выполнение одного готового задания; False — очередь пуста"""
+        job = self.queue.claim()
+        if job is None:
+            return False
+        handler = self.handlers.get(job['kind'])
+        try:
+            if handler is None:
+                raise PermanentError(f"Нет обработчика заданий {job['kind']}")
+            result = handler(job['payload'])
+        except PermanentError as e:
+            logging.error(f"Задание {job['id']} ({job['kind']}) не выполнено: {e}")
+            held = self.queue.fail(job, str(e), permanent=True)
+        except Exception as e:
+            logging.exception(f"Ошибка задания {job['id']} ({job['kind']}), попытка {job['attempts']}")
+            held = self.queue.fail(job, f'{type(e).__name__}: {e}')
+        else:
+            held = self.queue.complete(job, result)
+        if not held:
+            logging.warning(f"Аренда задания {job['id']} ({job['kind']}) истекла до завершения попытки "
+                            f"{job['attempts']}: результат не записан")
+        return True
+
+    def _work(self):
+        while not self._stopping:
+            try:
+                if not self.run_once():
+                    self.queue.wait(self.poll_interval)
+            except sqlite3.Error:
+                logging.exception('Ошибка очереди заданий')
+                time.sleep(self.poll_interval)
+        self.queue.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+    queue = JobQueue()
+    if len(sys.argv) == 2 and sys.argv[1] == 'run':
+        import signal
+        from data_manager import DataManager
+        from report_jobs import make_handlers
+
+        workers = JobWorkers(queue, make_handlers(DataManager(), queue), max(JOB_WORKERS, 1))
+        stopped = threading.Event()
+        signal.signal(signal.SIGTERM, lambda signum, frame: stopped.set())
+        workers.start()
+        logging.info(f'Исполнители заданий запущены, потоков: {workers.threads}')
+        try:
+            while not stopped.wait(1):
+                pass
+        except KeyboardInterrupt:
+            pass
+        workers.stop()
+    elif len(sys.argv) == 2 and sys.argv[1] == 'stats':
+        print(json.dumps(queue.stats(), ensure_ascii=False, indent=2))
+    elif len(sys.argv) == 3 and sys.argv[1] == 'retry' and sys.argv[2].isdigit():
+        if not queue.retry(int(sys.argv[2])):
+            print(f'Задание {sys.argv[2]} не найдено или не в статусе failed')
+            sys.exit(1)
+        print(f'Задание {sys.argv[2]} возвращено в очередь')
+    else:
+        print('Использование:\n'
+              '  python jobs.py run         # исполнители заданий без веб-сервера\n'
+              '  python jobs.py stats       # число заданий по статусам\n'
+              '  python jobs.py retry ID    # вернуть задание failed в очередь')
+        sys.exit(1)
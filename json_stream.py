@@ -0,0 +1,85 @@
+import json
+import zlib
+
+from flask import Response
+
+try:
+    import brotli
+except ImportError:  # brotli необязателен: без него отдаем gzip
+    brotli = None
+
+# Размер порции, которую копим перед сжатием и отправкой (байт)
+CHUNK_SIZE = 16 * 1024
+
+
+def negotiate_encoding(accept_encodings):
+    """Лучшее сжатие из поддерживаемых клиентом: 'br', 'gzip' или None"""
+    if brotli is not None and accept_encodings['br']:
+        return 'br'
+    if accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+
+def iter_json(items, fields=None, items_key=None):
+    """JSON по частям: массив из генератора items или, если задан items_key,
+    объект с полями fields и этим массивом под ключом items_key.
+
+    Элементы сериализуются по одному, поэтому ответ целиком в памяти не строится.
+    """
+    if items_key is None:
+        yield '['
+    else:
+        head = json.dumps(fields or {}, ensure_ascii=False)
+        separator = ', ' if fields else ''
+        yield f'{head[:-1]}{separator}{json.dumps(items_key)}: ['
+    first = True
+    for item in items:
+        if not first:
+            yield ', '
+        first = False
+        yield json.dumps(item, ensure_ascii=False)
+    yield ']' if items_key is None else ']}'
+
+
+def _buffered(chunks):
+    """Склейка мелких частей в порции по CHUNK_SIZE байт"""
+    buffer = []
+    size = 0
+    for chunk in chunks:
+        data = chunk.encode('utf-8')
+        buffer.append(data)
+        size += len(data)
+        if size >= CHUNK_SIZE:
+            yield b''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def _compressed(chunks, encoding):
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=5)
+        for chunk in chunks:
+            data = compressor.process(chunk)
+            if data:
+                yield data
+        yield compressor.finish()
+        return
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # 31 — формат gzip
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream_json(items, fields=None, items_key=None, encoding=None):
+    """Потоковый JSON ответ (см. iter_json), при encoding — сжатый 'gzip' или 'br'"""
+    body = _buffered(iter_json(items, fields, items_key))
+    response = Response(_compressed(body, encoding) if encoding else body, mimetype='application/json')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
@@ -0,0 +1,91 @@
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировки между процессами недоступны
+    fcntl = None
+
+# Слот коллекции в файле версий: номер версии и время последнего изменения (нс)
+_SLOT = struct.Struct('<QQ')
+
+
+class CollectionLocks:
+    """Блокировки коллекций между процессами и счетчики их версий.
+
+    Для каждой коллекции есть файл <lock_dir>/<name>.lock, на который берется
+    flock: разделяемый для чтения, эксклюзивный для чтения-изменения-записи.
+    Каждое взятие открывает файл заново, поэтому блокировки работают и между
+    потоками одного процесса; повторное взятие в том же потоке пропускается.
+
+    Версии коллекций лежат в общем файле versions, отображенном в память
+    (mmap): запись увеличивает счетчик под эксклюзивной блокировкой, а
+    остальные процессы сравнивают его со своим кэшем без системных вызовов.
+    Рядом со счетчиком хранится время последнего изменения коллекции.
+    """
+
+    def __init__(self, lock_dir, names):
+        self.lock_dir = lock_dir
+        os.makedirs(lock_dir, exist_ok=True)
+        self.slots = {name: i for i, name in enumerate(sorted(names))}
+        self._held = threading.local()
+        self._versions = self._map_versions(os.path.join(lock_dir, 'versions'))
+
+    def _map_versions(self, path):
+        size = _SLOT.size * len(self.slots)
+        with open(path, 'a+b') as f:
+            if os.fstat(f.fileno()).st_size < size:
+                f.truncate(size)
+            return mmap.mmap(f.fileno(), size)
+
+    def _held_modes(self):
+        if not hasattr(self._held, 'modes'):
+            self._held.modes = {}
+        return self._held.modes
+
+    @contextmanager
+    def _acquire(self, names, exclusive):
+        held = self._held_modes()
+        files = []
+        try:
+            # Единый порядок взятия исключает взаимные блокировки
+            for name in sorted(set(names)):
+                if name in held and (held[name] or not exclusive):
+                    continue
+                if name in held:
+                    raise RuntimeError(f'Нельзя повысить разделяемую блокировку до эксклюзивной: {name}')
+                f = open(os.path.join(self.lock_dir, f'{name}.lock'), 'a+b')
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+                held[name] = exclusive
+                files.append((name, f))
+            yield
+        finally:
+            for name, f in reversed(files):
+                del held[name]
+                f.close()
+
+    def shared(self, *names):
+        """Разделяемая блокировка на время чтения"""
+        return self._acquire(names, exclusive=False)
+
+    def exclusive(self, *names):
+        """Эксклюзивная блокировка на время чтения-изменения-записи"""
+        return self._acquire(names, exclusive=True)
+
+    def version(self, name):
+        return _SLOT.unpack_from(self._versions, self.slots[name] * _SLOT.size)[0]
+
+    def modified(self, name):
+        """Время последнего изменения коллекции (unix-время; None — изменений еще не было)"""
+        modified_ns = _SLOT.unpack_from(self._versions, self.slots[name] * _SLOT.size)[1]
+        return modified_ns / 1e9 if modified_ns else None
+
+    def bump(self, name):
+        """Увеличение версии коллекции (вызывать под эксклюзивной блокировкой)"""
+        offset = self.slots[name] * _SLOT.size
+        _SLOT.pack_into(self._versions, offset, _SLOT.unpack_from(self._versions, offset)[0] + 1, time.time_ns())
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Перенос фотографий отчетов в хранилище по содержимому
+Снимки из корня uploads/photos (имена вида 20240115_103000_photo.jpg) получают
+имя по SHA-256 содержимого и переносятся в подкаталоги ab/cd/ (см. photos.py);
+одинаковые снимки остаются в одном экземпляре. Ссылки на фото в отчетах, рабочих
+и архивных, переписываются на новые имена.
+
+Перенос можно прервать в любой момент: сначала снимки и превью появляются под
+новыми именами (жесткой ссылкой или копией), затем переписываются отчеты и
+только потом удаляются старые файлы; повторный запуск продолжает с того же места.
+
+    python migrate_photos.py [--dry-run]
+"""
+
+import argparse
+import os
+import shutil
+
+from config import PHOTOS_DIR, PHOTO_THUMBNAILS
+from photos import EXTENSIONS, FORMATS, HASHED_NAME, file_digest, iter_photos, photo_path, thumbnail_name
+
+
+def _link(source, target):
+    """Файл source под вторым именем target (без копирования данных, если возможно)"""
+    if os.path.exists(target):
+        return
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+
+def plan(photos_dir=PHOTOS_DIR):
+    """Новые имена снимков: {прежнее имя: <sha256>.<расширение>}"""
+    mapping = {}
+    for name in sorted(iter_photos(photos_dir)):
+        if HASHED_NAME.fullmatch(name):
+            continue
+        extension = EXTENSIONS[FORMATS[os.path.splitext(name)[1][1:].lower()]]
+        mapping[name] = f'{file_digest(os.path.join(photos_dir, name))}.{extension}'
+    return mapping
+
+
+def remap_photos(mapping):
+    """Функция для отчета: заменяет имена фото по mapping, убирает повторы; True — отчет изменен"""
+
+    def remap(report):
+        photos = report.get('photos') or []
+        renamed = list(dict.fromkeys(mapping.get(name, name) for name in photos))
+        if renamed == photos:
+            return False
+        report['photos'] = renamed
+        return True
+
+    return remap
+
+
+def migrate(dm, photos_dir=PHOTOS_DIR, dry_run=False):
+    """Перенос снимков и ссылок в отчетах; возвращает сводку"""
+    mapping = plan(photos_dir)
+    summary = {
+        'photos': len(mapping),
+        'unique': len(set(mapping.values())),
+        'duplicate_bytes': 0,
+        'reports': 0,
+        'archived_reports': 0
+    }
+    seen = set()
+    for name, new_name in mapping.items():
+        if new_name in seen:
+            summary['duplicate_bytes'] += os.path.getsize(os.path.join(photos_dir, name))
+        seen.add(new_name)
+    if dry_run:
+        return summary
+
+    for name, new_name in mapping.items():
+        _link(os.path.join(photos_dir, name), os.path.join(photos_dir, photo_path(new_name)))
+        for size in PHOTO_THUMBNAILS:
+            thumbnail = os.path.join(photos_dir, thumbnail_name(name, size))
+            if os.path.exists(thumbnail):
+                _link(thumbnail, os.path.join(photos_dir, thumbnail_name(new_name, size)))
+
+    remap = remap_photos(mapping)
+    with dm.transaction('reports') as tx:
+        summary['reports'] = sum(1 for report in tx.load('reports') if remap(report))
+    summary['archived_reports'] = dm.archive.update_reports(remap)
+
+    for name in mapping:
+        os.remove(os.path.join(photos_dir, name))
+        for size in PHOTO_THUMBNAILS:
+            thumbnail = os.path.join(photos_dir, thumbnail_name(name, size))
+            if os.path.exists(thumbnail):
+                os.remove(thumbnail)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Перенос фото отчетов в хранилище по содержимому')
+    parser.add_argument('--dir', default=PHOTOS_DIR, help='Каталог фотографий')
+    parser.add_argument('--dry-run', action='store_true', help='Только показать, что будет перенесено')
+    args = parser.parse_args()
+
+    from data_manager import DataManager
+
+    summary = migrate(DataManager(), args.dir, args.dry_run)
+    print(f"Снимков со старыми именами: {summary['photos']}, уникальных: {summary['unique']}, "
+          f"повторы занимали {summary['duplicate_bytes'] / 1024 / 1024:.1f} МБ")
+    if args.dry_run:
+        print('Пробный запуск: файлы и отчеты не изменены')
+    else:
+        print(f"Обновлено отчетов: {summary['reports']}, архивных: {summary['archived_reports']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+Обработка фотографий отчетов
+Снимок поворачивается по EXIF, теряет метаданные (EXIF с координатами GPS,
+модель телефона), уменьшается до PHOTO_MAX_EDGE по длинной стороне и
+пересжимается в PHOTO_FORMAT; рядом в thumbs/<размер>/ сохраняются превью
+PHOTO_THUMBNAILS с тем же именем. Pillow импортируется только при обработке.
+
+Имя снимка — SHA-256 загруженного файла (<хеш>.jpg), снимок лежит в
+подкаталогах по первым символам хеша: ab/cd/abcd….jpg. Повторно загруженный
+тот же файл получает то же имя и не сохраняется второй раз. Снимки, загруженные
+до этого, лежат в корне каталога под прежними именами (см. migrate_photos.py).
+
+Повторная обработка уже загруженных фото (снимки с превью пропускаются):
+    python photos.py [--force] [--workers N]
+"""
+
+import argparse
+import hashlib
+import os
+import re
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from config import PHOTOS_DIR, PHOTOS_INCOMING_DIR, PHOTO_MAX_EDGE, PHOTO_QUALITY, PHOTO_FORMAT, PHOTO_THUMBNAILS, PHOTO_MAX_PIXELS
+
+# Расширения файлов форматов Pillow и обратно
+EXTENSIONS = {'JPEG': 'jpg', 'WEBP': 'webp', 'PNG': 'png', 'GIF': 'gif'}
+FORMATS = {'jpg': 'JPEG', 'jpeg': 'JPEG', 'webp': 'WEBP', 'png': 'PNG', 'gif': 'GIF'}
+
+# Форматы, в которых снимок пересохраняется на месте при повторной обработке
+REENCODED_FORMATS = ('JPEG', 'WEBP', 'PNG')
+
+# Имя снимка по содержимому: SHA-256 и расширение
+HASHED_NAME = re.compile(r'[0-9a-f]{64}\.[0-9a-z]+')
+
+# Размер части, которыми загружаемый файл пишется на диск (байт)
+CHUNK_SIZE = 1024 * 1024
+
+
+class PhotoError(ValueError):
+    """Файл не удалось прочитать как изображение"""
+
+
+def photo_name(filename):
+    """Имя обработанного снимка: расширение заменяется на расширение PHOTO_FORMAT"""
+    return f'{os.path.splitext(filename)[0]}.{EXTENSIONS[PHOTO_FORMAT]}'
+
+
+def photo_path(name):
+    """Путь снимка относительно PHOTOS_DIR: ab/cd/<имя> для имени по хешу, иначе само имя"""
+    if HASHED_NAME.fullmatch(name):
+        return f'{name[:2]}/{name[2:4]}/{name}'
+    return name
+
+
+def thumbnail_name(name, size):
+    """Путь превью снимка name относительно PHOTOS_DIR: thumbs/<размер>/<путь снимка> в PHOTO_FORMAT"""
+    extension = EXTENSIONS[PHOTO_FORMAT]
+    path = photo_path(name)
+    if os.path.splitext(name)[1][1:].lower() != extension:
+        path = f'{path}.{extension}'  # превью a.png и a.jpg не должны совпадать
+    return f'thumbs/{size}/{path}'
+
+
+def _load(source):
+    """Снимок, повернутый по EXIF и уменьшенный до PHOTO_MAX_EDGE"""
+    from PIL import Image, ImageOps
+
+    try:
+        image = Image.open(source)
+        width, height = image.size
+        if width * height > PHOTO_MAX_PIXELS:
+            raise PhotoError(f'слишком большое изображение: {width}x{height}')
+        scale = PHOTO_MAX_EDGE / max(width, height)
+        if scale < 1:
+            # JPEG сразу декодируется в уменьшенном в 2-8 раз масштабе — быстрее и меньше памяти
+            image.draft('RGB', (int(width * scale) + 1, int(height * scale) + 1))
+        image = ImageOps.exif_transpose(image)
+        if image.mode in ('1', 'P'):
+            # Палитру нельзя уменьшать сглаживанием
+            image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+        image.thumbnail((PHOTO_MAX_EDGE, PHOTO_MAX_EDGE), Image.Resampling.LANCZOS)
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError) as e:
+        raise PhotoError(str(e)) from e
+    return image
+
+
+def _prepare(image, image_format):
+    """Режим цвета, который поддерживает формат; прозрачность для JPEG — на белом фоне"""
+    from PIL import Image
+
+    has_alpha = image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+    if image_format == 'JPEG' and has_alpha:
+        rgba = image.convert('RGBA')
+        background = Image.new('RGB', rgba.size, 'white')
+        background.paste(rgba, mask=rgba.getchannel('A'))
+        return background
+    if image_format == 'PNG' and image.mode in ('1', 'L', 'LA', 'P', 'RGB', 'RGBA'):
+        return image
+    return image.convert('RGBA' if has_alpha else 'RGB')
+
+
+def _save(image, path, image_format):
+    """Запись без метаданных (кроме цветового профиля) через временный файл"""
+    options = {
+        'JPEG': {'quality': PHOTO_QUALITY, 'optimize': True, 'progressive': True},
+        'WEBP': {'quality': PHOTO_QUALITY, 'method': 4},
+        'PNG': {'optimize': True}
+    }[image_format]
+    options['exif'] = b''
+    icc_profile = image.info.get('icc_profile')
+    image = _prepare(image, image_format)
+    if icc_profile:
+        options['icc_profile'] = icc_profile
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.tmp'
+    image.save(tmp_path, image_format, **options)
+    os.replace(tmp_path, path)
+
+
+def _save_thumbnails(image, name, photos_dir):
+    # Каждое превью уменьшается из предыдущего, большего
+    for size, edge in sorted(PHOTO_THUMBNAILS.items(), key=lambda item: -item[1]):
+        image = image.copy()
+        image.thumbnail((edge, edge))
+        _save(image, os.path.join(photos_dir, thumbnail_name(name, size)), PHOTO_FORMAT)
+
+
+def check_photo(stream):
+    """Быстрая проверка загружаемого файла по заголовку, без декодирования снимка"""
+    from PIL import Image
+
+    position = stream.tell()
+    try:
+        with Image.open(stream) as image:
+            width, height = image.size
+            image_format = image.format
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError) as e:
+        raise PhotoError(str(e)) from e
+    finally:
+        stream.seek(position)
+    if image_format not in FORMATS.values():
+        raise PhotoError(f'неподдерживаемый формат: {image_format}')
+    if width * height > PHOTO_MAX_PIXELS:
+        raise PhotoError(f'слишком большое изображение: {width}x{height}')
+
+
+def file_digest(path):
+    """SHA-256 файла (читается частями)"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def receive_photo(stream, incoming_dir=PHOTOS_INCOMING_DIR):
+    """Запись загружаемого файла в incoming_dir частями с подсчетом SHA-256: (хеш, путь).
+
+    Файл сохраняется под именем хеша, поэтому одинаковые загрузки занимают одно место.
+    """
+    digest = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(dir=incoming_dir, suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            while chunk := stream.read(CHUNK_SIZE):
+                digest.update(chunk)
+                f.write(chunk)
+        path = os.path.join(incoming_dir, digest.hexdigest())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return digest.hexdigest(), path
+
+
+def photo_exists(name, photos_dir=PHOTOS_DIR):
+    return os.path.exists(os.path.join(photos_dir, photo_path(name)))
+
+
+def iter_photos(photos_dir=PHOTOS_DIR):
+    """Имена всех снимков: прежние в корне каталога и по хешу в подкаталогах ab/cd/"""
+    for entry in os.scandir(photos_dir):
+        if entry.is_file() and os.path.splitext(entry.name)[1][1:].lower() in FORMATS:
+            yield entry.name
+        elif entry.is_dir() and len(entry.name) == 2 and entry.name != 'thumbs':
+            for shard in os.scandir(entry.path):
+                if shard.is_dir():
+                    yield from (photo.name for photo in os.scandir(shard.path)
+                                if HASHED_NAME.fullmatch(photo.name))
+
+
+def save_photo(source, filename, photos_dir=PHOTOS_DIR):
+    """Обработка загруженного снимка source (путь или файл) с превью; возвращает имя снимка"""
+    image = _load(source)
+    name = photo_name(filename)
+    _save(image, os.path.join(photos_dir, photo_path(name)), PHOTO_FORMAT)
+    _save_thumbnails(image, name, photos_dir)
+    return name
+
+
+def ensure_thumbnail(name, size, photos_dir=PHOTOS_DIR):
+    """Путь превью снимка (относительно photos_dir); превью создается, если его нет"""
+    thumbnail = thumbnail_name(name, size)
+    if not os.path.exists(os.path.join(photos_dir, thumbnail)):
+        _save_thumbnails(_load(os.path.join(photos_dir, photo_path(name))), name, photos_dir)
+    return thumbnail
+
+
+def reprocess_photo(name, photos_dir=PHOTOS_DIR, force=False):
+    """Обработка уже сохраненного снимка на месте (имя не меняется, ссылки в отчетах
+    остаются верными): (байт до, байт после) или None, если у снимка уже есть превью"""
+    path = os.path.join(photos_dir, photo_path(name))
+    if not force and all(os.path.exists(os.path.join(photos_dir, thumbnail_name(name, size)))
+                         for size in PHOTO_THUMBNAILS):
+        return None
+    before = os.path.getsize(path)
+    image = _load(path)
+    image_format = FORMATS.get(os.path.splitext(name)[1][1:].lower())
+    if image_format in REENCODED_FORMATS:
+        _save(image, path, image_format)
+    _save_thumbnails(image, name, photos_dir)
+    return before, os.path.getsize(path)
+
+
+def _reprocess(args):
+    name, photos_dir, force = args
+    try:
+        return name, reprocess_photo(name, photos_dir, force), None
+    except (OSError, PhotoError) as e:
+        return name, None, str(e)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Повторная обработка загруженных фотографий')
+    parser.add_argument('--dir', default=PHOTOS_DIR, help='Каталог фотографий')
+    parser.add_argument('--force', action='store_true', help='Обработать и снимки, у которых уже есть превью')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Число процессов')
+    args = parser.parse_args()
+
+    names = sorted(iter_photos(args.dir))
+    started = time.monotonic()
+    processed = skipped = errors = 0
+    total_before = total_after = 0
+    with ProcessPoolExecutor(args.workers) as pool:
+        for name, result, error in pool.map(_reprocess, [(name, args.dir, args.force) for name in names],
+                                            chunksize=8):
+            if error:
+                errors += 1
+                print(f'❌ {name}: {error}')
+            elif result is None:
+                skipped += 1
+            else:
+                processed += 1
+                total_before += result[0]
+                total_after += result[1]
+    print(f'Обработано: {processed}, пропущено: {skipped}, ошибок: {errors} '
+          f'за {time.monotonic() - started:.1f} с')
+    if processed:
+        print(f'Размер снимков: {total_before / 1024 / 1024:.1f} МБ → {total_after / 1024 / 1024:.1f} МБ')
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: общий файл работает только внутри процесса
+    fcntl = None
+
+# Счетчики для мониторинга
+COUNTERS = ('allowed', 'rejected', 'succeeded', 'failed')
+
+
+class MemoryStore:
+    """Состояние ведер в памяти процесса: {ключ: (жетоны, время, отказы подряд, блок до)}"""
+
+    def __init__(self, max_keys=10000):
+        self.max_keys = max_keys
+        self._buckets = {}
+        self._counters = dict.fromkeys(COUNTERS, 0)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def locked(self):
+        with self._lock:
+            yield
+
+    def get(self, key):
+        return self._buckets.get(key)
+
+    def put(self, key, state):
+        if key not in self._buckets and len(self._buckets) >= self.max_keys:
+            # Перебор логинов не должен расходовать память: вытесняются самые старые ведра
+            for old_key in sorted(self._buckets, key=lambda k: self._buckets[k][1])[:self.max_keys // 10 or 1]:
+                del self._buckets[old_key]
+        self._buckets[key] = state
+
+    def incr(self, counter):
+        self._counters[counter] += 1
+
+    def stats(self):
+        return dict(self._counters, keys=len(self._buckets))
+
+
+class FileStore:
+    """Состояние ведер в общем файле, отображенном в память, — одно на все воркеры.
+
+    Файл — счетчики и хеш-таблица из slots слотов (хеш ключа и состояние ведра)
+    с линейным пробированием; если свободного слота рядом нет, вытесняется
+    самое старое ведро. Изменения выполняются под flock на файле, который, как
+    в CollectionLocks, открывается заново при каждом взятии — так блокировка
+    работает и между воркерами, унаследовавшими объект через fork.
+    """
+
+    _HEADER = struct.Struct('<' + 'Q' * len(COUNTERS))
+    _SLOT = struct.Struct('<QdddQ')
+    PROBES = 16
+
+    def __init__(self, path, slots=8192):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self.slots = slots
+        size = self._HEADER.size + self._SLOT.size * slots
+        with open(path, 'a+b') as f:
+            if os.fstat(f.fileno()).st_size < size:
+                f.truncate(size)
+            self._map = mmap.mmap(f.fileno(), size)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def locked(self):
+        with self._lock, open(self.path, 'r+b') as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            yield
+
+    def _offset(self, index):
+        return self._HEADER.size + self._SLOT.size * index
+
+    def _find(self, key):
+        """(смещение слота ключа или слота для него, хеш ключа, состояние или None)"""
+        key_hash = int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'little') | 1
+        start = key_hash % self.slots
+        victim = None
+        for probe in range(self.PROBES):
+            offset = self._offset((start + probe) % self.slots)
+            slot_hash, tokens, updated, blocked_until, strikes = self._SLOT.unpack_from(self._map, offset)
+            if slot_hash == key_hash:
+                return offset, key_hash, (tokens, updated, strikes, blocked_until)
+            if slot_hash == 0:
+                return offset, key_hash, None
+            if victim is None or updated < victim[1]:
+                victim = (offset, updated)
+        return victim[0], key_hash, None
+
+    def get(self, key):
+        return self._find(key)[2]
+
+    def put(self, key, state):
+        offset, key_hash, _ = self._find(key)
+        tokens, updated, strikes, blocked_until = state
+        self._SLOT.pack_into(self._map, offset, key_hash, tokens, updated, blocked_until, strikes)
+
+    def incr(self, counter):
+        counters = list(self._HEADER.unpack_from(self._map, 0))
+        counters[COUNTERS.index(counter)] += 1
+        self._HEADER.pack_into(self._map, 0, *counters)
+
+    def stats(self):
+        counters = dict(zip(COUNTERS, self._HEADER.unpack_from(self._map, 0)))
+        counters['keys'] = sum(1 for index in range(self.slots)
+                               if struct.unpack_from('<Q', self._map, self._offset(index))[0])
+        return counters
+
+
+class LoginThrottle:
+    """Ограничение попыток входа: token bucket на логин и на IP клиента.
+
+    Каждая попытка забирает жетон из ведра логина и ведра IP; жетоны
+    восстанавливаются по одному раз в refill секунд до capacity. Если ведро
+    пусто, попытка отклоняется до проверки пароля, а каждый отказ подряд
+    удваивает блокировку ведра (от backoff до max_backoff секунд). Успешный
+    вход восстанавливает ведро логина и возвращает жетон ведру IP.
+
+    С IP, с которого пользователь успешно входил за последние trusted_for
+    секунд, попытки расходуют отдельное ведро логина для этого IP: перебор
+    пароля с других адресов не блокирует владельца учетной записи.
+    """
+
+    def __init__(self, store, user_limit=(5, 60), ip_limit=(20, 6), backoff=1, max_backoff=300,
+                 trusted_for=30 * 24 * 3600):
+        self.store = store
+        self.limits = {'user': user_limit, 'ip': ip_limit}
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.trusted_for = trusted_for
+
+    def _user_key(self, username, ip, now):
+        """Ведро логина: свое для IP недавнего успешного входа, иначе общее"""
+        trusted = self.store.get(f'trusted:{username}@{ip}')
+        if trusted is not None and now - trusted[1] < self.trusted_for:
+            return f'user:{username}@{ip}'
+        return f'user:{username}'
+
+    def _current(self, kind, key, now):
+        """Состояние ведра с жетонами, восстановленными к моменту now"""
+        capacity, refill = self.limits[kind]
+        state = self.store.get(key)
+        if state is None:
+            return capacity, now, 0, 0.0
+        tokens, updated, strikes, blocked_until = state
+        tokens = min(capacity, tokens + (now - updated) / refill)
+        if tokens >= capacity and now >= blocked_until:
+            strikes = 0  # ведро простояло до полного восстановления
+        return tokens, now, strikes, blocked_until
+
+    def check(self, username, ip):
+        """Можно ли проверять пароль: (True, 0) или (False, через сколько секунд повторить)"""
+        now = time.time()
+        with self.store.locked():
+            buckets = [('user', self._user_key(username, ip, now)), ('ip', f'ip:{ip}')]
+            states = {key: self._current(kind, key, now) for kind, key in buckets}
+            retry_after = 0
+            for kind, key in buckets:
+                tokens, updated, strikes, blocked_until = states[key]
+                if tokens >= 1 and now >= blocked_until:
+                    continue
+                strikes += 1
+                blocked_until = max(blocked_until, now + min(self.backoff * 2 ** (strikes - 1), self.max_backoff))
+                self.store.put(key, (tokens, updated, strikes, blocked_until))
+                retry_after = max(retry_after, blocked_until - now)
+            if retry_after:
+                self.store.incr('rejected')
+                return False, retry_after
+            for kind, key in buckets:
+                tokens, updated, strikes, blocked_until = states[key]
+                self.store.put(key, (tokens - 1, updated, strikes, blocked_until))
+            self.store.incr('allowed')
+        return True, 0
+
+    def success(self, username, ip):
+        now = time.time()
+        with self.store.locked():
+            self.store.put(self._user_key(username, ip, now), (self.limits['user'][0], now, 0, 0.0))
+            self.store.put(f'trusted:{username}@{ip}', (0, now, 0, 0.0))
+            tokens, updated, strikes, blocked_until = self._current('ip', f'ip:{ip}', now)
+            self.store.put(f'ip:{ip}', (min(tokens + 1, self.limits['ip'][0]), updated, strikes, blocked_until))
+            self.store.incr('succeeded')
+
+    def failure(self):
+        with self.store.locked():
+            self.store.incr('failed')
+
+    def stats(self):
+        """Счетчики попыток и число отслеживаемых ведер"""
+        with self.store.locked():
+            return self.store.stats()
+
+
+def create_login_throttle(store, path=None, **limits):
+    """Ограничитель входа с хранилищем 'memory' (в процессе) или 'file' (общее для воркеров)"""
+    if store == 'memory':
+        return LoginThrottle(MemoryStore(), **limits)
+    if store == 'file':
+        return LoginThrottle(FileStore(path), **limits)
+    raise ValueError(f'Неизвестное хранилище ограничителя входа: {store}')
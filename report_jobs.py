@@ -0,0 +1,118 @@
+"""
+Фоновые задания по отчетам бригад (см. jobs.py)
+process_report — обработка загруженных фото отчета (photos.py), затем постановка
+уведомления; notify_report — отправка отчета с фото в супергруппу Telegram
+"""
+
+import json
+import logging
+import os
+import urllib.error
+import urllib.request
+import uuid
+
+from config import BOT_TOKEN, SUPER_GROUP_ID, PHOTOS_DIR
+from jobs import PermanentError
+from photos import PhotoError, photo_exists, photo_path, save_photo
+
+TELEGRAM_API = 'https://api.telegram.org'
+# Telegram принимает от 2 до 10 фото в альбоме и до 1024 символов в подписи
+MEDIA_GROUP_SIZE = 10
+CAPTION_LIMIT = 1024
+
+
+def report_message(report, task):
+    """Текст уведомления об отчете (как в bot.send_report_to_group)"""
+    lines = ['📝 Новый отчёт', '',
+             f"🏠 Адрес: {task['address']}",
+             f"👥 Бригада: {report['brigade']}",
+             f"🔧 Вид работ: {task['work_type']}", '',
+             f"💬 Комментарий: {report['comment']}",
+             f"🔑 Доступ: {report['access']}", '',
+             '📦 Материалы:']
+    lines.extend(f"- {material['name']}: {material['quantity']}" for material in report['materials'])
+    return '\n'.join(lines)
+
+
+def telegram_enabled():
+    return BOT_TOKEN != "YOUR_BOT_TOKEN_HERE" and SUPER_GROUP_ID != "YOUR_SUPER_GROUP_ID"
+
+
+def telegram(method, fields, files=None):
+    """Вызов Bot API (multipart/form-data); ошибки запроса 4xx, кроме 429, не повторяются"""
+    boundary = uuid.uuid4().hex
+    body = bytearray()
+    for name, value in fields.items():
+        body += (f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n'
+                 f'{value}\r\n').encode('utf-8')
+    for name, path in (files or {}).items():
+        with open(path, 'rb') as f:
+            body += (f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; '
+                     f'filename="{os.path.basename(path)}"\r\n'
+                     f'Content-Type: application/octet-stream\r\n\r\n').encode('utf-8')
+            body += f.read() + b'\r\n'
+    body += f'--{boundary}--\r\n'.encode('utf-8')
+    request = urllib.request.Request(f'{TELEGRAM_API}/bot{BOT_TOKEN}/{method}', data=bytes(body),
+                                     headers={'Content-Type': f'multipart/form-data; boundary={boundary}'})
+    try:
+        with urllib.request.urlopen(request, timeout=60) as response:
+            return json.load(response)
+    except urllib.error.HTTPError as e:
+        if 400 <= e.code < 500 and e.code != 429:
+            raise PermanentError(f'Telegram {method}: {e.code} {e.read()[:200].decode("utf-8", "replace")}')
+        raise
+
+
+def make_handlers(dm, queue):
+    """Обработчики заданий {вид: функция(payload)} для JobWorkers"""
+
+    def process_report(payload):
+        processed = 0
+        for incoming, name in payload['photos']:
+            if not os.path.exists(incoming):
+                continue  # обработан при прошлой попытке или заданием другого отчета с тем же фото
+            if not photo_exists(name):
+                try:
+                    save_photo(incoming, name)
+                    processed += 1
+                except PhotoError as e:
+                    # Повтор не поможет: файл поврежден
+                    logging.warning(f"Фото {name} отчета {payload['report_id']} не обработано: {e}")
+            try:
+                os.remove(incoming)
+            except FileNotFoundError:
+                pass
+        queue.enqueue('notify_report', {'report_id': payload['report_id']},
+                      key=f"notify_report:{payload['report_id']}")
+        return {'photos': processed}
+
+    def notify_report(payload):
+        if not telegram_enabled():
+            return {'sent': False}
+        report = dm.get_report(payload['report_id'])
+        task = dm.get_task(report['task_id']) if report else None
+        if task is None:
+            raise PermanentError(f"Отчет {payload['report_id']} или его задача не найдены")
+        text = report_message(report, task)
+        photos = [os.path.join(PHOTOS_DIR, photo_path(name)) for name in report['photos']
+                  if photo_exists(name)]
+        if not photos or len(text) > CAPTION_LIMIT:
+            telegram('sendMessage', {'chat_id': SUPER_GROUP_ID, 'text': text})
+            text = None
+        for start in range(0, len(photos), MEDIA_GROUP_SIZE):
+            group = photos[start:start + MEDIA_GROUP_SIZE]
+            if len(group) == 1:
+                # Альбом — от 2 фото, одно отправляется отдельным сообщением
+                fields = {'chat_id': SUPER_GROUP_ID}
+                if text and start == 0:
+                    fields['caption'] = text
+                telegram('sendPhoto', fields, {'photo': group[0]})
+                continue
+            media = [{'type': 'photo', 'media': f'attach://photo{index}'} for index in range(len(group))]
+            if text and start == 0:
+                media[0]['caption'] = text
+            telegram('sendMediaGroup', {'chat_id': SUPER_GROUP_ID, 'media': json.dumps(media, ensure_ascii=False)},
+                     {f'photo{index}': path for index, path in enumerate(group)})
+        return {'sent': True, 'photos': len(photos)}
+
+    return {'process_report': process_report, 'notify_report': notify_report}
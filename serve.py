@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Продакшен-запуск веб-приложения AWR
+Главный процесс один раз создает приложение (app.create_app), загружает данные,
+открывает порт и запускает WEB_WORKERS воркеров через fork; каждый воркер обслуживает
+запросы пулом из WEB_THREADS потоков и выполняет фоновые задания (jobs.py).
+По SIGTERM (или SIGINT) воркеры перестают принимать соединения, закрывают потоки
+событий, дожидаются начатых запросов и заданий не дольше WEB_GRACEFUL_TIMEOUT
+секунд и завершаются. Упавший воркер перезапускается.
+"""
+
+import gc
+import io
+import logging
+import os
+import queue
+import select
+import signal
+import socket
+import threading
+import time
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+from config import WEB_WORKERS, WEB_THREADS, WEB_GRACEFUL_TIMEOUT
+
+# Сколько ждать следующий запрос в keep-alive соединении, прежде чем освободить поток (сек)
+KEEPALIVE_TIMEOUT = 5
+
+
+class RequestHandler(WSGIRequestHandler):
+    timeout = KEEPALIVE_TIMEOUT
+
+    def make_environ(self):
+        environ = super().make_environ()
+        # Приложение может забрать соединение себе (поток событий SSE, см. app.api_events)
+        environ['awr.detach'] = self.detach
+        return environ
+
+    def detach(self, take):
+        """Передача соединения приложению: после обработки запроса сокет не
+        закрывается, а отдается take(sock). Ответ WSGI при этом никуда не пишется —
+        заголовки и данные отправляет сам take."""
+        self.close_connection = True
+        self.wfile = io.BytesIO()
+        self.server.detached[self.connection] = take
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """WSGI-сервер Werkzeug с постоянным пулом потоков на уже открытом сокете.
+
+    Соединение принимается, только когда в пуле есть свободный поток, поэтому
+    занятый воркер не забирает запросы у свободных — они ждут в очереди сокета.
+    """
+
+    multithread = True
+
+    def __init__(self, app, sock, threads):
+        host, port = sock.getsockname()[:2]
+        super().__init__(host, port, app, handler=RequestHandler, fd=sock.fileno())
+        self.socket.setblocking(False)
+        self.threads = threads
+        self.stopping = False
+        self._slots = threading.Semaphore(threads)
+        self._requests = queue.Queue()
+        # Соединения, которые забрало приложение: сокет -> take (см. RequestHandler.detach)
+        self.detached = {}
+        for _ in range(threads):
+            threading.Thread(target=self._work, daemon=True).start()
+
+    def _work(self):
+        while True:
+            request, client_address = self._requests.get()
+            take = None
+            try:
+                self.finish_request(request, client_address)
+                take = self.detached.pop(request, None)
+                if take is not None:
+                    take(request)
+            except Exception:
+                self.handle_error(request, client_address)
+                take = None
+            finally:
+                self.detached.pop(request, None)
+                if take is None:
+                    self.shutdown_request(request)
+                self._slots.release()
+
+    def run(self):
+        """Прием соединений до остановки"""
+        while not self.stopping:
+            if not self._slots.acquire(timeout=0.5):
+                continue
+            try:
+                readable, _, _ = select.select([self.socket], [], [], 0.5)
+                # Соединение могли забрать другие воркеры
+                request, client_address = self.socket.accept() if readable else (None, None)
+            except (BlockingIOError, InterruptedError):
+                request = None
+            if request is None:
+                self._slots.release()
+                continue
+            self._requests.put((request, client_address))
+
+    def wait_idle(self, timeout):
+        """Ожидание завершения начатых запросов; False — не успели за timeout"""
+        deadline = time.monotonic() + timeout
+        for _ in range(self.threads):
+            if not self._slots.acquire(timeout=max(deadline - time.monotonic(), 0)):
+                return False
+        return True
+
+
+def run_worker(app, sock):
+    from app import shutdown, start_job_workers
+
+    server = PooledWSGIServer(app, sock, WEB_THREADS)
+
+    def stop(signum, frame):
+        server.stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    start_job_workers(app)
+    logging.info(f'Воркер {os.getpid()} запущен, потоков: {WEB_THREADS}')
+    server.run()
+    shutdown(app)
+    if not server.wait_idle(WEB_GRACEFUL_TIMEOUT):
+        logging.warning(f'Воркер {os.getpid()}: начатые запросы не завершились за {WEB_GRACEFUL_TIMEOUT} с')
+    logging.info(f'Воркер {os.getpid()} остановлен')
+
+
+def spawn_worker(app, sock):
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            run_worker(app, sock)
+        except BaseException:
+            logging.exception('Ошибка воркера')
+            code = 1
+        finally:
+            logging.shutdown()
+            os._exit(code)
+    return pid
+
+
+def main():
+    from app import create_app, preload
+
+    port = int(os.getenv('PORT', 5000))
+    app = create_app()
+    preload(app)
+    sock = socket.create_server(('0.0.0.0', port), backlog=2048)
+    # Все загруженное до fork остается общим для воркеров: сборщик мусора не
+    # будет обходить эти объекты и копировать их страницы памяти в каждый процесс
+    gc.freeze()
+
+    logging.info(f'🚀 Запуск AWR Web Application: http://0.0.0.0:{port}, '
+                 f'воркеров: {WEB_WORKERS}, потоков в каждом: {WEB_THREADS}')
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    workers = {spawn_worker(app, sock) for _ in range(WEB_WORKERS)}
+
+    while not stopping:
+        pid, status = os.waitpid(-1, os.WNOHANG)
+        if pid == 0:
+            time.sleep(1)
+            continue
+        workers.discard(pid)
+        if not stopping:
+            logging.warning(f'Воркер {pid} завершился (код {os.waitstatus_to_exitcode(status)}), перезапуск')
+            workers.add(spawn_worker(app, sock))
+
+    logging.info('Остановка сервера')
+    for pid in workers:
+        os.kill(pid, signal.SIGTERM)
+    deadline = time.monotonic() + WEB_GRACEFUL_TIMEOUT + 5
+    while workers and time.monotonic() < deadline:
+        pid, _ = os.waitpid(-1, os.WNOHANG)
+        if pid:
+            workers.discard(pid)
+        else:
+            time.sleep(0.1)
+    for pid in workers:
+        os.kill(pid, signal.SIGKILL)
+    sock.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Профиль времени запуска: сколько занимает импорт модулей приложения
+Каждый модуль несколько раз импортируется в отдельном процессе
+(python -X importtime) на копии данных; в отчет идет лучший результат и
+самые медленные прямые импорты модуля. Если время превышает бюджет или при
+запуске загружаются тяжелые модули, которые должны импортироваться только
+при использовании, скрипт завершается с кодом 1
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Бюджет времени импорта (мс): config импортируют все процессы, app — каждый воркер
+STARTUP_BUDGETS = {
+    'config': 100,
+    'data_manager': 300,
+    'app': 1000
+}
+
+# Тяжелые модули, которые при запуске загружаться не должны
+DEFERRED_MODULES = ('pandas', 'openpyxl', 'PIL')
+
+
+def import_times(module, work_dir):
+    """Один импорт module в чистом процессе: [(имя, глубина, собственное мкс, всего мкс)]"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            cwd=work_dir, env=dict(os.environ, PYTHONPATH=BASE_DIR),
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f'Ошибка импорта {module}:\n{result.stderr[-2000:]}')
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        times.append((name.strip(), depth, int(self_us), int(cumulative_us)))
+    return times
+
+
+def profile(module, work_dir, repeat):
+    """Лучший из repeat импортов: (всего мс, импорты)"""
+    best = None
+    for _ in range(repeat):
+        times = import_times(module, work_dir)
+        total = next(cumulative for name, depth, _, cumulative in times if name == module and depth == 0)
+        if best is None or total < best[0]:
+            best = (total, times)
+    return best[0] / 1000, best[1]
+
+
+def report(module, budget, total_ms, times, top):
+    """Печать отчета по модулю; возвращает True, если бюджет соблюден"""
+    loaded = {name.split('.')[0] for name, _, _, _ in times}
+    deferred = [name for name in DEFERRED_MODULES if name in loaded]
+    ok = total_ms <= budget and not deferred
+    print(f"{'✅' if ok else '❌'} {module}: {total_ms:.0f} мс (бюджет {budget} мс)")
+    # importtime печатает вложенные импорты перед самим модулем
+    end = next(i for i, (name, depth, _, _) in enumerate(times) if name == module and depth == 0)
+    start = end
+    while start > 0 and times[start - 1][1] > 0:
+        start -= 1
+    children = sorted((item for item in times[start:end] if item[1] == 1), key=lambda item: -item[3])
+    for name, _, _, cumulative in children[:top]:
+        print(f'   {cumulative / 1000:>8.1f} мс  {name}')
+    if deferred:
+        print(f"   При запуске загружаются: {', '.join(deferred)} — их нужно импортировать при использовании")
+    return ok
+
+
+def check_startup(modules=None, repeat=3, top=8):
+    """Проверка бюджетов времени запуска; True — все в пределах"""
+    work_dir = tempfile.mkdtemp(prefix='awr_startup_')
+    try:
+        shutil.copytree(os.path.join(BASE_DIR, 'data'), os.path.join(work_dir, 'data'),
+                        ignore=shutil.ignore_patterns('locks', 'archive', '*.db*'))
+        ok = True
+        for module in modules or STARTUP_BUDGETS:
+            total_ms, times = profile(module, work_dir, repeat)
+            ok = report(module, STARTUP_BUDGETS[module], total_ms, times, top) and ok
+        return ok
+    finally:
+        shutil.rmtree(work_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Время импорта модулей приложения')
+    parser.add_argument('modules', nargs='*', help=f"Модули: {', '.join(STARTUP_BUDGETS)} (по умолчанию все)")
+    parser.add_argument('--repeat', type=int, default=3, help='Число замеров на модуль')
+    parser.add_argument('--top', type=int, default=8, help='Сколько прямых импортов показать')
+    args = parser.parse_args()
+    unknown = [module for module in args.modules if module not in STARTUP_BUDGETS]
+    if unknown:
+        parser.error(f"нет бюджета для модулей: {', '.join(unknown)}")
+    sys.exit(0 if check_startup(args.modules, args.repeat, args.top) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,610 @@
+import glob
+import itertools
+import json
+import logging
+import marshal
+import os
+import sqlite3
+import sys
+import threading
+
+# Коллекции-списки, записи которых имеют поле id, и колонки для индексов
+RECORD_COLUMNS = {
+    'tasks': ('assigned_brigade', 'assigned_admin', 'status'),
+    'reports': ('task_id',),
+    'warehouse_log': ()
+}
+
+# Складские остатки: {наименование: количество} или {бригада: {наименование: количество}}
+STOCK_COLLECTIONS = {
+    'materials': False,
+    'tools': False,
+    'brigade_materials': True,
+    'brigade_tools': True
+}
+
+
+# Двоичный снапшот: сигнатура, версия формата marshal, затем marshal-данные
+BINARY_MAGIC = b'AWRB\x01'
+
+
+def encode_binary(data):
+    return BINARY_MAGIC + bytes([marshal.version]) + marshal.dumps(data)
+
+
+def decode_binary(blob):
+    if not blob.startswith(BINARY_MAGIC):
+        raise ValueError('Не двоичный снапшот AWR')
+    if blob[len(BINARY_MAGIC)] > marshal.version:
+        raise ValueError('Снапшот записан более новой версией Python')
+    return marshal.loads(blob[len(BINARY_MAGIC) + 1:])
+
+
+class JsonStorage:
+    """Хранение каждой коллекции в отдельном файле-снапшоте.
+
+    По умолчанию снапшот — JSON (<name>.json). Для коллекций, которым в formats
+    задан формат 'binary', снапшот пишется в <name>.bin (marshal): он в разы
+    быстрее кодируется и разбирается. Если файла в выбранном формате еще нет,
+    читается файл в другом формате, а при следующей записи он заменяется.
+    """
+
+    def __init__(self, data_files, locks=None, formats=None):
+        self.data_files = data_files
+        self.locks = locks
+        self.formats = formats or {}
+        self.data_dir = os.path.dirname(next(iter(data_files.values())))
+        self._intent_ids = itertools.count(1)
+
+    def _snapshot_paths(self, name):
+        """Путь снапшота в выбранном формате и путь в другом формате"""
+        json_path = self.data_files[name]
+        binary_path = os.path.splitext(json_path)[0] + '.bin'
+        if self.formats.get(name) == 'binary':
+            return binary_path, json_path
+        return json_path, binary_path
+
+    def _readable_path(self, name):
+        path, other_path = self._snapshot_paths(name)
+        if not os.path.exists(path) and os.path.exists(other_path):
+            return other_path
+        return path
+
+    def exists(self, name):
+        return os.path.exists(self._readable_path(name))
+
+    def stamp(self, name):
+        """Отметка состояния файла: меняется при каждой записи (None — файла нет)"""
+        try:
+            st = os.stat(self._readable_path(name))
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def load(self, name):
+        """Загрузка коллекции целиком"""
+        path = self._readable_path(name)
+        try:
+            with open(path, 'rb') as f:
+                blob = f.read()
+        except FileNotFoundError:
+            return []
+        try:
+            if blob.startswith(BINARY_MAGIC):
+                return decode_binary(blob)
+            return json.loads(blob)
+        except (ValueError, EOFError):
+            return []
+
+    def save(self, name, data):
+        """Перезапись коллекции целиком (через временный файл и rename)"""
+        self._write_snapshot(name, data)
+
+    def _write_snapshot(self, name, data, fsync=False):
+        path, other_path = self._snapshot_paths(name)
+        tmp_path = f'{path}.tmp'
+        if path.endswith('.bin'):
+            with open(tmp_path, 'wb') as f:
+                f.write(encode_binary(data))
+                if fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+        else:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+                if fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        if os.path.exists(other_path):
+            os.remove(other_path)
+
+    def export_json(self, name, path):
+        """Выгрузка коллекции в читаемый JSON (для отладки двоичных снапшотов)"""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.load(name), f, ensure_ascii=False, indent=2)
+
+    def count(self, name):
+        return len(self.load(name))
+
+    def close(self):
+        """Открытых соединений нет — для совместимости с SqliteStorage"""
+
+    def get(self, name, record_id):
+        return next((r for r in self.load(name) if r.get('id') == record_id), None)
+
+    def query(self, name, **filters):
+        """Записи коллекции, у которых поля равны переданным значениям"""
+        return [r for r in self.load(name)
+                if all(r.get(field) == value for field, value in filters.items())]
+
+    def insert(self, name, record):
+        """Добавление записи (повторная вставка того же id заменяет запись)"""
+        records = self.load(name)
+        for i, existing in enumerate(records):
+            if existing.get('id') == record['id']:
+                records[i] = record
+                break
+        else:
+            records.append(record)
+        self.save(name, records)
+
+    def patch(self, name, record_id, fields):
+        """Изменение полей записи с указанным id"""
+        records = self.load(name)
+        for record in records:
+            if record.get('id') == record_id:
+                record.update(fields)
+                break
+        self.save(name, records)
+
+    def commit(self, changes):
+        """Атомарная фиксация изменений нескольких коллекций.
+
+        changes: {коллекция: ('save', данные) | ('insert', [записи])}. Сначала все
+        изменения одним файлом намерения записываются на диск (fsync + rename —
+        точка фиксации), затем применяются к файлам коллекций, после чего файл
+        намерения удаляется. Если процесс упал посередине, recover() при
+        следующем запуске доприменит транзакцию: все операции идемпотентны.
+        Вызывать под эксклюзивными блокировками затронутых коллекций.
+        """
+        intent_path = os.path.join(self.data_dir, f'transaction-{os.getpid()}-{next(self._intent_ids)}.json')
+        tmp_path = f'{intent_path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({name: list(change) for name, change in changes.items()}, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, intent_path)
+        _fsync_dir(self.data_dir)
+        self._apply(changes)
+        os.remove(intent_path)
+
+    def _apply(self, changes):
+        for name, (operation, data) in changes.items():
+            if operation == 'save':
+                self.save(name, data)
+            else:
+                for record in data:
+                    self.insert(name, record)
+            self._flush(name)
+
+    def _flush(self, name):
+        """fsync файла коллекции"""
+        _fsync_file(self._readable_path(name))
+
+    def recover(self):
+        """Доприменение транзакций, прерванных после точки фиксации"""
+        recovered = False
+        for intent_path in sorted(glob.glob(os.path.join(self.data_dir, 'transaction-*.json'))):
+            try:
+                with open(intent_path, 'r', encoding='utf-8') as f:
+                    changes = json.load(f)
+            except FileNotFoundError:
+                continue
+            if self.locks is None:
+                self._recover_intent(intent_path, changes)
+            else:
+                # Если транзакция еще фиксируется живым процессом, ждем ее завершения
+                with self.locks.exclusive(*changes):
+                    self._recover_intent(intent_path, changes)
+            recovered = True
+        return recovered
+
+    def _recover_intent(self, intent_path, changes):
+        if not os.path.exists(intent_path):
+            return
+        self._apply({name: tuple(change) for name, change in changes.items()})
+        os.remove(intent_path)
+
+
+class JournalStorage(JsonStorage):
+    """JSON снапшоты плюс append-only журнал (JSONL) для задач, отчетов и лога склада.
+
+    Добавление записи — одна строка в <name>.jsonl, изменение — строка с патчем,
+    полная перезапись — строка reset. Все операции журнала идемпотентны, поэтому
+    повторное применение уже свернутого журнала после сбоя дает то же состояние.
+    Когда журнал превышает порог, он переименовывается в <name>.jsonl.compacting
+    и в фоновом потоке сворачивается в снапшот коллекции (JSON или двоичный).
+    """
+
+    def __init__(self, data_files, compact_bytes=1024 * 1024, fsync=False, locks=None, formats=None):
+        super().__init__(data_files, locks, formats)
+        self.compact_bytes = compact_bytes
+        self.fsync = fsync
+        self._lock = threading.RLock()
+        self._compacting = set()
+
+    def _journal_path(self, name):
+        return os.path.splitext(self.data_files[name])[0] + '.jsonl'
+
+    def _paths(self, name):
+        journal = self._journal_path(name)
+        return self._readable_path(name), f'{journal}.compacting', journal
+
+    def stamp(self, name):
+        if name not in RECORD_COLUMNS:
+            return super().stamp(name)
+        stamps = []
+        for path in self._paths(name):
+            try:
+                st = os.stat(path)
+                stamps.append((st.st_ino, st.st_size, st.st_mtime_ns))
+            except FileNotFoundError:
+                stamps.append(None)
+        return tuple(stamps) if stamps[0] is not None else None
+
+    def load(self, name):
+        if name not in RECORD_COLUMNS:
+            return super().load(name)
+        compacting_path, journal_path = self._paths(name)[1:]
+        with self._lock:
+            records = {record['id']: record for record in super().load(name)}
+            self._replay(compacting_path, records)
+            self._replay(journal_path, records)
+        return list(records.values())
+
+    def _replay(self, path, records):
+        """Применение операций журнала; оборванные строки отбрасываются"""
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            return
+        with f:
+            for number, line in enumerate(f, 1):
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Строка, склеенная с оборванной записью упавшего процесса
+                    logging.warning(f'Пропущена поврежденная строка {number} журнала {path}')
+                    continue
+                if entry['op'] == 'add':
+                    records[entry['record']['id']] = entry['record']
+                elif entry['op'] == 'patch' and entry['id'] in records:
+                    records[entry['id']].update(entry['fields'])
+                elif entry['op'] == 'reset':
+                    records.clear()
+                    records.update((record['id'], record) for record in entry['records'])
+
+    @staticmethod
+    def _repair_tail(f):
+        """Обрезка оборванной последней строки, чтобы новая запись не склеилась с ней.
+
+        Оборванную строку может оставить любой процесс (например, воркер serve.py,
+        убитый посреди записи большой строки reset), поэтому проверка идет перед
+        каждой записью под эксклюзивной блокировкой коллекции.
+        """
+        size = f.seek(0, os.SEEK_END)
+        if size == 0:
+            return
+        f.seek(size - 1)
+        if f.read(1) == b'\n':
+            return
+        f.seek(0)
+        f.truncate(f.read().rfind(b'\n') + 1)
+
+    def _append(self, name, entry):
+        """Добавление одной строки в журнал (одна буферизованная запись)"""
+        line = (json.dumps(entry, ensure_ascii=False) + '\n').encode('utf-8')
+        journal_path = self._journal_path(name)
+        with self._lock:
+            with open(journal_path, 'a+b') as f:
+                self._repair_tail(f)
+                f.write(line)
+                if self.fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+                size = f.tell()
+        if size >= self.compact_bytes:
+            self.compact_in_background(name)
+
+    def save(self, name, data):
+        if name not in RECORD_COLUMNS:
+            return super().save(name, data)
+        if not self.exists(name):
+            return super().save(name, data)
+        self._append(name, {'op': 'reset', 'records': data})
+
+    def count(self, name):
+        return len(self.load(name))
+
+    def insert(self, name, record):
+        if name not in RECORD_COLUMNS:
+            return super().insert(name, record)
+        self._append(name, {'op': 'add', 'record': record})
+
+    def patch(self, name, record_id, fields):
+        if name not in RECORD_COLUMNS:
+            return super().patch(name, record_id, fields)
+        self._append(name, {'op': 'patch', 'id': record_id, 'fields': fields})
+
+    def _flush(self, name):
+        super()._flush(name)
+        if name in RECORD_COLUMNS:
+            _fsync_file(self._journal_path(name))
+
+    def compact_in_background(self, name):
+        """Запуск свертки журнала в фоновом потоке (не более одной на коллекцию)"""
+        with self._lock:
+            if name in self._compacting:
+                return
+            self._compacting.add(name)
+        thread = threading.Thread(target=self.compact, args=(name,), daemon=True)
+        thread.start()
+
+    def compact(self, name):
+        """Свертка журнала в снапшот: rename журнала, запись снапшота, удаление журнала"""
+        try:
+            if self.locks is None:
+                self._compact(name)
+            else:
+                # Другие процессы не должны писать в журнал, пока он переименовывается
+                with self.locks.exclusive(name):
+                    self._compact(name)
+        finally:
+            with self._lock:
+                self._compacting.discard(name)
+
+    def _compact(self, name):
+        compacting_path, journal_path = self._paths(name)[1:]
+        with self._lock:
+            if not os.path.exists(compacting_path) and os.path.exists(journal_path):
+                os.replace(journal_path, compacting_path)
+            if not os.path.exists(compacting_path):
+                return
+            records = {record['id']: record for record in JsonStorage.load(self, name)}
+            self._replay(compacting_path, records)
+            self._write_snapshot(name, list(records.values()), fsync=True)
+            _fsync_dir(self.data_dir)
+            os.remove(compacting_path)
+
+
+def _fsync_file(path):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except FileNotFoundError:
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _fsync_dir(path):
+    """Сброс на диск записи каталога после rename"""
+    fd = os.open(path or '.', os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class SqliteStorage:
+    """Хранение задач, отчетов, лога склада и остатков во встроенной SQLite базе.
+
+    Записи коллекций-списков лежат в отдельных таблицах построчно (JSON в колонке
+    data плюс индексируемые колонки), остатки склада — в таблице stock, прочие
+    коллекции — целиком в таблице documents.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._create_schema()
+
+    @property
+    def conn(self):
+        """Отдельное соединение на каждый поток"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def close(self):
+        """Закрытие соединения текущего потока (например, перед fork)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def _create_schema(self):
+        with self.conn as conn:
+            for name, columns in RECORD_COLUMNS.items():
+                extra = ''.join(f', {column}' for column in columns)
+                conn.execute(f'CREATE TABLE IF NOT EXISTS {name} '
+                             f'(id INTEGER PRIMARY KEY{extra}, data TEXT NOT NULL)')
+                for column in columns:
+                    conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{name}_{column} ON {name}({column})')
+            conn.execute('CREATE TABLE IF NOT EXISTS stock (collection TEXT NOT NULL, owner TEXT NOT NULL, '
+                         'item TEXT NOT NULL, quantity NUMERIC NOT NULL, '
+                         'PRIMARY KEY (collection, owner, item))')
+            conn.execute('CREATE TABLE IF NOT EXISTS documents (name TEXT PRIMARY KEY, data TEXT NOT NULL)')
+            conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+
+    def _get_meta(self, key):
+        row = self.conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, conn, key, value):
+        conn.execute('INSERT INTO meta (key, value) VALUES (?, ?) '
+                     'ON CONFLICT(key) DO UPDATE SET value = excluded.value', (key, value))
+
+    def _bump(self, conn, name):
+        """Увеличение счетчика версии коллекции при каждой записи"""
+        conn.execute("INSERT INTO meta (key, value) VALUES (?, 1) "
+                     "ON CONFLICT(key) DO UPDATE SET value = value + 1", (f'version:{name}',))
+
+    def stamp(self, name):
+        if not self.exists(name):
+            return None
+        return self._get_meta(f'version:{name}')
+
+    def exists(self, name):
+        if name in RECORD_COLUMNS or name in STOCK_COLLECTIONS:
+            return self._get_meta(f'init:{name}') is not None
+        return self.conn.execute('SELECT 1 FROM documents WHERE name = ?', (name,)).fetchone() is not None
+
+    def load(self, name):
+        if name in RECORD_COLUMNS:
+            rows = self.conn.execute(f'SELECT data FROM {name} ORDER BY id')
+            return [json.loads(data) for data, in rows]
+        if name in STOCK_COLLECTIONS:
+            return self._load_stock(name)
+        row = self.conn.execute('SELECT data FROM documents WHERE name = ?', (name,)).fetchone()
+        return json.loads(row[0]) if row else []
+
+    def _load_stock(self, name):
+        nested = STOCK_COLLECTIONS[name]
+        rows = self.conn.execute('SELECT owner, item, quantity FROM stock '
+                                 'WHERE collection = ? ORDER BY rowid', (name,))
+        stock = {}
+        for owner, item, quantity in rows:
+            if nested:
+                stock.setdefault(owner, {})[item] = quantity
+            else:
+                stock[item] = quantity
+        return stock
+
+    def save(self, name, data):
+        with self.conn as conn:
+            self._write(conn, name, data)
+
+    def _write(self, conn, name, data):
+        """Полная перезапись коллекции внутри открытой транзакции"""
+        if name in RECORD_COLUMNS:
+            conn.execute(f'DELETE FROM {name}')
+            for record in data:
+                self._upsert(conn, name, record)
+        elif name in STOCK_COLLECTIONS:
+            conn.execute('DELETE FROM stock WHERE collection = ?', (name,))
+            if STOCK_COLLECTIONS[name]:
+                rows = [(name, owner, item, quantity)
+                        for owner, items in data.items() for item, quantity in items.items()]
+            else:
+                rows = [(name, '', item, quantity) for item, quantity in data.items()]
+            conn.executemany('INSERT INTO stock (collection, owner, item, quantity) '
+                             'VALUES (?, ?, ?, ?)', rows)
+        else:
+            conn.execute('INSERT INTO documents (name, data) VALUES (?, ?) '
+                         'ON CONFLICT(name) DO UPDATE SET data = excluded.data',
+                         (name, json.dumps(data, ensure_ascii=False)))
+        if name in RECORD_COLUMNS or name in STOCK_COLLECTIONS:
+            self._set_meta(conn, f'init:{name}', '1')
+        self._bump(conn, name)
+
+    def _upsert(self, conn, name, record):
+        columns = RECORD_COLUMNS[name]
+        names = ', '.join(('id',) + columns + ('data',))
+        placeholders = ', '.join('?' * (len(columns) + 2))
+        updates = ', '.join(f'{column} = excluded.{column}' for column in columns + ('data',))
+        values = [record['id']] + [record.get(column) for column in columns]
+        values.append(json.dumps(record, ensure_ascii=False))
+        conn.execute(f'INSERT INTO {name} ({names}) VALUES ({placeholders}) '
+                     f'ON CONFLICT(id) DO UPDATE SET {updates}', values)
+
+    def count(self, name):
+        return self.conn.execute(f'SELECT COUNT(*) FROM {name}').fetchone()[0]
+
+    def get(self, name, record_id):
+        row = self.conn.execute(f'SELECT data FROM {name} WHERE id = ?', (record_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def query(self, name, **filters):
+        """Выборка по индексируемым колонкам"""
+        where = ' AND '.join(f'{field} = ?' for field in filters) or '1'
+        rows = self.conn.execute(f'SELECT data FROM {name} WHERE {where} ORDER BY id',
+                                 tuple(filters.values()))
+        return [json.loads(data) for data, in rows]
+
+    def insert(self, name, record):
+        with self.conn as conn:
+            self._upsert(conn, name, record)
+            self._bump(conn, name)
+
+    def patch(self, name, record_id, fields):
+        with self.conn as conn:
+            row = conn.execute(f'SELECT data FROM {name} WHERE id = ?', (record_id,)).fetchone()
+            if row is None:
+                return
+            record = json.loads(row[0])
+            record.update(fields)
+            self._upsert(conn, name, record)
+            self._bump(conn, name)
+
+    def commit(self, changes):
+        """Атомарная фиксация изменений нескольких коллекций одной транзакцией SQLite"""
+        with self.conn as conn:
+            for name, (operation, data) in changes.items():
+                if operation == 'save':
+                    self._write(conn, name, data)
+                else:
+                    for record in data:
+                        self._upsert(conn, name, record)
+                    self._bump(conn, name)
+
+    def recover(self):
+        return False
+
+    def migrate_from_json(self, json_storage):
+        """Однократный перенос данных из data/*.json в базу"""
+        if self._get_meta('migrated_from_json'):
+            return False
+        with self.conn as conn:
+            for name in json_storage.data_files:
+                if json_storage.exists(name):
+                    self._write(conn, name, json_storage.load(name))
+            self._set_meta(conn, 'migrated_from_json', '1')
+        return True
+
+
+def create_storage(backend, data_files, sqlite_path=None, journal_compact_bytes=1024 * 1024,
+                   journal_fsync=False, locks=None, snapshot_formats=None):
+    """Создание хранилища по имени из конфигурации"""
+    if backend == 'json':
+        storage = JsonStorage(data_files, locks, snapshot_formats)
+    elif backend == 'journal':
+        storage = JournalStorage(data_files, journal_compact_bytes, journal_fsync, locks, snapshot_formats)
+    elif backend == 'sqlite':
+        storage = SqliteStorage(sqlite_path)
+        json_storage = JsonStorage(data_files, locks, snapshot_formats)
+        json_storage.recover()
+        storage.migrate_from_json(json_storage)
+    else:
+        raise ValueError(f'Неизвестное хранилище данных: {backend}')
+    storage.recover()
+    return storage
+
+
+if __name__ == '__main__':
+    # Просмотр снапшота любого формата: python storage.py data/tasks.bin > tasks.json
+    if len(sys.argv) != 2:
+        print('Использование: python storage.py <файл снапшота>')
+        sys.exit(1)
+    with open(sys.argv[1], 'rb') as f:
+        blob = f.read()
+    data = decode_binary(blob) if blob.startswith(BINARY_MAGIC) else json.loads(blob)
+    print(json.dumps(data, ensure_ascii=False, indent=2))
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Нагрузочная проверка DataManager несколькими процессами
+Процессы одновременно добавляют и обновляют задачи и выдают материалы,
+после чего проверяется, что ни одно изменение не потерялось
+"""
+
+import argparse
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, REPO_DIR)
+
+MATERIAL = 'БО/16 100'
+BRIGADE = 'Бригада 1'
+
+
+def worker(backend, worker_id, count, shared_task_id):
+    """Один процесс: count задач, их обновления и обновления общей задачи"""
+    from data_manager import DataManager
+    dm = DataManager(backend)
+    for i in range(count):
+        task_id = dm.add_task({'address': f'Воркер {worker_id}, задача {i}', 'worker': worker_id})
+        dm.update_task(task_id, {'status': 'В работе', 'step': i})
+        dm.update_task(shared_task_id, {f'worker_{worker_id}': i})
+        dm.transfer_material_to_brigade(MATERIAL, 1, BRIGADE)
+
+
+def run(backend, processes, count):
+    """Запуск проверки во временном каталоге данных; возвращает список ошибок"""
+    from data_manager import DataManager
+    dm = DataManager(backend)
+    shared_task_id = dm.add_task({'address': 'Общая задача'})
+    stock_before = dm.load_data('materials')[MATERIAL]
+
+    started = time.time()
+    workers = [multiprocessing.Process(target=worker, args=(backend, n, count, shared_task_id))
+               for n in range(processes)]
+    for p in workers:
+        p.start()
+    for p in workers:
+        p.join()
+    elapsed = time.time() - started
+
+    errors = [f'Процесс {p.pid} завершился с кодом {p.exitcode}' for p in workers if p.exitcode]
+    dm = DataManager(backend)
+    tasks = [t for t in dm.load_data('tasks') if 'worker' in t]
+    ids = [t['id'] for t in tasks]
+    if len(tasks) != processes * count:
+        errors.append(f'Задач {len(tasks)}, ожидалось {processes * count}')
+    if len(set(ids)) != len(ids):
+        errors.append('Повторяющиеся id задач')
+    lost = [t['id'] for t in tasks if t.get('status') != 'В работе' or 'step' not in t]
+    if lost:
+        errors.append(f'Потеряны обновления задач: {lost[:10]}')
+    shared = dm.get_task(shared_task_id)
+    for n in range(processes):
+        if shared.get(f'worker_{n}') != count - 1:
+            errors.append(f'Общая задача: потеряно обновление процесса {n}')
+    transferred = processes * count
+    if dm.load_data('materials')[MATERIAL] != stock_before - transferred:
+        errors.append('Остаток на складе не сходится')
+    if dm.load_data('brigade_materials')[BRIGADE][MATERIAL] != transferred:
+        errors.append('Остаток у бригады не сходится')
+    if len(dm.load_data('warehouse_log')) != transferred:
+        errors.append('Количество записей лога склада не сходится')
+
+    operations = processes * count * 4
+    print(f'{backend}: {processes} процессов x {count} итераций, '
+          f'{operations} операций за {elapsed:.2f} с ({operations / elapsed:.0f} оп/с)')
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочная проверка DataManager')
+    parser.add_argument('--processes', type=int, default=8)
+    parser.add_argument('--count', type=int, default=25)
+    parser.add_argument('--backend', action='append', choices=['json', 'journal', 'sqlite'])
+    args = parser.parse_args()
+
+    failed = False
+    for backend in args.backend or ['json', 'journal', 'sqlite']:
+        work_dir = tempfile.mkdtemp(prefix='awr_stress_')
+        os.chdir(work_dir)
+        try:
+            errors = run(backend, args.processes, args.count)
+        finally:
+            os.chdir(REPO_DIR)
+            shutil.rmtree(work_dir)
+        for error in errors:
+            print(f'❌ {error}')
+        failed = failed or bool(errors)
+    if failed:
+        sys.exit(1)
+    print('✅ Потерянных обновлений нет')
+
+
+if __name__ == '__main__':
+    main()
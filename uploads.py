@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+Возобновляемая загрузка фото отчета частями
+При плохой связи фото не отправляются одним запросом вместе с формой: для каждого
+файла открывается сессия загрузки, файл передается частями по UPLOAD_CHUNK_SIZE,
+после обрыва клиент узнает, сколько байт уже принято, и продолжает с этого места.
+Завершенная загрузка проверяется и получает имя по хешу (photos.py), а при отправке
+формы отчета с тем же submit_key ее файл переходит в обработку (report_jobs.py).
+
+    POST /api/uploads                    {task_id, submit_key, filename, size}
+    GET  /api/uploads/<key>/<id>         сколько байт принято (offset)
+    PUT  /api/uploads/<key>/<id>/<n>     часть номер n (с нуля)
+    POST /api/uploads/<key>/<id>/complete
+    DELETE /api/uploads/<key>/<id>       отмена загрузки
+
+Сессии одного отчета лежат в UPLOAD_SESSIONS_DIR/<submit_key>/: <id>.json и
+принимаемый файл <id>.part (после завершения — <id>.photo). Сессии отчетов,
+которые так и не отправили, удаляются через UPLOAD_SESSION_TTL:
+    python uploads.py cleanup
+"""
+
+import json
+import logging
+import os
+import re
+import shutil
+import sys
+import threading
+import time
+import uuid
+
+from config import (UPLOAD_SESSIONS_DIR, UPLOAD_CHUNK_SIZE, UPLOAD_SESSION_TTL, PHOTO_MAX_FILE_SIZE,
+                    REPORT_MAX_PHOTOS, REPORT_MAX_UPLOAD_SIZE, PHOTOS_INCOMING_DIR)
+from photos import CHUNK_SIZE, check_photo, file_digest, photo_name
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировки между процессами недоступны
+    fcntl = None
+
+# submit_key формы отчета и id сессии — uuid4().hex
+KEY = re.compile(r'[0-9a-f]{32}')
+
+
+class UploadError(ValueError):
+    """Запрос к сессии загрузки отклонен; status — код ответа HTTP"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class IncompleteUploads(UploadError):
+    """Форма отчета отправлена, пока не все его фото загружены; sessions — состояния этих
+    загрузок (с filename), по которым клиент продолжает их под тем же submit_key"""
+
+    def __init__(self, sessions):
+        super().__init__(f"Фото загружены не полностью: {', '.join(s['filename'] for s in sessions)}", 409)
+        self.sessions = sessions
+
+
+def _lock(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+
+
+class UploadSessions:
+    """Сессии загрузки фото частями; состояние хранится в файлах и общее для воркеров serve.py"""
+
+    def __init__(self, sessions_dir=UPLOAD_SESSIONS_DIR, chunk_size=UPLOAD_CHUNK_SIZE,
+                 max_file_size=PHOTO_MAX_FILE_SIZE, max_photos=REPORT_MAX_PHOTOS,
+                 max_report_size=REPORT_MAX_UPLOAD_SIZE, ttl=UPLOAD_SESSION_TTL):
+        self.sessions_dir = sessions_dir
+        self.chunk_size = chunk_size
+        self.max_file_size = max_file_size
+        self.max_photos = max_photos
+        self.max_report_size = max_report_size
+        self.ttl = ttl
+        self._cleaned = 0
+        self._cleanup_lock = threading.Lock()
+        os.makedirs(sessions_dir, exist_ok=True)
+
+    def _path(self, key, upload_id, suffix):
+        if not KEY.fullmatch(key) or not KEY.fullmatch(upload_id):
+            return None
+        return os.path.join(self.sessions_dir, key, f'{upload_id}{suffix}')
+
+    def _report_lock(self, key):
+        """Эксклюзивная блокировка сессий отчета (файл держать открытым до конца операции)"""
+        f = open(os.path.join(self.sessions_dir, key, '.lock'), 'a+b')
+        _lock(f)
+        return f
+
+    def _save(self, session):
+        path = self._path(session['key'], session['id'], '.json')
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(session, f, ensure_ascii=False)
+        os.replace(path + '.tmp', path)
+
+    def _sessions(self, key):
+        directory = os.path.join(self.sessions_dir, key)
+        sessions = []
+        for filename in sorted(os.listdir(directory)):
+            if filename.endswith('.json'):
+                with open(os.path.join(directory, filename), encoding='utf-8') as f:
+                    sessions.append(json.load(f))
+        return sessions
+
+    def create(self, user, task_id, key, filename, size):
+        """Новая сессия загрузки файла filename размером size байт для отчета key"""
+        if not KEY.fullmatch(key or ''):
+            raise UploadError('Некорректный ключ отчета')
+        if size <= 0 or size > self.max_file_size:
+            raise UploadError(f'Размер фото — до {self.max_file_size // (1024 * 1024)} МБ', 413)
+        self.cleanup(force=False)
+        os.makedirs(os.path.join(self.sessions_dir, key), exist_ok=True)
+        with self._report_lock(key):
+            sessions = self._sessions(key)
+            if any(session['user'] != user or session['task_id'] != task_id for session in sessions):
+                raise UploadError('Ключ отчета принадлежит другому отчету', 403)
+            if len(sessions) >= self.max_photos:
+                raise UploadError(f'В отчете не больше {self.max_photos} фото', 413)
+            if sum(session['size'] for session in sessions) + size > self.max_report_size:
+                raise UploadError(f'Фото отчета — не больше {self.max_report_size // (1024 * 1024)} МБ', 413)
+            session = {'id': uuid.uuid4().hex, 'key': key, 'user': user, 'task_id': task_id,
+                       'filename': filename, 'size': size, 'chunk_size': self.chunk_size,
+                       'created': time.time(), 'name': None}
+            open(self._path(key, session['id'], '.part'), 'wb').close()
+            self._save(session)
+        return self.status(session)
+
+    def get(self, key, upload_id):
+        """Сессия или None"""
+        path = self._path(key, upload_id, '.json')
+        try:
+            with open(path, encoding='utf-8') as f:
+                return json.load(f)
+        except (TypeError, FileNotFoundError):
+            return None
+
+    def status(self, session):
+        """Состояние для клиента: принято offset байт из size, следующая часть next_chunk"""
+        if session['name']:
+            offset = session['size']
+        else:
+            try:
+                offset = os.path.getsize(self._path(session['key'], session['id'], '.part'))
+            except FileNotFoundError:
+                offset = session['size']  # файл уже перенесен: загрузка завершена
+        return {'id': session['id'], 'size': session['size'], 'chunk_size': session['chunk_size'],
+                'offset': offset, 'next_chunk': offset // session['chunk_size'],
+                'complete': session['name'] is not None, 'name': session['name']}
+
+    def write_chunk(self, session, index, stream, length):
+        """Запись части index из потока stream (length байт) прямо в файл; возвращает offset.
+
+        Части принимаются по порядку. Повтор уже принятой части (ответ потерялся при
+        обрыве) ничего не меняет; часть дальше принятого отклоняется с кодом 409.
+        Оборванная посреди части запись откатывается, и offset остается кратным части.
+        """
+        chunk_size = session['chunk_size']
+        start = index * chunk_size
+        if index < 0 or start >= session['size']:
+            raise UploadError('Номер части вне файла')
+        expected = min(chunk_size, session['size'] - start)
+        if length != expected:
+            raise UploadError(f'Часть {index} должна быть {expected} байт')
+        try:
+            f = open(self._path(session['key'], session['id'], '.part'), 'r+b')
+        except FileNotFoundError:
+            return session['size']  # загрузка уже завершена
+        with f:
+            _lock(f)
+            offset = f.seek(0, os.SEEK_END)
+            if start < offset:
+                return offset
+            if start > offset:
+                raise UploadError(f'Ожидается часть {offset // chunk_size}', 409)
+            try:
+                received = 0
+                while received < length:
+                    data = stream.read(min(CHUNK_SIZE, length - received))
+                    if not data:
+                        raise UploadError(f'Часть {index} получена не полностью')
+                    f.write(data)
+                    received += len(data)
+                f.flush()
+                os.fsync(f.fileno())
+            except BaseException:
+                f.truncate(offset)
+                raise
+            return offset + length
+
+    def complete(self, session):
+        """Проверка полностью принятого файла и имя по хешу; возвращает состояние сессии"""
+        part = self._path(session['key'], session['id'], '.part')
+        with self._report_lock(session['key']):
+            session = self.get(session['key'], session['id'])
+            if session is None:
+                raise UploadError('Сессия загрузки не найдена', 404)
+            if session['name']:
+                return self.status(session)
+            with open(part, 'rb') as f:
+                _lock(f)
+                size = f.seek(0, os.SEEK_END)
+                if size != session['size']:
+                    raise UploadError(f'Принято {size} из {session["size"]} байт', 409)
+                f.seek(0)
+                check_photo(f)
+            digest = file_digest(part)
+            os.replace(part, self._path(session['key'], session['id'], '.photo'))
+            session['digest'] = digest
+            session['name'] = photo_name(digest)
+            self._save(session)
+        return self.status(session)
+
+    def delete(self, session):
+        """Отмена загрузки (фото убрано из формы)"""
+        with self._report_lock(session['key']):
+            for suffix in ('.json', '.part', '.photo'):
+                try:
+                    os.remove(self._path(session['key'], session['id'], suffix))
+                except FileNotFoundError:
+                    pass
+
+    def take(self, key, user, task_id, incoming_dir=PHOTOS_INCOMING_DIR):
+        """Загрузки отчета key: [(путь в incoming_dir, имя фото)]; сессии отчета удаляются.
+
+        Файлы переносятся в incoming_dir под именем хеша, как при receive_photo.
+        Если какая-то загрузка не завершена, ничего не переносится и не удаляется,
+        а выбрасывается IncompleteUploads — клиент продолжает загрузку и отправляет форму снова.
+        """
+        directory = os.path.join(self.sessions_dir, key or '')
+        if not KEY.fullmatch(key or '') or not os.path.isdir(directory):
+            return []
+        photos = []
+        with self._report_lock(key):
+            sessions = self._sessions(key)
+            for session in sessions:
+                if session['user'] != user or session['task_id'] != task_id:
+                    raise UploadError('Ключ отчета принадлежит другому отчету', 403)
+            incomplete = [dict(self.status(session), filename=session['filename'])
+                          for session in sessions if not session['name']]
+            if incomplete:
+                logging.warning(f"Отчет {key} отправлен до завершения загрузок: "
+                                f"{', '.join(session['filename'] for session in incomplete)}")
+                raise IncompleteUploads(incomplete)
+            for session in sessions:
+                path = os.path.join(incoming_dir, session['digest'])
+                os.replace(self._path(key, session['id'], '.photo'), path)
+                photos.append((path, session['name']))
+            shutil.rmtree(directory)
+        return photos
+
+    def cleanup(self, force=True):
+        """Удаление сессий отчетов старше ttl; без force — не чаще раза в час на процесс"""
+        now = time.time()
+        with self._cleanup_lock:
+            if not force and now - self._cleaned < 3600:
+                return 0
+            self._cleaned = now
+        removed = 0
+        for key in os.listdir(self.sessions_dir):
+            directory = os.path.join(self.sessions_dir, key)
+            try:
+                modified = max(os.path.getmtime(os.path.join(directory, filename))
+                               for filename in os.listdir(directory))
+            except (OSError, ValueError):
+                continue
+            if now - modified > self.ttl:
+                shutil.rmtree(directory, ignore_errors=True)
+                removed += 1
+        return removed
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 2 and sys.argv[1] == 'cleanup':
+        print(f'Удалено сессий отчетов: {UploadSessions().cleanup()}')
+    else:
+        print('Использование:\n'
+              '  python uploads.py cleanup    # удалить сессии неотправленных отчетов')
+        sys.exit(1)